@@ -0,0 +1,165 @@
+"""
+landsat_cogeo_mosaic.cache: Cache STAC API responses on disk
+"""
+import json
+import os
+import sqlite3
+import time
+import zlib
+from pathlib import Path
+from threading import Lock
+from typing import Dict, Optional
+
+from landsat_cogeo_mosaic.util import get_hash
+
+# Responses older than this many seconds are fetched again
+CACHE_TTL = 24 * 60 * 60
+
+# Max total compressed size of cached responses in bytes
+CACHE_MAX_SIZE = 512 * 2**20
+
+# File name of cache database within cache directory
+CACHE_FILE_NAME = 'stac_responses.sqlite'
+
+CREATE_CACHE_TABLE_SQL = """\
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    created REAL NOT NULL,
+    accessed REAL NOT NULL,
+    size INTEGER NOT NULL,
+    data BLOB NOT NULL
+)"""
+
+CREATE_CACHE_INDEX_SQL = """\
+CREATE INDEX IF NOT EXISTS responses_accessed_idx ON responses (accessed)"""
+
+
+def default_cache_dir() -> str:
+    """Get default cache directory, within XDG_CACHE_HOME or ~/.cache
+    """
+    cache_home = os.environ.get('XDG_CACHE_HOME') or Path.home() / '.cache'
+    return str(Path(cache_home) / 'landsat-cogeo-mosaic')
+
+
+def response_key(url: str, query: Dict) -> str:
+    """Create cache key of page of query
+
+    Args:
+        - url: search endpoint
+        - query: STAC API search query, with or without page
+    """
+    page = int(query.get('page') or 1)
+    query = {k: v for k, v in query.items() if k != 'page'}
+    return get_hash(url=url, query=query, page=page)
+
+
+class ResponseCache:
+    """Cache of STAC API responses in SQLite database
+
+    Responses are stored zlib-compressed JSON. Entries expire after `ttl`
+    seconds, and the least recently used entries are evicted when the total
+    size is above `max_size`. The cache may be shared between threads and
+    processes.
+    """
+    def __init__(
+            self,
+            cache_dir: Optional[str] = None,
+            ttl: float = CACHE_TTL,
+            max_size: int = CACHE_MAX_SIZE):
+        """
+        Args:
+            - cache_dir: directory of cache database. Created if it doesn't
+              exist. Defaults to `default_cache_dir()`.
+            - ttl: seconds until entries expire
+            - max_size: max total size of entries in bytes
+        """
+        cache_dir = Path(cache_dir or default_cache_dir())
+        cache_dir.mkdir(parents=True, exist_ok=True)
+
+        self.path = cache_dir / CACHE_FILE_NAME
+        self.ttl = ttl
+        self.max_size = max_size
+        self._lock = Lock()
+
+        self.conn = sqlite3.connect(
+            str(self.path),
+            timeout=30,
+            isolation_level=None,
+            check_same_thread=False)
+        self.conn.execute(CREATE_CACHE_TABLE_SQL)
+        self.conn.execute(CREATE_CACHE_INDEX_SQL)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.conn.close()
+
+    def get(self, key: str) -> Optional[Dict]:
+        """Get cached response
+
+        Args:
+            - key: key from `response_key`
+
+        Returns:
+            response data, or None if not cached or expired
+        """
+        now = time.time()
+        with self._lock:
+            row = self.conn.execute(
+                'SELECT data FROM responses WHERE key = ? AND created > ?',
+                (key, now - self.ttl)).fetchone()
+            if row is None:
+                return None
+
+            self.conn.execute(
+                'UPDATE responses SET accessed = ? WHERE key = ?', (now, key))
+
+        return json.loads(zlib.decompress(row[0]))
+
+    def put(self, key: str, data: Dict):
+        """Cache response, evicting expired and least recently used entries
+
+        Args:
+            - key: key from `response_key`
+            - data: response data
+        """
+        blob = zlib.compress(json.dumps(data, separators=(',', ':')).encode())
+        now = time.time()
+        with self._lock:
+            self.conn.execute('BEGIN IMMEDIATE')
+            try:
+                self.conn.execute(
+                    'INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)',
+                    (key, now, now, len(blob), blob))
+                self.conn.execute(
+                    'DELETE FROM responses WHERE created <= ?',
+                    (now - self.ttl, ))
+                self._evict()
+                self.conn.execute('COMMIT')
+            except BaseException:
+                self.conn.execute('ROLLBACK')
+                raise
+
+    def _evict(self):
+        """Delete least recently used entries until total size is below max
+        """
+        total_size = self.conn.execute(
+            'SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+        if total_size <= self.max_size:
+            return
+
+        rows = self.conn.execute(
+            'SELECT key, size FROM responses ORDER BY accessed')
+        evict = []
+        for key, size in rows:
+            if total_size <= self.max_size:
+                break
+
+            evict.append((key, ))
+            total_size -= size
+
+        self.conn.executemany('DELETE FROM responses WHERE key = ?', evict)
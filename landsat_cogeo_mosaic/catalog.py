@@ -0,0 +1,469 @@
+"""
+landsat_cogeo_mosaic.catalog: Columnar catalog of scenes, selecting the best
+scene of many pathrows with array operations
+"""
+import gzip
+import os
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+
+import numpy as np
+
+from landsat_cogeo_mosaic.db import (
+    SceneDB, connect, format_pathrow, iter_scenes, parse_scene_list,
+    relax_thresholds)
+from landsat_cogeo_mosaic.selection import date_range_ts
+from landsat_cogeo_mosaic.util import (
+    coerce_to_datetime, has_magic, midpoint_date, open_arrays, save_arrays)
+
+# First bytes of catalog files: magic and format version
+CATALOG_MAGIC = b'LSCAT\x00\x00\x01'
+
+# Arrays of catalog files, in order, with their little-endian dtypes
+CATALOG_ARRAYS = {
+    'pathrows': '<i4',
+    'pathrow_offsets': '<i8',
+    'pathrow': '<i4',
+    'acquisition_ts': '<i8',
+    'cloud_cover': '<f4',
+    'tier': 'u1',
+    'scene_rowid': '<i8',
+    'product_id_offsets': '<i8',
+    'product_id_data': 'u1',
+}
+
+# First bytes of SQLite database files
+SQLITE_MAGIC = b'SQLite format 3\x00'
+
+
+class SceneCatalog:
+    """Columnar catalog of scenes
+
+    Scenes are stored as arrays sorted by pathrow and rowid, with an offsets
+    table giving the range of scenes of each pathrow. Product ids are stored
+    as one bytes string and an array of offsets into it.
+
+    Catalogs are loaded into memory from a database with `from_db`, or from
+    the scene_list CSV with `from_scene_list`. `save` writes them to a binary
+    file, which `open` memory-maps, so that selecting assets for some
+    pathrows only reads the pages of their scenes.
+
+    `select` chooses the same scenes as `mosaic.select_assets` on the database
+    the catalog was loaded from. Cloud cover is stored as float32, so scenes
+    whose cloud cover differs by less than float32 precision are tied, and
+    the tie is broken by tier and rowid.
+
+    Attributes:
+        - pathrow: int32 pathrow of each scene, as path * 1000 + row
+        - acquisition_ts: int64 seconds since epoch
+        - cloud_cover: float32 cloud cover percent
+        - tier: uint8 index into `tiers`
+        - scene_rowid: int64 rowid of scene in database
+        - product_id_offsets: int64 offsets of product ids in
+          `product_id_data`, with one more element than scenes
+        - product_id_data: ASCII product ids, concatenated, as bytes or
+          uint8 array
+        - tiers: list of tier names
+        - pathrows: int32 unique pathrows, sorted
+        - pathrow_offsets: int64 index of first scene of each pathrow, with
+          one more element than pathrows
+        - watermark: dict with `rowid` of last inserted scene and newest
+          `acquisition_date`, like `db.find_watermark`
+    """
+    def __init__(
+            self, pathrow: np.ndarray, acquisition_ts: np.ndarray,
+            cloud_cover: np.ndarray, tier: np.ndarray,
+            scene_rowid: np.ndarray, product_id_offsets: np.ndarray,
+            product_id_data: Union[bytes, np.ndarray], tiers: List[str],
+            pathrows: Optional[np.ndarray] = None,
+            pathrow_offsets: Optional[np.ndarray] = None,
+            watermark: Optional[Dict] = None):
+        """
+        Args:
+            - arrays of scenes, already sorted by pathrow and rowid. See
+              class attributes. pathrows, pathrow_offsets and watermark are
+              computed if not given.
+        """
+        self.pathrow = pathrow
+        self.acquisition_ts = acquisition_ts
+        self.cloud_cover = cloud_cover
+        self.tier = tier
+        self.scene_rowid = scene_rowid
+        self.product_id_offsets = product_id_offsets
+        self.product_id_data = product_id_data
+        self.tiers = list(tiers)
+
+        if pathrows is None or pathrow_offsets is None:
+            pathrows, starts = np.unique(pathrow, return_index=True)
+            pathrow_offsets = np.append(starts, len(pathrow)).astype(np.int64)
+
+        self.pathrows = pathrows
+        self.pathrow_offsets = pathrow_offsets
+
+        if watermark is None:
+            watermark = {'rowid': None, 'acquisition_date': None}
+            if len(pathrow):
+                max_date = datetime.fromtimestamp(
+                    int(acquisition_ts.max()), timezone.utc)
+                watermark = {
+                    'rowid': int(scene_rowid.max()),
+                    'acquisition_date': datetime.strftime(max_date, '%Y-%m-%d')}
+
+        self.watermark = watermark
+
+    def __len__(self):
+        return len(self.pathrow)
+
+    @classmethod
+    def from_db(cls, db: Union[SceneDB, str, Path]) -> 'SceneCatalog':
+        """Load all scenes of database
+
+        Args:
+            - db: Path to sqlite database or open db.SceneDB
+        """
+        if not isinstance(db, SceneDB):
+            db = connect(db)
+
+        return cls.from_scenes(iter_scenes(db))
+
+    @classmethod
+    def from_scene_list(cls, scene_path) -> 'SceneCatalog':
+        """Load all scenes of scene_list CSV
+
+        Scenes get the rowid they would have in a database created by
+        `db.prepare_db` from the same file, so the catalog selects the same
+        scenes as that database.
+
+        Args:
+            - scene_path: path to scene_list or scene_list.gz from AWS S3
+        """
+        file_opener = gzip.open if str(scene_path).endswith('.gz') else open
+        with file_opener(scene_path, 'rt', newline='') as f:
+            # Columns pathrow, productId, acquisition_ts, cloudCover, tier
+            # and rowid of rows of scene_list table
+            scenes = (
+                (row[12], row[0], row[13], row[3], row[14], rowid)
+                for rowid, row in enumerate(parse_scene_list(f), start=1))
+            return cls.from_scenes(scenes)
+
+    @classmethod
+    def from_scenes(cls, scenes: Iterable[Tuple]) -> 'SceneCatalog':
+        """Load scenes in any order
+
+        Args:
+            - scenes: tuples of pathrow, productId, acquisition_ts,
+              cloudCover, tier and rowid, like records of `db.iter_scenes`
+        """
+        pathrow = []
+        acquisition_ts = []
+        cloud_cover = []
+        tier = []
+        scene_rowid = []
+        product_ids = []
+        tier_codes = {}
+        for (scene_pathrow, product_id, scene_ts, scene_cloud_cover,
+             scene_tier, rowid) in scenes:
+            pathrow.append(int(scene_pathrow))
+            acquisition_ts.append(scene_ts)
+            cloud_cover.append(scene_cloud_cover)
+            tier.append(tier_codes.setdefault(scene_tier, len(tier_codes)))
+            scene_rowid.append(rowid)
+            product_ids.append(product_id.encode('ascii'))
+
+        pathrow = np.array(pathrow, dtype=np.int32)
+        scene_rowid = np.array(scene_rowid, dtype=np.int64)
+        order = np.lexsort((scene_rowid, pathrow))
+
+        product_ids = [product_ids[ind] for ind in order]
+        product_id_offsets = np.zeros(len(product_ids) + 1, dtype=np.int64)
+        np.cumsum(
+            [len(product_id) for product_id in product_ids],
+            out=product_id_offsets[1:])
+
+        return cls(
+            pathrow=pathrow[order],
+            acquisition_ts=np.array(acquisition_ts, dtype=np.int64)[order],
+            cloud_cover=np.array(cloud_cover, dtype=np.float32)[order],
+            tier=np.array(tier, dtype=np.uint8)[order],
+            scene_rowid=scene_rowid[order],
+            product_id_offsets=product_id_offsets,
+            product_id_data=b''.join(product_ids),
+            tiers=list(tier_codes))
+
+    @classmethod
+    def open(cls, path) -> 'SceneCatalog':
+        """Memory-map catalog file written by `save`
+
+        Only the header is read. Arrays are views of one read-only memory map,
+        so pages are read from disk when they're first used.
+
+        Args:
+            - path: path to catalog file
+        """
+        header, arrays = open_arrays(path, CATALOG_MAGIC, CATALOG_ARRAYS)
+        return cls(
+            tiers=header['tiers'], watermark=header['watermark'], **arrays)
+
+    def save(self, path):
+        """Write catalog to binary file
+
+        The file has the tiers, watermark and arrays of `CATALOG_ARRAYS`;
+        see `util.save_arrays`.
+
+        Args:
+            - path: path of new catalog file. Overwrites existing file.
+        """
+        arrays = {name: getattr(self, name) for name in CATALOG_ARRAYS}
+        arrays['product_id_data'] = np.frombuffer(
+            self.product_id_data, dtype=np.uint8)
+        save_arrays(
+            path,
+            CATALOG_MAGIC,
+            CATALOG_ARRAYS,
+            arrays,
+            tiers=self.tiers,
+            watermark=self.watermark)
+
+    def product_id(self, ind: int) -> str:
+        """Get product id of scene
+
+        Args:
+            - ind: index of scene
+        """
+        start, end = self.product_id_offsets[ind:ind + 2]
+        return bytes(self.product_id_data[start:end]).decode('ascii')
+
+    def scene_indices(
+            self, pathrows: Optional[Iterable[str]] = None) -> np.ndarray:
+        """Get indices of scenes of pathrows
+
+        Args:
+            - pathrows: 6-character pathrows. If None, all scenes.
+
+        Returns:
+            sorted array of indices of scenes
+        """
+        if pathrows is None:
+            return np.arange(len(self), dtype=np.int64)
+
+        pathrows = np.unique(np.array([int(x) for x in pathrows], dtype=np.int32))
+        inds = np.searchsorted(self.pathrows, pathrows)
+        found = inds < len(self.pathrows)
+        found[found] = self.pathrows[inds[found]] == pathrows[found]
+        inds = inds[found]
+
+        starts = self.pathrow_offsets[inds]
+        counts = self.pathrow_offsets[inds + 1] - starts
+        if not len(counts):
+            return np.zeros(0, dtype=np.int64)
+
+        # Concatenated ranges of [start, start + count)
+        group_starts = np.repeat(starts - np.cumsum(counts) + counts, counts)
+        return group_starts + np.arange(counts.sum(), dtype=np.int64)
+
+    def select(
+            self, pathrows: Optional[Iterable[str]] = None,
+            **kwargs) -> Dict[str, Tuple[str, int]]:
+        """Select asset for many pathrows, relaxing parameters where necessary
+
+        Args:
+            - pathrows: pathrows to select assets for. All pathrows if None.
+            - kwargs: Arguments passed to rank_scenes
+
+        Returns:
+            dict of {pathrow: (productId, relax_tier)}, like
+            `mosaic.select_assets`
+        """
+        inds = self.scene_indices(pathrows)
+        tier_rank = tier_ranks(
+            self.tiers, kwargs.pop('tier_preference', ['T1', 'T2', 'RT']))
+        selectable, relax_tier, preference = rank_scenes(
+            acquisition_ts=self.acquisition_ts[inds],
+            cloud_cover=self.cloud_cover[inds],
+            **kwargs)
+
+        inds = inds[selectable]
+        if not len(inds):
+            return {}
+
+        relax_tier = relax_tier[selectable]
+        preference = preference[selectable]
+        pathrow = self.pathrow[inds]
+
+        # Sort by pathrow, then by the same order as db._order_clause, and
+        # keep the first scene of each pathrow
+        order = np.lexsort((
+            self.scene_rowid[inds], tier_rank[self.tier[inds]], preference,
+            relax_tier, pathrow))
+        pathrow = pathrow[order]
+        first = np.flatnonzero(np.r_[True, pathrow[1:] != pathrow[:-1]])
+        best = order[first]
+
+        return {
+            format_pathrow(int(pathrow)): (self.product_id(ind), int(tier))
+            for pathrow, ind, tier in zip(
+                self.pathrow[inds[best]], inds[best], relax_tier[best])}
+
+
+# Catalogs loaded through `load_catalog`, keyed by resolved path, with the
+# modification time and size of the file when they were loaded
+_catalogs: Dict[str, Tuple[Tuple[int, int], SceneCatalog]] = {}
+
+
+def load_catalog(path) -> SceneCatalog:
+    """Get shared catalog of database or catalog file
+
+    Catalogs are kept for the life of the process, so that repeated builds
+    load the database only once. A catalog is loaded again once the
+    modification time or size of its file changes, e.g. after `harvest` or
+    `prepare_db` write to the database.
+
+    Args:
+        - path: Path to sqlite database, or to catalog file written by
+          `SceneCatalog.save`, which is memory-mapped
+    """
+    key = str(Path(path).resolve())
+    stat = os.stat(key)
+    version = (stat.st_mtime_ns, stat.st_size)
+
+    cached = _catalogs.get(key)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+
+    if is_catalog_file(path):
+        catalog = SceneCatalog.open(path)
+    else:
+        catalog = SceneCatalog.from_db(path)
+
+    _catalogs[key] = (version, catalog)
+    return catalog
+
+
+def is_catalog_file(path) -> bool:
+    """Check whether file is a catalog file written by `SceneCatalog.save`
+    """
+    return has_magic(path, CATALOG_MAGIC)
+
+
+def prepare_catalog(scene_path, catalog_path):
+    """Create catalog file of Landsat scenes
+
+    Args:
+        - scene_path: path to scene_list or scene_list.gz from AWS S3, or to
+          sqlite database of scenes
+        - catalog_path: path for new catalog file. Overwrites existing file.
+    """
+    if has_magic(scene_path, SQLITE_MAGIC):
+        catalog = SceneCatalog.from_db(scene_path)
+    else:
+        catalog = SceneCatalog.from_scene_list(scene_path)
+
+    catalog.save(catalog_path)
+
+
+def tier_ranks(tiers: List[str],
+               tier_preference: Optional[List[str]]) -> np.ndarray:
+    """Rank of each tier in tier preference
+
+    Like `CASE tier WHEN ... END` in SQL, tiers not in the preference sort
+    first.
+
+    Args:
+        - tiers: tier names
+        - tier_preference: preference of tiers
+
+    Returns:
+        int array with rank of each tier
+    """
+    ranks = {tier: ind for ind, tier in enumerate(tier_preference or [])}
+    default_rank = -1 if tier_preference else 0
+    return np.array(
+        [ranks.get(tier, default_rank) for tier in tiers] or [0],
+        dtype=np.int64)
+
+
+def rank_scenes(
+        acquisition_ts: np.ndarray,
+        cloud_cover: np.ndarray,
+        max_cloud: float = 10,
+        min_date: str = None,
+        max_date: str = None,
+        sort_preference: Optional[str] = None,
+        closest_to_date: Optional[Union[datetime, str]] = None
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Rank scenes like `db.generate_query(relax=True)`
+
+    Vectorized version of `selection.scene_ranker`.
+
+    Args:
+        - acquisition_ts: seconds since epoch of scenes
+        - cloud_cover: cloud cover of scenes
+        - max_cloud: maximum cloud cover percent. Range from 0-100.
+        - min_date: min date as str: 'YYYY-MM-DD'
+        - max_date: max date as str: 'YYYY-MM-DD'
+        - sort_preference: preference for selecting pathrow
+        - closest_to_date: datetime used for comparisons when preference is closest-to-date. Must be datetime or str of format YYYY-MM-DD
+
+    Returns:
+        tuple of arrays (selectable, relax_tier, preference). The best scene
+        is the selectable scene with the smallest relax_tier, then the
+        smallest preference value.
+    """
+    thresholds = np.array(
+        relax_thresholds(max_cloud), dtype=cloud_cover.dtype)
+    midpoint_tier = len(thresholds)
+    use_midpoint = sort_preference != 'closest-to-date'
+
+    min_ts, max_ts = date_range_ts(min_date, max_date)
+    in_range = np.ones(len(acquisition_ts), dtype=bool)
+    if min_ts is not None:
+        in_range &= acquisition_ts >= min_ts
+    if max_ts is not None:
+        in_range &= acquisition_ts < max_ts
+
+    # Same conditions as the where clause of db._candidates_query
+    below_max = cloud_cover <= thresholds[-1]
+    if max_cloud:
+        selectable = below_max & (in_range | use_midpoint)
+        # Index of first threshold the scene passes
+        relax_tier = np.searchsorted(thresholds, cloud_cover)
+    else:
+        selectable = in_range | (use_midpoint & below_max)
+        relax_tier = np.zeros(len(cloud_cover), dtype=np.int64)
+
+    preference = _preference_values(
+        acquisition_ts, cloud_cover, sort_preference, closest_to_date)
+    if use_midpoint:
+        midpoint = _preference_values(
+            acquisition_ts, cloud_cover, 'closest-to-date',
+            midpoint_date(min_date=min_date, max_date=max_date))
+        relax_tier = np.where(in_range, relax_tier, midpoint_tier)
+        preference = np.where(in_range, preference, midpoint)
+
+    return selectable, relax_tier, preference
+
+
+def _preference_values(
+        acquisition_ts: np.ndarray,
+        cloud_cover: np.ndarray,
+        sort_preference: Optional[str] = None,
+        closest_to_date: Optional[Union[datetime, str]] = None) -> np.ndarray:
+    """Order value of scenes for sort preference, smallest first
+    """
+    if sort_preference == 'min-cloud':
+        return cloud_cover.astype(np.float64)
+
+    if sort_preference == 'newest':
+        return -acquisition_ts.astype(np.float64)
+
+    if sort_preference == 'oldest':
+        return acquisition_ts.astype(np.float64)
+
+    if sort_preference == 'closest-to-date':
+        closest_to_date_timestamp = round(
+            coerce_to_datetime(closest_to_date).timestamp())
+        return np.abs(
+            closest_to_date_timestamp - acquisition_ts).astype(np.float64)
+
+    raise ValueError('sort_preference not supported')
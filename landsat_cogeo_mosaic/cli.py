@@ -1,3 +1,4 @@
+import gzip
 import json
 import re
 import sys
@@ -6,14 +7,25 @@ from pathlib import Path
 
 import click
 
+from landsat_cogeo_mosaic.cache import ResponseCache
+from landsat_cogeo_mosaic.catalog import prepare_catalog as _prepare_catalog
+from landsat_cogeo_mosaic.db import prepare_db as _prepare_db
 from landsat_cogeo_mosaic.grid import generate_grid
+from landsat_cogeo_mosaic.harvest import harvest as _harvest
 from landsat_cogeo_mosaic.index import create_index
+from landsat_cogeo_mosaic.mosaic import \
+    create_batch_from_db as _create_batch_from_db
 from landsat_cogeo_mosaic.mosaic import create_from_db as _create_from_db
 from landsat_cogeo_mosaic.mosaic import features_to_mosaicJSON
-from landsat_cogeo_mosaic.stac import search as _search
-from landsat_cogeo_mosaic.util import filter_season, load_index_data
+from landsat_cogeo_mosaic.mosaic import update_from_db as _update_from_db
+from landsat_cogeo_mosaic.stac import create_session
+from landsat_cogeo_mosaic.stac import search_pages as _search_pages
+from landsat_cogeo_mosaic.util import (
+    PathrowIndex, filter_features, load_index_data)
 from landsat_cogeo_mosaic.validate import missing_quadkeys as _missing_quadkeys
+from landsat_cogeo_mosaic.validate import mosaic_stats as _mosaic_stats
 from landsat_cogeo_mosaic.visualize import visualize as _visualize
+from landsat_cogeo_mosaic.writer import save_mosaic
 
 
 @click.group()
@@ -87,13 +99,43 @@ def main():
     default=500,
     show_default=True,
     help='Limits the number of items per page returned by sat-api.')
+@click.option(
+    '--retries',
+    type=int,
+    default=3,
+    show_default=True,
+    help=
+    'Number of times to retry failed requests to sat-api, with exponential backoff.'
+)
+@click.option(
+    '--concurrency',
+    type=int,
+    default=4,
+    show_default=True,
+    help=
+    'Max number of concurrent requests to sat-api. Searches finding more than 10,000 features are split into many queries.'
+)
+@click.option(
+    '--cache-dir',
+    type=click.Path(file_okay=False, writable=True),
+    default=None,
+    help=
+    'Directory to cache sat-api responses in. Responses are reused for a day, and the least recently used are evicted above 512MB. Defaults to $XDG_CACHE_HOME/landsat-cogeo-mosaic or ~/.cache/landsat-cogeo-mosaic.'
+)
+@click.option(
+    '--no-cache',
+    is_flag=True,
+    default=False,
+    help='Always request sat-api, without reading or writing the cache.')
 def search(
         bounds, min_cloud, max_cloud, min_date, max_date, period, period_qty,
-        stac_collection_limit, season):
+        stac_collection_limit, season, retries, concurrency, cache_dir,
+        no_cache):
     """Retrieve features from sat-api
     """
     bounds = tuple(map(float, bounds.split(',')))
-    features = _search(
+    cache = None if no_cache else ResponseCache(cache_dir)
+    pages = _search_pages(
         bounds=bounds,
         min_cloud=min_cloud,
         max_cloud=max_cloud,
@@ -101,17 +143,24 @@ def search(
         max_date=max_date,
         period=period,
         period_qty=period_qty,
-        stac_collection_limit=stac_collection_limit)
-    if not features:
+        stac_collection_limit=stac_collection_limit,
+        session=create_session(retries=retries, pool_maxsize=concurrency),
+        concurrency=concurrency,
+        cache=cache)
+
+    # Write to stdout as newline delimited features, as each page arrives
+    found = False
+    for page in pages:
+        found = found or bool(page)
+        for feature in filter_features(page, seasons=season):
+            print(json.dumps(feature, separators=(',', ':')))
+        sys.stdout.flush()
+
+    if cache is not None:
+        cache.close()
+
+    if not found:
         print(f"No assets found for query", file=sys.stderr)
-        return
-
-    if season:
-        features = filter_season(features, season)
-
-    # Write to stdout as newline delimited features
-    for feature in features:
-        print(json.dumps(feature, separators=(',', ':')))
 
 
 @click.command()
@@ -152,24 +201,33 @@ def search(
     show_default=True,
     type=click.Choice(["spring", "summer", "autumn", "winter"]),
     help='Season, can provide multiple')
+@click.option(
+    '-o',
+    '--out-path',
+    type=click.Path(dir_okay=False, writable=True),
+    default=None,
+    help=
+    'Output path, gzipped if it ends with .gz. Writes to stdout by default.')
 @click.argument('lines', type=click.File())
-def create(min_zoom, max_zoom, quadkey_zoom, bounds, season, lines):
+def create(min_zoom, max_zoom, quadkey_zoom, bounds, season, out_path, lines):
     """Create MosaicJSON from STAC features
+
+    LINES is newline-delimited GeoJSON of features, e.g. from search. Features
+    are read one at a time, so it can be larger than memory.
     """
     if bounds:
         bounds = tuple(map(float, re.split(r'[, ]+', bounds)))
 
-    features = [json.loads(l) for l in lines]
-
-    if season:
-        features = filter_season(features, season)
+    features = (json.loads(l) for l in lines if l.strip())
+    features = filter_features(features, seasons=season, bounds=bounds)
 
     mosaic = features_to_mosaicJSON(
         features=features,
         quadkey_zoom=quadkey_zoom,
         minzoom=min_zoom,
         maxzoom=max_zoom)
-    print(json.dumps(mosaic, separators=(',', ':')))
+    tiles = mosaic.pop('tiles')
+    save_mosaic(out_path, mosaic, tiles.items())
 
 
 @click.command()
@@ -234,9 +292,38 @@ def create(min_zoom, max_zoom, quadkey_zoom, bounds, season, lines):
     help=
     'Date used for comparisons when preference is closest-to-date. Format must be YYYY-MM-DD'
 )
+@click.option(
+    '--workers',
+    type=int,
+    default=1,
+    show_default=True,
+    help='Number of processes used to select assets from the database.')
+@click.option(
+    '--engine',
+    type=click.Choice(['sqlite', 'catalog'], case_sensitive=False),
+    default='sqlite',
+    show_default=True,
+    help=
+    'Select assets with SQLite queries, or load scenes into memory and select assets with array operations. With catalog, --sqlite-path may be a catalog file from prepare-catalog.'
+)
+@click.option(
+    '--compact',
+    is_flag=True,
+    default=False,
+    help=
+    'Build tiles in compact arrays instead of sets. Uses much less memory for indexes with many quadkeys.'
+)
+@click.option(
+    '-o',
+    '--out-path',
+    type=click.Path(dir_okay=False, writable=True),
+    default=None,
+    help=
+    'Output path, gzipped if it ends with .gz. Writes to stdout by default.')
 def create_from_db(
         sqlite_path, pathrow_index, max_cloud, min_date, max_date, min_zoom,
-        max_zoom, sort_preference, closest_to_date):
+        max_zoom, sort_preference, closest_to_date, workers, engine, compact,
+        out_path):
     """Create MosaicJSON from SQLite database of Landsat features
     """
     if (sort_preference == 'closest-to-date') and (not closest_to_date):
@@ -244,7 +331,7 @@ def create_from_db(
         raise ValueError(msg)
 
     pr_index = load_index_data(pathrow_index)
-    mosaic = _create_from_db(
+    streaming_parser = _create_from_db(
         sqlite_path=sqlite_path,
         pr_index=pr_index,
         max_cloud=max_cloud,
@@ -253,9 +340,326 @@ def create_from_db(
         min_zoom=min_zoom,
         max_zoom=max_zoom,
         sort_preference=sort_preference,
-        closest_to_date=closest_to_date)
+        closest_to_date=closest_to_date,
+        workers=workers,
+        engine=engine,
+        compact=compact,
+        as_parser=True)
+
+    save_mosaic(
+        out_path, streaming_parser.header, streaming_parser.iter_tiles())
+
+
+@click.command()
+@click.option(
+    '--sqlite-path',
+    type=click.Path(exists=True, readable=True),
+    required=True,
+    help='Path to sqlite3 db generated from scene_list')
+@click.option(
+    '--pathrow-index',
+    type=click.Path(exists=True, readable=True),
+    required=False,
+    default=None,
+    help='Path to pathrow-quadkey index. Loads bundled index by default.')
+@click.option(
+    '--min-zoom',
+    type=int,
+    required=False,
+    default=7,
+    show_default=True,
+    help='Minimum zoom')
+@click.option(
+    '--max-zoom',
+    type=int,
+    required=False,
+    default=12,
+    show_default=True,
+    help='Maximum zoom')
+@click.option(
+    '-o',
+    '--out-dir',
+    required=True,
+    type=click.Path(file_okay=False, writable=True),
+    help='Directory to write gzipped MosaicJSON files into, named by spec.')
+@click.option(
+    '--compact',
+    is_flag=True,
+    default=False,
+    help=
+    'Build tiles in compact arrays instead of sets. Uses much less memory for indexes with many quadkeys.'
+)
+@click.argument('manifest', type=click.File())
+def create_batch(
+        sqlite_path, pathrow_index, min_zoom, max_zoom, out_dir, compact,
+        manifest):
+    """Create many MosaicJSONs from SQLite database in one pass
+
+    MANIFEST is a JSON file with a list of specs. Each spec has a name and
+    the parameters of create-from-db, e.g. {"name": "mosaic_2019_spring",
+    "min_date": "2019-03-21", "max_date": "2019-06-21", "max_cloud": 5,
+    "sort_preference": "min-cloud"}
+    """
+    specs = json.load(manifest)
+    for spec in specs:
+        if (spec.get('sort_preference') == 'closest-to-date') and (
+                not spec.get('closest_to_date')):
+            msg = 'closest_to_date required when sort_preference is closest-to-date'
+            raise ValueError(msg)
+
+    pr_index = load_index_data(pathrow_index)
+    parsers = _create_batch_from_db(
+        sqlite_path=sqlite_path,
+        pr_index=pr_index,
+        specs=specs,
+        min_zoom=min_zoom,
+        max_zoom=max_zoom,
+        compact=compact,
+        as_parser=True)
+
+    Path(out_dir).mkdir(parents=True, exist_ok=True)
+    for name in list(parsers):
+        streaming_parser = parsers.pop(name)
+        save_mosaic(
+            Path(out_dir) / f'{name}.json.gz', streaming_parser.header,
+            streaming_parser.iter_tiles())
+
+
+@click.command()
+@click.option(
+    '--sqlite-path',
+    type=click.Path(exists=True, readable=True),
+    required=True,
+    help='Path to sqlite3 db generated from scene_list')
+@click.option(
+    '--pathrow-index',
+    type=click.Path(exists=True, readable=True),
+    required=False,
+    default=None,
+    help='Path to pathrow-quadkey index. Loads bundled index by default.')
+@click.option(
+    '--max-cloud',
+    type=float,
+    required=False,
+    default=100,
+    show_default=True,
+    help='Maximum cloud percentage')
+@click.option(
+    '--min-date',
+    type=str,
+    required=False,
+    default='2013-01-01',
+    show_default=True,
+    help='Minimum date, inclusive')
+@click.option(
+    '--max-date',
+    type=str,
+    required=False,
+    default=datetime.strftime(datetime.today(), "%Y-%m-%d"),
+    show_default=True,
+    help='Maximum date, inclusive')
+@click.option(
+    '-p',
+    '--sort-preference',
+    type=click.Choice(['newest', 'oldest', 'closest-to-date', 'min-cloud'],
+                      case_sensitive=False),
+    default='newest',
+    show_default=True,
+    help='Method for choosing scenes in the same path-row')
+@click.option(
+    '--closest-to-date',
+    type=str,
+    default=None,
+    help=
+    'Date used for comparisons when preference is closest-to-date. Format must be YYYY-MM-DD'
+)
+@click.option(
+    '--since-rowid',
+    type=int,
+    default=None,
+    help=
+    'Update pathrows with scenes inserted after this rowid. Defaults to watermark stored in mosaic.'
+)
+@click.option(
+    '--since-date',
+    type=str,
+    default=None,
+    help=
+    'Update pathrows with scenes acquired on or after this date. Format must be YYYY-MM-DD'
+)
+@click.option(
+    '-o',
+    '--out-path',
+    type=click.Path(dir_okay=False, writable=True),
+    default=None,
+    help=
+    'Output path, gzipped if it ends with .gz. May be the same as MOSAIC. Writes to stdout by default.'
+)
+@click.argument('mosaic', type=click.Path(exists=True, readable=True))
+def update_from_db(
+        sqlite_path, pathrow_index, max_cloud, min_date, max_date,
+        sort_preference, closest_to_date, since_rowid, since_date, out_path,
+        mosaic):
+    """Update MosaicJSON with scenes added to SQLite database
+
+    MOSAIC is a MosaicJSON created by create-from-db, optionally gzipped.
+    Use the same parameters as when creating it.
+    """
+    if (sort_preference == 'closest-to-date') and (not closest_to_date):
+        msg = 'closest-to-date parameter required when sort_preference is closest-to-date'
+        raise ValueError(msg)
+
+    watermark = None
+    if since_rowid is not None:
+        watermark = {'rowid': since_rowid}
+    elif since_date:
+        watermark = {'acquisition_date': since_date}
+
+    file_opener = gzip.open if mosaic.endswith('.gz') else open
+    with file_opener(mosaic, 'rt') as f:
+        mosaic = json.load(f)
+
+    pr_index = load_index_data(pathrow_index)
+    mosaic = _update_from_db(
+        sqlite_path=sqlite_path,
+        mosaic=mosaic,
+        pr_index=pr_index,
+        max_cloud=max_cloud,
+        min_date=min_date,
+        max_date=max_date,
+        sort_preference=sort_preference,
+        closest_to_date=closest_to_date,
+        watermark=watermark)
 
-    print(json.dumps(mosaic, separators=(',', ':')))
+    tiles = mosaic.pop('tiles')
+    save_mosaic(out_path, mosaic, tiles.items())
+
+
+@click.command()
+@click.option(
+    '--scene-path',
+    required=True,
+    type=click.Path(exists=True, readable=True),
+    help='Path to CSV of scene metadata downloaded from AWS S3. May be gzipped.'
+)
+@click.option(
+    '-o',
+    '--out-path',
+    required=True,
+    type=click.Path(exists=False, writable=True),
+    help='Path of new SQLite DB. Will overwrite any existing file.')
+@click.option(
+    '--batch-size',
+    type=int,
+    default=100000,
+    show_default=True,
+    help='Number of scenes inserted at a time.')
+def prepare_db(scene_path, out_path, batch_size):
+    """Create SQLite database of Landsat features from scene_list
+    """
+    _prepare_db(
+        scene_path=scene_path, sqlite_path=out_path, batch_size=batch_size)
+
+
+@click.command()
+@click.option(
+    '--sqlite-path',
+    type=click.Path(dir_okay=False, writable=True),
+    required=True,
+    help=
+    'Path to sqlite3 db to upsert scenes into. Created if it does not exist, otherwise must be generated by prepare-db.'
+)
+@click.option(
+    '-b',
+    '--bounds',
+    type=str,
+    required=True,
+    help='Comma-separated bounding box: "west, south, east, north"')
+@click.option(
+    '--min-cloud',
+    type=float,
+    required=False,
+    default=0,
+    show_default=True,
+    help='Minimum cloud percentage')
+@click.option(
+    '--max-cloud',
+    type=float,
+    required=False,
+    default=100,
+    show_default=True,
+    help='Maximum cloud percentage')
+@click.option(
+    '--min-date',
+    type=str,
+    required=False,
+    default=None,
+    help=
+    'Minimum date. Defaults to the day of the newest scene harvested with the same bounds and clouds, or 2013-01-01 for the first harvest.'
+)
+@click.option(
+    '--max-date',
+    type=str,
+    required=False,
+    default=datetime.strftime(datetime.today(), "%Y-%m-%d"),
+    show_default=True,
+    help='Maximum date, inclusive')
+@click.option(
+    '--stac-collection-limit',
+    type=int,
+    default=500,
+    show_default=True,
+    help='Limits the number of items per page returned by sat-api.')
+@click.option(
+    '--retries',
+    type=int,
+    default=3,
+    show_default=True,
+    help=
+    'Number of times to retry failed requests to sat-api, with exponential backoff.'
+)
+@click.option(
+    '--concurrency',
+    type=int,
+    default=4,
+    show_default=True,
+    help='Max number of concurrent requests to sat-api.')
+def harvest(
+        sqlite_path, bounds, min_cloud, max_cloud, min_date, max_date,
+        stac_collection_limit, retries, concurrency):
+    """Upsert features from sat-api into SQLite DB of scenes
+    """
+    bounds = tuple(map(float, bounds.split(',')))
+    _harvest(
+        sqlite_path=sqlite_path,
+        bounds=bounds,
+        min_cloud=min_cloud,
+        max_cloud=max_cloud,
+        min_date=min_date,
+        max_date=max_date,
+        stac_collection_limit=stac_collection_limit,
+        session=create_session(retries=retries, pool_maxsize=concurrency),
+        concurrency=concurrency)
+
+
+@click.command()
+@click.option(
+    '--scene-path',
+    required=True,
+    type=click.Path(exists=True, readable=True),
+    help=
+    'Path to CSV of scene metadata downloaded from AWS S3, which may be gzipped, or to SQLite DB generated from it.'
+)
+@click.option(
+    '-o',
+    '--out-path',
+    required=True,
+    type=click.Path(exists=False, writable=True),
+    help='Path of new catalog file. Will overwrite any existing file.')
+def prepare_catalog(scene_path, out_path):
+    """Create memory-mapped catalog file of Landsat features from scene_list
+    """
+    _prepare_catalog(scene_path=scene_path, catalog_path=out_path)
 
 
 @click.command()
@@ -287,9 +691,43 @@ def create_from_db(
     help=
     'Zoom level used for quadkeys in MosaicJSON. Lower value means more assets per tile, but a smaller MosaicJSON file. Higher value means fewer assets per tile but a larger MosaicJSON file. Must be between min zoom and max zoom, inclusive.'
 )
-def index(wrs_path, scene_path, bounds, quadkey_zoom):
+@click.option(
+    '--format',
+    'output_format',
+    type=click.Choice(['json', 'binary'], case_sensitive=False),
+    default='json',
+    show_default=True,
+    help=
+    'Output format. The binary format is memory-mapped when loaded and requires --out-path.'
+)
+@click.option(
+    '-o',
+    '--out-path',
+    type=click.Path(exists=False, writable=True),
+    default=None,
+    help='Output path. Writes JSON to stdout by default.')
+@click.option(
+    '--shard-zoom',
+    type=int,
+    default=4,
+    show_default=True,
+    help=
+    'Zoom level of tiles that quadkeys are split into shards by. Each process only joins the quadkeys and path-rows of one shard at a time. The index is the same for any value.'
+)
+@click.option(
+    '--workers',
+    type=int,
+    default=1,
+    show_default=True,
+    help='Number of processes used to index shards.')
+def index(
+        wrs_path, scene_path, bounds, quadkey_zoom, output_format, out_path,
+        shard_zoom, workers):
     """Create optimized index of path-row to quadkey_zoom
     """
+    if output_format == 'binary' and not out_path:
+        raise click.UsageError('--out-path is required for binary format')
+
     if bounds:
         bounds = tuple(map(float, bounds.split(',')))
 
@@ -297,9 +735,17 @@ def index(wrs_path, scene_path, bounds, quadkey_zoom):
         pathrow_path=wrs_path,
         scene_path=scene_path,
         bounds=bounds,
-        quadkey_zoom=quadkey_zoom)
+        quadkey_zoom=quadkey_zoom,
+        shard_zoom=shard_zoom,
+        workers=workers)
 
-    print(json.dumps(_index, separators=(',', ':')))
+    if output_format == 'binary':
+        PathrowIndex.from_dict(_index).save(out_path)
+    elif out_path:
+        with open(out_path, 'w') as f:
+            json.dump(_index, f, separators=(',', ':'))
+    else:
+        print(json.dumps(_index, separators=(',', ':')))
 
 
 @click.command()
@@ -380,6 +826,34 @@ def missing_quadkeys(shp_path, bounds, simplify, file):
     print(json.dumps(fc, separators=(',', ':')))
 
 
+@click.command()
+@click.option(
+    '--check',
+    is_flag=True,
+    default=False,
+    help=
+    'Exit with status 1 if any quadkey has more than one asset of the same path-row.'
+)
+@click.argument('mosaic', type=click.Path(exists=True, readable=True))
+def stats(check, mosaic):
+    """Print statistics of assets in MosaicJSON
+
+    MOSAIC is a MosaicJSON, optionally gzipped.
+    """
+    file_opener = gzip.open if mosaic.endswith('.gz') else open
+    with file_opener(mosaic, 'rt') as f:
+        mosaic = json.load(f)
+
+    mosaic_stats = _mosaic_stats(mosaic)
+    print(json.dumps(mosaic_stats, separators=(',', ':')))
+
+    if check and mosaic_stats['duplicate_quadkeys']:
+        print(
+            f"{mosaic_stats['duplicate_quadkeys']} quadkeys have more than one asset of the same path-row",
+            file=sys.stderr)
+        sys.exit(1)
+
+
 @click.command()
 @click.option(
     '-p',
@@ -415,11 +889,17 @@ def visualize(wrs_path, mosaic_paths, api_key):
 
 
 main.add_command(create)
+main.add_command(create_batch)
 main.add_command(create_from_db)
 main.add_command(grid)
+main.add_command(harvest)
 main.add_command(index)
 main.add_command(missing_quadkeys)
+main.add_command(prepare_catalog)
+main.add_command(prepare_db)
 main.add_command(search)
+main.add_command(stats)
+main.add_command(update_from_db)
 main.add_command(visualize)
 
 if __name__ == '__main__':
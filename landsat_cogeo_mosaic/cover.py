@@ -0,0 +1,292 @@
+"""
+landsat_cogeo_mosaic.cover: Find tiles intersecting polygons
+"""
+from typing import List, Sequence, Tuple
+
+import mercantile
+import numpy as np
+import shapely
+from shapely.geometry.base import BaseGeometry
+
+from landsat_cogeo_mosaic.quadkey import tiles_to_bounds
+
+# Number of geometries scanned at a time, which bounds memory use
+CHUNK_SIZE = 1000
+
+# Polygons with a convex hull larger than their area by more than this
+# fraction are checked tile by tile after scanning
+_CONVEX_TOLERANCE = 1e-9
+
+
+def tile_ranges(bounds: Sequence[float],
+                zoom: int) -> List[Tuple[int, int, int, int]]:
+    """Ranges of tiles within bounds
+
+    Args:
+        - bounds: west, south, east, north. West may be greater than east
+          across the antimeridian.
+        - zoom: zoom of tiles
+
+    Returns:
+        list of inclusive (min x, max x, min y, max y), of the same tiles as
+        `mercantile.tiles`
+    """
+    west, south, east, north = bounds
+    if west > east:
+        bboxes = [(-180.0, south, east, north), (west, south, 180.0, north)]
+    else:
+        bboxes = [(west, south, east, north)]
+
+    ranges = []
+    for w, s, e, n in bboxes:
+        w = max(-180.0, w)
+        s = max(-85.051129, s)
+        e = min(180.0, e)
+        n = min(85.051129, n)
+
+        ul_tile = mercantile.tile(w, n, zoom)
+        lr_tile = mercantile.tile(
+            e - mercantile.LL_EPSILON, s + mercantile.LL_EPSILON, zoom)
+        ranges.append((ul_tile.x, lr_tile.x, ul_tile.y, lr_tile.y))
+
+    return ranges
+
+
+def bounds_tiles(bounds: Sequence[float],
+                 zoom: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Find all tiles within bounds
+
+    Args:
+        - bounds: west, south, east, north
+        - zoom: zoom of tiles
+
+    Returns:
+        arrays of x and y of tiles, in the order of `mercantile.tiles`
+    """
+    xs, ys = [], []
+    for x_min, x_max, y_min, y_max in tile_ranges(bounds, zoom):
+        x, y = np.meshgrid(
+            np.arange(x_min, x_max + 1, dtype=np.int64),
+            np.arange(y_min, y_max + 1, dtype=np.int64),
+            indexing='ij')
+        xs.append(x.ravel())
+        ys.append(y.ravel())
+
+    return np.concatenate(xs), np.concatenate(ys)
+
+
+def cover_geometries(
+        geometries: Sequence[BaseGeometry],
+        bounds: Sequence[float],
+        zoom: int,
+        chunk_size: int = CHUNK_SIZE
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Find tiles within bounds intersecting each polygon
+
+    Tiles intersect a polygon when their longitude and latitude bounds do,
+    including tiles that only touch it, the same as a spatial join of the
+    polygons with tile polygons from `mercantile.feature`. Only tiles near
+    the polygons are created.
+
+    The tiles are found by scanline rasterization: for each row of tiles,
+    the edges of the polygon are clipped to the latitudes of the row, and the
+    tiles between the westmost and eastmost clipped edges intersect it. For
+    convex polygons these are exactly the intersecting tiles. Tiles of other
+    polygons are then checked against the polygon.
+
+    Args:
+        - geometries: polygons or multipolygons in longitude and latitude
+        - bounds: west, south, east, north
+        - zoom: zoom of tiles
+        - chunk_size: number of geometries scanned at a time
+
+    Returns:
+        arrays of index of geometry, x and y of each pair of intersecting
+        geometry and tile, sorted by index, x and y
+    """
+    geometries = np.asarray(geometries, dtype=object)
+    ranges = tile_ranges(bounds, zoom)
+
+    indices, xs, ys = [], [], []
+    for start in range(0, len(geometries), chunk_size):
+        chunk = geometries[start:start + chunk_size]
+        index, x, y = _cover_chunk(chunk, zoom, ranges)
+        indices.append(index + start)
+        xs.append(x)
+        ys.append(y)
+
+    if not indices:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty, empty
+
+    return np.concatenate(indices), np.concatenate(xs), np.concatenate(ys)
+
+
+def _cover_chunk(
+        geometries: np.ndarray, zoom: int,
+        ranges: List[Tuple[int, int, int, int]]
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Find tiles within ranges intersecting each polygon
+
+    See `cover_geometries`.
+    """
+    polygons, polygon_index = shapely.get_parts(geometries, return_index=True)
+    coords, ring_index = shapely.get_coordinates(
+        shapely.get_exterior_ring(polygons), return_index=True)
+
+    indices, xs, ys = [], [], []
+    for x_min, x_max, y_min, y_max in ranges:
+        ring, x, y = _scan_rings(
+            coords[:, 0], coords[:, 1], ring_index, len(polygons), zoom,
+            x_min, x_max, y_min, y_max)
+        indices.append(polygon_index[ring])
+        xs.append(x)
+        ys.append(y)
+
+    index = np.concatenate(indices)
+    x = np.concatenate(xs)
+    y = np.concatenate(ys)
+
+    # Tiles of parts of multipolygons, and of antimeridian ranges, can repeat
+    order = np.lexsort((y, x, index))
+    index, x, y = index[order], x[order], y[order]
+    first = np.ones(len(index), dtype=bool)
+    first[1:] = (np.diff(index) != 0) | (np.diff(x) != 0) | (np.diff(y) != 0)
+    index, x, y = index[first], x[first], y[first]
+
+    # Tiles between the ends of each row cover the convex hull of the
+    # polygon. Check tiles of other polygons one by one.
+    hull_areas = shapely.area(shapely.convex_hull(geometries))
+    not_convex = (
+        hull_areas - shapely.area(geometries) > _CONVEX_TOLERANCE * hull_areas)
+    check = not_convex[index]
+    if check.any():
+        west, south, east, north = tiles_to_bounds(
+            x[check], y[check], np.full(check.sum(), zoom))
+        keep = np.ones(len(index), dtype=bool)
+        keep[check] = shapely.intersects(
+            shapely.box(west, south, east, north), geometries[index[check]])
+        index, x, y = index[keep], x[keep], y[keep]
+
+    return index, x, y
+
+
+def _scan_rings(
+        lons: np.ndarray, lats: np.ndarray, ring_index: np.ndarray,
+        num_rings: int, zoom: int, x_min: int, x_max: int, y_min: int,
+        y_max: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Find tiles between the westmost and eastmost edges of rings in each row
+
+    Args:
+        - lons, lats: coordinates of closed rings
+        - ring_index: ring of each coordinate, in ascending order
+        - num_rings: number of rings
+        - zoom: zoom of tiles
+        - x_min, x_max, y_min, y_max: inclusive range of tiles to find
+
+    Returns:
+        arrays of ring, x and y of tiles
+    """
+    empty = np.empty(0, dtype=np.int64)
+
+    # Edges between consecutive coordinates of the same ring
+    same_ring = ring_index[:-1] == ring_index[1:]
+    lon_a, lon_b = lons[:-1][same_ring], lons[1:][same_ring]
+    lat_a, lat_b = lats[:-1][same_ring], lats[1:][same_ring]
+    edge_ring = ring_index[:-1][same_ring]
+    edge_counts = np.bincount(edge_ring, minlength=num_rings)
+    edge_starts = np.cumsum(edge_counts) - edge_counts
+
+    # Rows of the north and south ends of each ring, and one more on each
+    # side, in case the ring touches the edge of a row or rounding differs
+    # from mercantile
+    max_lats = np.full(num_rings, -90.0)
+    min_lats = np.full(num_rings, 90.0)
+    np.maximum.at(max_lats, edge_ring, np.maximum(lat_a, lat_b))
+    np.minimum.at(min_lats, edge_ring, np.minimum(lat_a, lat_b))
+    top = np.maximum(_lat_to_row(max_lats, zoom) - 1, y_min)
+    bottom = np.minimum(_lat_to_row(min_lats, zoom) + 1, y_max)
+    row_counts = np.where(edge_counts > 0, np.maximum(bottom - top + 1, 0), 0)
+    if not row_counts.sum():
+        return empty, empty, empty
+
+    # Arrays of (ring, row)
+    row_ring = np.repeat(np.arange(num_rings), row_counts)
+    rows = top[row_ring] + _ranges(row_counts)
+    _, south, _, north = tiles_to_bounds(
+        np.zeros(len(rows)), rows, np.full(len(rows), zoom))
+
+    # Arrays of (ring, row, edge), with each edge clipped to the latitudes of
+    # the row
+    pair_counts = edge_counts[row_ring]
+    pair_row = np.repeat(np.arange(len(rows)), pair_counts)
+    edge = np.repeat(edge_starts[row_ring], pair_counts) + _ranges(pair_counts)
+    lon_a, lon_b = lon_a[edge], lon_b[edge]
+    lat_a, lat_b = lat_a[edge], lat_b[edge]
+    lo = np.maximum(np.minimum(lat_a, lat_b), south[pair_row])
+    hi = np.minimum(np.maximum(lat_a, lat_b), north[pair_row])
+    valid = lo <= hi
+
+    # Longitude of edge at latitudes, exact at its vertices. Horizontal
+    # edges within a row span both of their vertices.
+    horizontal = lat_a == lat_b
+    with np.errstate(divide='ignore', invalid='ignore'):
+        slope = (lon_b - lon_a) / (lat_b - lat_a)
+        lon_lo = np.where(
+            horizontal, np.minimum(lon_a, lon_b),
+            _edge_lon(lo, lon_a, lat_a, lon_b, lat_b, slope))
+        lon_hi = np.where(
+            horizontal, np.maximum(lon_a, lon_b),
+            _edge_lon(hi, lon_a, lat_a, lon_b, lat_b, slope))
+
+    pair_starts = np.cumsum(pair_counts) - pair_counts
+    west = np.minimum.reduceat(
+        np.where(valid, np.minimum(lon_lo, lon_hi), np.inf), pair_starts)
+    east = np.maximum.reduceat(
+        np.where(valid, np.maximum(lon_lo, lon_hi), -np.inf), pair_starts)
+
+    # First tile with its east edge at or east of west, and last tile with
+    # its west edge at or west of east, starting from estimates that are one
+    # tile too far. Rows the ring doesn't reach are left empty.
+    reached = np.isfinite(west)
+    row_ring, rows = row_ring[reached], rows[reached]
+    west, east = west[reached], east[reached]
+
+    z2 = 2.0**zoom
+    first = np.floor((west + 180.0) / 360.0 * z2).astype(np.int64) - 1
+    last = np.floor((east + 180.0) / 360.0 * z2).astype(np.int64) + 1
+    for _ in range(3):
+        first += (first + 1) / z2 * 360.0 - 180.0 < west
+        last -= last / z2 * 360.0 - 180.0 > east
+
+    first = np.maximum(first, x_min)
+    last = np.minimum(last, x_max)
+    counts = np.maximum(last - first + 1, 0)
+
+    ring = np.repeat(row_ring, counts)
+    y = np.repeat(rows, counts)
+    x = np.repeat(first, counts) + _ranges(counts)
+    return ring, x, y
+
+
+def _lat_to_row(lats: np.ndarray, zoom: int) -> np.ndarray:
+    """Row of tiles containing latitudes, up to rounding
+    """
+    lats = np.radians(np.clip(lats, -85.051129, 85.051129))
+    rows = (1 - np.arcsinh(np.tan(lats)) / np.pi) / 2 * 2**zoom
+    return np.floor(rows).astype(np.int64)
+
+
+def _ranges(counts: np.ndarray) -> np.ndarray:
+    """Concatenated ranges from 0 to each count
+
+    E.g. [0, 1, 2, 0, 1] for counts [3, 2]
+    """
+    starts = np.cumsum(counts) - counts
+    return np.arange(counts.sum()) - np.repeat(starts, counts)
+
+
+def _edge_lon(lat, lon_a, lat_a, lon_b, lat_b, slope):
+    lon = lon_a + (lat - lat_a) * slope
+    lon = np.where(lat == lat_a, lon_a, lon)
+    return np.where(lat == lat_b, lon_b, lon)
@@ -1,26 +1,212 @@
+import csv
+import gzip
+import os
+import re
 import sqlite3
-from datetime import datetime
-from typing import Dict, Iterable, List, Optional, Union
+import sys
+import warnings
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from itertools import islice
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+from dateutil.parser import parse as date_parse
 
 from landsat_cogeo_mosaic.constants import LANDSAT8_MIN_DATE
-from landsat_cogeo_mosaic.util import coerce_to_datetime
+from landsat_cogeo_mosaic.util import (
+    coerce_to_datetime, date_to_ts, midpoint_date)
+
+# Max number of pathrows bound in a single bulk query. Older SQLite versions
+# allow at most 999 parameters per statement. Using a fixed chunk size also
+# means every full chunk reuses the same cached statement.
+BULK_QUERY_CHUNK_SIZE = 500
+
+_EPOCH = datetime(1970, 1, 1)
+_MILLISECOND = timedelta(milliseconds=1)
+
+# Columns of scene_list.gz, in order
+SCENE_LIST_COLUMNS = [
+    'productId', 'entityId', 'acquisitionDate', 'cloudCover',
+    'processingLevel', 'path', 'row', 'min_lat', 'min_lon', 'max_lat',
+    'max_lon', 'download_url']
+
+CREATE_SCENE_TABLE_SQL = """\
+CREATE TABLE scene_list (
+    productId TEXT,
+    entityId TEXT,
+    acquisitionDate TEXT,
+    cloudCover REAL,
+    processingLevel TEXT,
+    path INTEGER,
+    row INTEGER,
+    min_lat REAL,
+    min_lon REAL,
+    max_lat REAL,
+    max_lon REAL,
+    download_url TEXT,
+    pathrow INTEGER,
+    acquisition_ts INTEGER,
+    tier TEXT
+);
+"""
+
+# Covering index for selecting scenes within a pathrow: every column used by
+# the where and order clauses of `generate_query`, plus productId
+CREATE_SCENE_INDEX_SQL = """\
+CREATE INDEX scene_selection_idx
+ON scene_list(pathrow, acquisition_ts, cloudCover, tier, productId);
+"""
+
+
+class SceneDB:
+    """Read-only connection to SQLite database of Landsat scenes
+
+    The database is opened read-only and immutable via a URI, so SQLite skips
+    all locking and change detection. Don't use it on a database file that's
+    being written to concurrently.
+
+    Queries use `?` parameters, so that SQLite's statement cache can reuse
+    compiled statements across pathrows. Records are returned as lightweight
+    named tuples.
+
+    Attributes:
+        - timestamp_column: `acquisition_ts` if the scene table has that
+          precomputed column (databases from `prepare_db`), otherwise None
+          for databases from `scripts/csv_import.sql`
+    """
+    def __init__(
+            self,
+            sqlite_path,
+            table_name: str = 'scene_list',
+            mmap_size: int = 2**30,
+            cache_size: int = -2**16,
+            cached_statements: int = 256):
+        """
+        Args:
+            - sqlite_path: Path to sqlite database
+            - table_name: name of table of scenes
+            - mmap_size: max number of bytes of database to memory-map
+            - cache_size: page cache size. Negative values are in KiB
+            - cached_statements: number of compiled statements to cache
+        """
+        self.sqlite_path = str(sqlite_path)
+        uri = Path(sqlite_path).resolve().as_uri() + '?mode=ro&immutable=1'
+        self.conn = sqlite3.connect(
+            uri,
+            uri=True,
+            check_same_thread=False,
+            cached_statements=cached_statements)
+
+        self.conn.execute(f'PRAGMA mmap_size = {int(mmap_size)}')
+        self.conn.execute(f'PRAGMA cache_size = {int(cache_size)}')
+        self.conn.execute('PRAGMA temp_store = MEMORY')
+
+        self.table_name = table_name
+        columns = {
+            row[1]
+            for row in self.conn.execute(f'PRAGMA table_info({table_name})')}
+        self.timestamp_column = (
+            'acquisition_ts' if 'acquisition_ts' in columns else None)
+
+        self._checked_queries = set()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.conn.close()
+
+    def query(self, query_str: str, params: Iterable = ()) -> Iterator[Tuple]:
+        """Run parameterized query on database
+
+        Args:
+            - query_str: query with `?` placeholders
+            - params: values for placeholders
+
+        Returns:
+            iterator of named tuple records
+        """
+        return run_query(self.conn, query_str, params)
+
+    def check_query_plan(self, query_str: str, params: Iterable = ()):
+        """Warn if query would scan the whole table of scenes
+
+        This happens when the database has no index starting with `pathrow`.
+        Each distinct query string is only checked once.
+
+        Args:
+            - query_str: query with `?` placeholders
+            - params: values for placeholders
+        """
+        if query_str in self._checked_queries:
+            return
+
+        self._checked_queries.add(query_str)
+        plan = self.conn.execute(
+            f'EXPLAIN QUERY PLAN {query_str}', tuple(params))
+
+        # Detail is e.g. "SCAN scene_list" or, before SQLite 3.36,
+        # "SCAN TABLE scene_list". Index scans mention the index.
+        full_scan = re.compile(rf'SCAN (TABLE )?{self.table_name}\b')
+        for row in plan:
+            detail = row[-1]
+            if full_scan.match(detail) and 'INDEX' not in detail:
+                msg = (
+                    f'Query does a full scan of {self.table_name} in '
+                    f'{self.sqlite_path}. Create the database with '
+                    '`landsat-cogeo-mosaic prepare-db` or add an index on '
+                    'pathrow.')
+                warnings.warn(msg)
+                return
+
+
+# Connections opened through `connect`, keyed by resolved path, with the
+# modification time and size of the file when they were opened
+_connections: Dict[str, Tuple[Tuple[int, int], SceneDB]] = {}
+
+
+def connect(sqlite_path) -> SceneDB:
+    """Get shared read-only connection to database
 
+    Connections are reused instead of opening a new file descriptor for every
+    query, until the modification time or size of the file changes, e.g.
+    after `prepare_db` or `harvest.harvest` write to it in the same process.
+    The previous connection, which is immutable and can't see the change, is
+    then dropped.
 
-def find_records(sqlite_path, query) -> Iterable[Dict]:
+    Args:
+        - sqlite_path: Path to sqlite database
+    """
+    path = Path(sqlite_path).resolve()
+    stat = os.stat(path)
+    version = (stat.st_mtime_ns, stat.st_size)
+
+    cached = _connections.get(str(path))
+    if cached is not None and cached[0] == version:
+        return cached[1]
+
+    db = SceneDB(sqlite_path)
+    _connections[str(path)] = (version, db)
+    return db
+
+
+def find_records(sqlite_path, query, params: Iterable = ()) -> Iterator[Tuple]:
     """Find records for query from sqlite
 
     Args:
         - sqlite_path: Path to sqlite database
         - query: query as string
+        - params: values for `?` placeholders in query
 
     Returns:
-        iterator that creates dict records
+        iterator of named tuple records
     """
-    # Setting the row_factory attribute allows for creating dict-like objects
-    # https://stackoverflow.com/a/18788347
-    conn = sqlite3.connect(sqlite_path)
-    conn.row_factory = sqlite3.Row
-    return run_query(conn, query)
+    return connect(sqlite_path).query(query, params)
 
 
 def generate_query(
@@ -32,14 +218,12 @@ def generate_query(
         sort_preference: Optional[str] = None,
         tier_preference: List[str] = ['T1', 'T2', 'RT'],
         closest_to_date: Optional[Union[datetime, str]] = None,
+        relax: bool = False,
+        timestamp_column: Optional[str] = None,
         limit: int = 1,
-        columns: List[str] = ['productId']) -> str:
+        columns: List[str] = ['productId']) -> Tuple[str, List]:
     """Generate query for SQLite
 
-    Technically you should use ? in query strings that will be interpolated by
-    the DB API to avoid SQL injection attacks, but since this code is only run
-    locally I'll just use string interpolation.
-
     Args:
         - pathrow: 6-character pathrow
         - table_name: name of table in sqlite. Default 'scene_list'
@@ -49,93 +233,676 @@ def generate_query(
         - sort_preference: preference for selecting pathrow
         - tier_preference: preference of tiers, by default ['T1', 'T2', 'RT']
         - closest_to_date: datetime used for comparisons when preference is closest-to-date. Must be datetime or str of format YYYY-MM-DD
+        - relax: if True, scenes that don't match max_cloud or the date range
+          are still returned, ranked after matching scenes. See
+          `relax_thresholds`.
+        - timestamp_column: name of integer column with seconds since epoch
+          of acquisitionDate, like `acquisition_ts` from `prepare_db`. If
+          provided, date filters and sorts compare it directly, so they can
+          use an index. See `SceneDB.timestamp_column`.
         - limit: Max number of results to return
         - columns: columns to return
 
     Returns:
-        string with query
+        tuple of query string with `?` placeholders and list of parameters.
+        Records also have a `relax_tier` column.
+    """
+    column_str = ', '.join(dict.fromkeys([*columns, 'relax_tier']))
+    candidates_str, params = _candidates_query(
+        table_name=table_name,
+        pathrow_terms=['pathrow = ?'],
+        pathrow_params=[pathrow],
+        columns=columns,
+        max_cloud=max_cloud,
+        min_date=min_date,
+        max_date=max_date,
+        sort_preference=sort_preference,
+        relax=relax,
+        timestamp_column=timestamp_column)
+
+    order_terms, order_params = _order_clause(
+        max_cloud=max_cloud,
+        min_date=min_date,
+        max_date=max_date,
+        sort_preference=sort_preference,
+        tier_preference=tier_preference,
+        closest_to_date=closest_to_date,
+        relax=relax,
+        timestamp_column=timestamp_column)
+    params.extend(order_params)
+
+    execute_str = (
+        f'SELECT {column_str} FROM ({candidates_str}) '
+        f"ORDER BY {', '.join(order_terms)}")
+
+    if limit:
+        execute_str += ' LIMIT ?'
+        params.append(limit)
+
+    execute_str += ';'
+    return execute_str, params
+
+
+def generate_bulk_query(
+        pathrows: Optional[Iterable[str]] = None,
+        table_name: str = 'scene_list',
+        max_cloud: float = 10,
+        min_date: str = None,
+        max_date: str = None,
+        sort_preference: Optional[str] = None,
+        tier_preference: List[str] = ['T1', 'T2', 'RT'],
+        closest_to_date: Optional[Union[datetime, str]] = None,
+        relax: bool = False,
+        timestamp_column: Optional[str] = None,
+        columns: List[str] = ['productId']) -> Tuple[str, List]:
+    """Generate query selecting the best scene for many pathrows at once
+
+    Instead of running one query per pathrow, this ranks all candidate scenes
+    within each pathrow using a window function and keeps the top-ranked scene
+    of every pathrow. The ranking is the same ORDER BY used by
+    `generate_query`, so the selected scene for each pathrow is identical.
+
+    Args:
+        - pathrows: 6-character pathrows to select scenes for. If None, all
+          pathrows in the table are considered.
+        - columns: columns to return in addition to `pathrow`
+
+        All other arguments have the same meaning as in `generate_query`.
+
+    Returns:
+        tuple of query string with `?` placeholders and list of parameters
     """
+    columns = list(dict.fromkeys(['pathrow', *columns]))
+    column_str = ', '.join([*columns, 'relax_tier'])
 
-    column_str = ', '.join(set(columns))
-    execute_str = f'SELECT {column_str} FROM {table_name} WHERE '
+    pathrow_terms = []
+    pathrow_params = []
+    if pathrows is not None:
+        pathrows = list(pathrows)
+        pathrow_terms.append(
+            f"pathrow IN ({', '.join('?' * len(pathrows))})")
+        pathrow_params.extend(pathrows)
 
-    # Where clause
+    candidates_str, candidates_params = _candidates_query(
+        table_name=table_name,
+        pathrow_terms=pathrow_terms,
+        pathrow_params=pathrow_params,
+        columns=columns,
+        max_cloud=max_cloud,
+        min_date=min_date,
+        max_date=max_date,
+        sort_preference=sort_preference,
+        relax=relax,
+        timestamp_column=timestamp_column)
+
+    order_terms, order_params = _order_clause(
+        max_cloud=max_cloud,
+        min_date=min_date,
+        max_date=max_date,
+        sort_preference=sort_preference,
+        tier_preference=tier_preference,
+        closest_to_date=closest_to_date,
+        relax=relax,
+        timestamp_column=timestamp_column)
+
+    # ROW_NUMBER() requires SQLite >= 3.25
+    ranked_str = (
+        f'SELECT {column_str}, ROW_NUMBER() OVER ('
+        f"PARTITION BY pathrow ORDER BY {', '.join(order_terms)}"
+        f') AS scene_rank FROM ({candidates_str})')
+
+    # Placeholders in the window's ORDER BY come before the candidates query
+    params = order_params + candidates_params
+
+    query_str = f'SELECT {column_str} FROM ({ranked_str}) WHERE scene_rank = 1;'
+    return query_str, params
+
+
+def find_best_records(
+        db: SceneDB,
+        pathrows: Optional[Iterable[str]] = None,
+        chunk_size: int = BULK_QUERY_CHUNK_SIZE,
+        **kwargs) -> Iterator[Tuple]:
+    """Find best record for many pathrows with bulk queries
+
+    Pathrows are bound as parameters in chunks of `chunk_size`, to stay below
+    SQLite's limit on the number of parameters. The precomputed timestamp
+    column of the database is used when it exists.
+
+    Args:
+        - db: open database
+        - pathrows: 6-character pathrows. If None, all pathrows in the table.
+        - chunk_size: max number of pathrows per query
+        - kwargs: Arguments passed to generate_bulk_query
+
+    Returns:
+        iterator of named tuple records, at most one per pathrow
+    """
+    kwargs.setdefault('table_name', db.table_name)
+    kwargs.setdefault('timestamp_column', db.timestamp_column)
+
+    if pathrows is None:
+        chunks = [None]
+    else:
+        pathrows = list(pathrows)
+        chunks = (
+            pathrows[i:i + chunk_size]
+            for i in range(0, len(pathrows), chunk_size))
+
+    for chunk in chunks:
+        query, params = generate_bulk_query(pathrows=chunk, **kwargs)
+        db.check_query_plan(query, params)
+        yield from db.query(query, params)
+
+
+def iter_scenes(db: SceneDB) -> Iterator[Tuple]:
+    """Iterate over all scenes ordered by pathrow and acquisition time
+
+    With the index created by `prepare_db` this is a single ordered scan of
+    the index.
+
+    Args:
+        - db: open database
+
+    Returns:
+        iterator of named tuple records with `pathrow`, `productId`,
+        `acquisition_ts`, `cloudCover`, `tier` and `scene_rowid`
+    """
+    timestamp_str = (
+        db.timestamp_column
+        or "CAST(strftime('%s', acquisitionDate) AS INTEGER)")
+    query_str = (
+        f'SELECT pathrow, productId, {timestamp_str} AS acquisition_ts, '
+        f'cloudCover, tier, rowid AS scene_rowid FROM {db.table_name} '
+        'ORDER BY pathrow, acquisition_ts;')
+    return db.query(query_str)
+
+
+def find_watermark(db: SceneDB) -> Dict:
+    """Find watermark of newest scenes in database
+
+    Stored in mosaics created from the database, so that `update_from_db` can
+    later find scenes added since.
+
+    Args:
+        - db: open database
+
+    Returns:
+        dict with `rowid` of last inserted scene and newest `acquisition_date`
+        as 'YYYY-MM-DD'
+    """
+    timestamp_str = db.timestamp_column or 'acquisitionDate'
+    query_str = (
+        f'SELECT max(rowid) AS max_rowid, max({timestamp_str}) AS max_date '
+        f'FROM {db.table_name};')
+    record = next(db.query(query_str))
+
+    max_date = record.max_date
+    if max_date is not None:
+        if db.timestamp_column:
+            max_date = datetime.fromtimestamp(max_date, timezone.utc)
+            max_date = datetime.strftime(max_date, '%Y-%m-%d')
+        else:
+            max_date = max_date[:10]
+
+    return {'rowid': record.max_rowid, 'acquisition_date': max_date}
+
+
+def find_updated_pathrows(
+        db: SceneDB,
+        rowid: Optional[int] = None,
+        acquisition_date: Optional[str] = None) -> List[str]:
+    """Find pathrows with scenes added after watermark
+
+    Rowids only grow as scenes are appended, so a rowid watermark finds
+    exactly the new scenes. With an acquisition date, scenes acquired on or
+    after that day are found, which includes scenes acquired on the day of
+    the watermark but ingested later. Scenes ingested late with an older
+    acquisition date are missed.
+
+    Args:
+        - db: open database
+        - rowid: find scenes with a rowid greater than this
+        - acquisition_date: find scenes acquired on or after this date, as
+          'YYYY-MM-DD'. Only used when rowid is None.
+
+    Returns:
+        list of 6-character pathrows
+    """
+    if rowid is not None:
+        where_str = 'rowid > ?'
+        params = [rowid]
+    elif acquisition_date is not None:
+        date = coerce_to_datetime(acquisition_date)
+        if db.timestamp_column:
+            where_str = f'{db.timestamp_column} >= ?'
+            params = [date_to_ts(date)]
+        else:
+            where_str = 'DATE(acquisitionDate) >= DATE(?)'
+            params = [datetime.strftime(date, '%Y-%m-%d')]
+    else:
+        raise ValueError('rowid or acquisition_date required')
+
+    query_str = (
+        f'SELECT DISTINCT pathrow FROM {db.table_name} WHERE {where_str};')
+    return sorted(
+        format_pathrow(record.pathrow)
+        for record in db.query(query_str, params))
+
+
+def relax_thresholds(max_cloud: Optional[float]) -> List[float]:
+    """Cloud cover thresholds tried in turn when relaxing a query
+
+    When no scene matches, max_cloud is raised by 5 until it reaches 100. If
+    there's still no match, the last resort is the scene closest to the
+    midpoint of the date range, regardless of date range. That last resort
+    isn't used when the sort preference is already closest-to-date.
+
+    With `relax=True`, queries express this as a ranking instead of retries:
+    scenes in the date range are ranked first by the index of the first
+    threshold they pass, then by sort preference. Scenes only found by the
+    last resort come after, with `relax_tier` equal to `len(thresholds)`.
+
+    Args:
+        - max_cloud: maximum cloud cover percent of the original query
+
+    Returns:
+        list of thresholds, starting with max_cloud
+    """
+    thresholds = [max_cloud or 0]
+    while thresholds[-1] < 100:
+        thresholds.append(thresholds[-1] + 5)
+
+    return thresholds
+
+
+def _candidates_query(
+        table_name: str,
+        pathrow_terms: List[str],
+        pathrow_params: List,
+        columns: List[str],
+        max_cloud: float = 10,
+        min_date: str = None,
+        max_date: str = None,
+        sort_preference: Optional[str] = None,
+        relax: bool = False,
+        timestamp_column: Optional[str] = None) -> Tuple[str, List]:
+    """Generate subquery of candidate scenes, with their relaxation tier
+    """
+    columns = dict.fromkeys([
+        *columns, 'pathrow', timestamp_column or 'acquisitionDate',
+        'cloudCover', 'tier'])
+    column_str = ', '.join(columns)
+
+    date_terms, date_params = _date_terms(
+        min_date=min_date,
+        max_date=max_date,
+        timestamp_column=timestamp_column)
+    if not relax:
+        where_clause = [*pathrow_terms, *date_terms]
+        params = [*pathrow_params, *date_params]
+        if max_cloud:
+            where_clause.append('cloudCover <= ?')
+            params.append(max_cloud)
+
+        query_str = (
+            f'SELECT {column_str}, rowid AS scene_rowid, 0 AS relax_tier '
+            f'FROM {table_name}')
+        if where_clause:
+            query_str += f" WHERE {' AND '.join(where_clause)}"
+
+        return query_str, params
+
+    thresholds = relax_thresholds(max_cloud)
+    use_midpoint = sort_preference != 'closest-to-date'
+
+    # Scenes in date range are ranked by the first cloud threshold they pass
+    if max_cloud and len(thresholds) > 1:
+        bucket_str = 'CASE'
+        bucket_params = []
+        for ind, threshold in enumerate(thresholds[:-1]):
+            bucket_str += ' WHEN cloudCover <= ? THEN ?'
+            bucket_params.extend([threshold, ind])
+        bucket_str += ' ELSE ? END'
+        bucket_params.append(len(thresholds) - 1)
+    else:
+        # The original query has no cloud filter or can't be relaxed further
+        bucket_str = '0'
+        bucket_params = []
+
+    # Scenes out of date range can only be found by the last resort
+    in_range_str = ' AND '.join(date_terms)
+    if in_range_str:
+        relax_tier_str = f'CASE WHEN {in_range_str} THEN {bucket_str} ELSE ? END'
+        relax_tier_params = [*date_params, *bucket_params, len(thresholds)]
+    else:
+        relax_tier_str = bucket_str
+        relax_tier_params = bucket_params
+
+    where_clause = list(pathrow_terms)
+    where_params = list(pathrow_params)
+    if max_cloud:
+        where_clause.append('cloudCover <= ?')
+        where_params.append(thresholds[-1])
+
+        if in_range_str and not use_midpoint:
+            where_clause.append(in_range_str)
+            where_params.extend(date_params)
+
+    elif in_range_str and use_midpoint:
+        where_clause.append(f'({in_range_str} OR cloudCover <= ?)')
+        where_params.extend([*date_params, thresholds[-1]])
+
+    elif in_range_str:
+        where_clause.append(in_range_str)
+        where_params.extend(date_params)
+
+    query_str = (
+        f'SELECT {column_str}, rowid AS scene_rowid, '
+        f'{relax_tier_str} AS relax_tier FROM {table_name}')
+    if where_clause:
+        query_str += f" WHERE {' AND '.join(where_clause)}"
+
+    return query_str, [*relax_tier_params, *where_params]
+
+
+def _date_terms(
+        min_date: str = None,
+        max_date: str = None,
+        timestamp_column: Optional[str] = None) -> Tuple[List[str], List]:
+    """Generate conditions restricting scenes to date range
+
+    Both dates are inclusive. With a timestamp column, the same whole days are
+    expressed as a half-open range of seconds since epoch.
+    """
     where_clause = []
-    where_clause.append(f'pathrow = "{pathrow}"')
+    params = []
 
     if min_date:
         # Make sure min_date is >= when Landsat8 reached operational orbit
         min_date = coerce_to_datetime(min_date)
         min_date = max(min_date, LANDSAT8_MIN_DATE)
-        min_date = datetime.strftime(min_date, "%Y-%m-%d")
 
-        where_clause.append(f'DATE(acquisitionDate) >= DATE("{min_date}")')
+        if timestamp_column:
+            where_clause.append(f'{timestamp_column} >= ?')
+            params.append(date_to_ts(min_date))
+        else:
+            where_clause.append('DATE(acquisitionDate) >= DATE(?)')
+            params.append(datetime.strftime(min_date, "%Y-%m-%d"))
 
     if max_date:
-        where_clause.append(f'DATE(acquisitionDate) <= DATE("{max_date}")')
+        if timestamp_column:
+            where_clause.append(f'{timestamp_column} < ?')
+            params.append(
+                date_to_ts(coerce_to_datetime(max_date) + timedelta(days=1)))
+        else:
+            where_clause.append('DATE(acquisitionDate) <= DATE(?)')
+            params.append(max_date)
 
-    if max_cloud:
-        where_clause.append(f'cloudCover <= {max_cloud}')
+    return where_clause, params
 
-    execute_str += ' AND '.join(where_clause)
 
-    # Order clause
+def _order_clause(
+        max_cloud: float = 10,
+        min_date: str = None,
+        max_date: str = None,
+        sort_preference: Optional[str] = None,
+        tier_preference: List[str] = ['T1', 'T2', 'RT'],
+        closest_to_date: Optional[Union[datetime, str]] = None,
+        relax: bool = False,
+        timestamp_column: Optional[str] = None) -> Tuple[List[str], List]:
+    """Generate terms of order clause over the candidates subquery
+    """
     order_clause = []
+    params = []
+
+    preference_str, preference_params = _preference_term(
+        sort_preference=sort_preference,
+        closest_to_date=closest_to_date,
+        timestamp_column=timestamp_column,
+        descending=not relax)
+
+    if relax:
+        order_clause.append('relax_tier')
+
+    if relax and sort_preference != 'closest-to-date':
+        # The last resort is the scene closest to the midpoint of the date
+        # range
+        midpoint_str, midpoint_params = _preference_term(
+            sort_preference='closest-to-date',
+            closest_to_date=midpoint_date(min_date, max_date),
+            timestamp_column=timestamp_column)
+
+        order_clause.append(
+            f'CASE WHEN relax_tier < ? THEN {preference_str} '
+            f'ELSE {midpoint_str} END')
+        params.extend([
+            len(relax_thresholds(max_cloud)), *preference_params,
+            *midpoint_params])
+    else:
+        order_clause.append(preference_str)
+        params.extend(preference_params)
+
+    # Sort by tier after sorting by preference
+    if tier_preference:
+        # https://stackoverflow.com/a/3303876
+        # `tier` is name of column
+        s = 'CASE tier '
+        s += ' '.join(['WHEN ? THEN ?' for _ in tier_preference])
+        s += ' END'
+        order_clause.append(s)
+        for ind, val in enumerate(tier_preference):
+            params.extend([val, ind])
+
+    # Break remaining ties by insertion order, so that the per-pathrow and bulk
+    # queries always agree on the selected scene
+    order_clause.append('scene_rowid')
+
+    return order_clause, params
+
+
+def _preference_term(
+        sort_preference: Optional[str] = None,
+        closest_to_date: Optional[Union[datetime, str]] = None,
+        timestamp_column: Optional[str] = None,
+        descending: bool = True) -> Tuple[str, List]:
+    """Generate order term for sort preference
+
+    Args:
+        - descending: if False, the term is a plain expression that can be
+          used inside CASE, instead of possibly ending with DESC
+    """
+    if sort_preference == 'min-cloud':
+        return 'cloudCover', []
+
+    if timestamp_column and sort_preference == 'newest':
+        if descending:
+            return f'{timestamp_column} DESC', []
+
+        return f'-{timestamp_column}', []
+
+    if timestamp_column and sort_preference == 'oldest':
+        return timestamp_column, []
 
     if sort_preference == 'closest-to-date':
         closest_to_date = coerce_to_datetime(closest_to_date)
-        closest_to_date_timestamp = round(closest_to_date.timestamp())
-        order_clause.append(
-            f"abs(strftime('%s', datetime({closest_to_date_timestamp}, 'unixepoch')) - strftime('%s', acquisitionDate))"
-        )
     elif sort_preference == 'oldest':
         # Set very early "closest_to_date"
         closest_to_date = coerce_to_datetime('1970-01-01')
-        closest_to_date_timestamp = round(closest_to_date.timestamp())
-        order_clause.append(
-            f"abs(strftime('%s', datetime({closest_to_date_timestamp}, 'unixepoch')) - strftime('%s', acquisitionDate))"
-        )
     elif sort_preference == 'newest':
         # Set "closest_to_date" in the future
         closest_to_date = coerce_to_datetime('2050-01-01')
-        closest_to_date_timestamp = round(closest_to_date.timestamp())
-        order_clause.append(
-            f"abs(strftime('%s', datetime({closest_to_date_timestamp}, 'unixepoch')) - strftime('%s', acquisitionDate))"
-        )
-    elif sort_preference == 'min-cloud':
-        order_clause.append('cloudCover')
-
     else:
         raise ValueError('sort_preference not supported')
 
-    # Sort by tier after sorting by preference
-    if tier_preference:
-        # https://stackoverflow.com/a/3303876
-        # `tier` is name of column
-        s = 'CASE tier '
-        s += ' '.join([
-            f'WHEN "{val}" THEN {ind}'
-            for ind, val in enumerate(tier_preference)
-        ])
-        s += ' END'
-        order_clause.append(s)
+    closest_to_date_timestamp = round(closest_to_date.timestamp())
+    if timestamp_column:
+        return f'abs(? - {timestamp_column})', [closest_to_date_timestamp]
 
-    if order_clause:
-        execute_str += f" ORDER BY {', '.join(order_clause)}"
+    term = "abs(strftime('%s', datetime(?, 'unixepoch')) - strftime('%s', acquisitionDate))"
+    return term, [closest_to_date_timestamp]
 
-    if order_clause and limit:
-        execute_str += f' LIMIT {limit}'
 
-    execute_str += ';'
-    return execute_str
+@lru_cache(maxsize=None)
+def _record_type(columns: Tuple[str]):
+    """Named tuple class for records with given columns
+    """
+    return namedtuple('Record', columns)
 
 
-def run_query(conn, query_str: str) -> Dict:
+def run_query(conn, query_str: str, params: Iterable = ()) -> Iterator[Tuple]:
     """Run SQLite query on database
     Args:
         - conn: SQLite connection
         - query_str: string to run in SQLite
+        - params: values for `?` placeholders in query_str
+    """
+    cursor = conn.execute(query_str, tuple(params))
+    record_type = _record_type(tuple(d[0] for d in cursor.description))
+    return map(record_type._make, cursor)
+
+
+def format_pathrow(pathrow) -> str:
+    """Format pathrow from database as 6-character string
+
+    Databases from `prepare_db` store pathrow as an integer, while databases
+    from `scripts/csv_import.sql` store the 6-character string.
+    """
+    if isinstance(pathrow, str):
+        return pathrow
+
+    return f'{pathrow:06d}'
+
+
+def prepare_db(scene_path, sqlite_path, batch_size: int = 100_000):
+    """Create SQLite database of Landsat scenes from scene_list
+
+    The CSV is streamed, optionally gzipped, straight into the database. While
+    ingesting, typed `pathrow`, `acquisition_ts` (integer seconds since epoch)
+    and `tier` columns are derived, and afterwards a covering index for scene
+    selection is built.
+
+    Args:
+        - scene_path: path to scene_list or scene_list.gz from AWS S3
+        - sqlite_path: path for new sqlite database. Overwrites existing file.
+        - batch_size: number of rows inserted per `executemany` call
+    """
+    # Delete DB if already exists
+    if Path(sqlite_path).exists():
+        Path(sqlite_path).unlink()
+
+    file_opener = gzip.open if str(scene_path).endswith('.gz') else open
+    placeholders = ', '.join('?' * (len(SCENE_LIST_COLUMNS) + 3))
+    insert_sql = f'INSERT INTO scene_list VALUES ({placeholders});'
+
+    conn = sqlite3.connect(sqlite_path, isolation_level=None)
+    try:
+        # The database is written from scratch, so if the import fails it's
+        # just run again
+        conn.execute('PRAGMA journal_mode = OFF')
+        conn.execute('PRAGMA synchronous = OFF')
+        conn.execute('PRAGMA cache_size = -262144')
+        conn.execute(CREATE_SCENE_TABLE_SQL)
+
+        with file_opener(scene_path, 'rt', newline='') as f:
+            rows = parse_scene_list(f)
+
+            conn.execute('BEGIN')
+            count = 0
+            while True:
+                batch = list(islice(rows, batch_size))
+                if not batch:
+                    break
+
+                conn.executemany(insert_sql, batch)
+                count += len(batch)
+                print(f'Scenes: {count}', file=sys.stderr)
+
+            conn.execute('COMMIT')
+
+        conn.execute(CREATE_SCENE_INDEX_SQL)
+        conn.execute('ANALYZE')
+    finally:
+        conn.close()
+
+
+def parse_scene_list(lines: Iterable[str]) -> Iterator[Tuple]:
+    """Parse rows of scene_list CSV into rows of scene_list table
+
+    Args:
+        - lines: lines of scene_list CSV, including header
+
+    Returns:
+        iterator of tuples of values in order of `CREATE_SCENE_TABLE_SQL`
     """
-    cursor = conn.execute(query_str)
-    for row in cursor:
-        yield {k: row[k] for k in row.keys()}
+    reader = csv.reader(lines)
+    header = next(reader)
+    indices = [header.index(column) for column in SCENE_LIST_COLUMNS]
+
+    for line in reader:
+        (product_id, entity_id, acquisition_date, cloud_cover,
+         processing_level, path, row, min_lat, min_lon, max_lat, max_lon,
+         download_url) = [line[i] for i in indices]
+
+        path = int(path)
+        row = int(row)
+
+        acquisition_ts = _acquisition_ts(acquisition_date)
+
+        yield (
+            product_id, entity_id, acquisition_date, float(cloud_cover),
+            processing_level, path, row, float(min_lat), float(min_lon),
+            float(max_lat), float(max_lon), download_url, path * 1000 + row,
+            acquisition_ts, product_id[-2:])
+
+
+def parse_stac_feature(feature: Dict) -> Tuple:
+    """Parse Landsat 8 STAC item into row of scene_list table
+
+    Args:
+        - feature: STAC item from sat-api, e.g. from `stac.search_pages`
+
+    Returns:
+        tuple of values in order of `CREATE_SCENE_TABLE_SQL`, with the same
+        formats as rows from `parse_scene_list`
+    """
+    properties = feature['properties']
+    product_id = properties['landsat:product_id']
+    path = int(properties['eo:column'])
+    row = int(properties['eo:row'])
+
+    # acquisitionDate of scene_list is in UTC, as 'YYYY-MM-DD HH:MM:SS.ffffff'
+    acquired = date_parse(properties['datetime'])
+    if acquired.tzinfo is not None:
+        acquired = acquired.astimezone(timezone.utc).replace(tzinfo=None)
+    acquisition_date = acquired.strftime('%Y-%m-%d %H:%M:%S.%f')
+
+    min_lon, min_lat, max_lon, max_lat = feature['bbox']
+    download_url = feature.get('assets', {}).get('index', {}).get('href') or (
+        'https://s3-us-west-2.amazonaws.com/landsat-pds/c1/L8/'
+        f'{path:03d}/{row:03d}/{product_id}/index.html')
+
+    return (
+        product_id, properties.get('landsat:scene_id'), acquisition_date,
+        float(properties['eo:cloud_cover']),
+        properties.get('landsat:processing_level', product_id[5:9]), path,
+        row, float(min_lat), float(min_lon), float(max_lat), float(max_lon),
+        download_url, path * 1000 + row, _acquisition_ts(acquisition_date),
+        product_id[-2:])
+
+
+def _acquisition_ts(acquisition_date: str) -> int:
+    """Whole seconds since epoch of acquisitionDate, treating it as UTC
+
+    Identical to SQLite's `strftime('%s', acquisitionDate)`, which rounds to
+    the nearest millisecond before truncating to seconds.
+
+    Args:
+        - acquisition_date: date as 'YYYY-MM-DD HH:MM:SS.ffffff'
+    """
+    delta = datetime.fromisoformat(acquisition_date[:19]) - _EPOCH
+    fraction = acquisition_date[20:26]
+    microseconds = int(fraction.ljust(6, '0')) if fraction else 0
+
+    milliseconds = (delta // _MILLISECOND) + (microseconds + 500) // 1000
+    return milliseconds // 1000
@@ -0,0 +1,270 @@
+"""
+landsat_cogeo_mosaic.harvest: Mirror STAC API items into SQLite database of scenes
+"""
+import json
+import sqlite3
+import sys
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import requests
+
+from landsat_cogeo_mosaic.db import (
+    CREATE_SCENE_INDEX_SQL, CREATE_SCENE_TABLE_SQL, parse_stac_feature)
+from landsat_cogeo_mosaic.stac import search_pages
+from landsat_cogeo_mosaic.util import coerce_to_datetime, get_hash
+
+CREATE_MARK_TABLE_SQL = """\
+CREATE TABLE IF NOT EXISTS harvest_marks (
+    collection TEXT NOT NULL,
+    query_hash TEXT NOT NULL,
+    query TEXT NOT NULL,
+    max_acquisition_ts INTEGER NOT NULL,
+    PRIMARY KEY (collection, query_hash)
+)"""
+
+# Index to find existing scenes when upserting
+CREATE_PRODUCT_INDEX_SQL = """\
+CREATE INDEX IF NOT EXISTS scene_product_idx ON scene_list(productId)"""
+
+# Number of columns of scene_list table, and position of acquisition_ts
+_NUM_COLUMNS = 15
+_ACQUISITION_TS = 13
+
+# Max number of productIds to find in one query, within SQLite's default limit
+# of 999 variables
+_MAX_VARIABLES = 500
+
+
+def harvest(
+        sqlite_path,
+        bounds: List[float],
+        min_cloud: float = 0,
+        max_cloud: float = 100,
+        min_date=None,
+        max_date=None,
+        collection: str = 'landsat-8-l1',
+        stac_collection_limit: int = 500,
+        stac_url: str = "https://sat-api.developmentseed.org",
+        session: Optional[requests.Session] = None,
+        concurrency: int = 4) -> Dict:
+    """Upsert STAC API search results into scene_list table of database
+
+    The database is created if it doesn't exist, with the schema of
+    `db.prepare_db`. The newest acquisition time harvested is stored per
+    collection and search, so that harvesting the same search again without
+    min_date only requests items acquired on or after the day of the newest
+    scene. Scenes already in the database are only rewritten when they
+    changed, so rowid watermarks of `update_from_db` find exactly the new and
+    changed scenes.
+
+    Args:
+        - sqlite_path: path to sqlite database
+        - bounds: minx, miny, maxx, maxy
+        - min_cloud: Minimum cloud percentage
+        - max_cloud: Maximum cloud percentage
+        - min_date: (str or datetime.datetime) Minimum date. Defaults to the
+          day of the newest scene harvested by the same search, or
+          2013-01-01 if never harvested.
+        - max_date: (str or datetime.datetime) Maximum date, inclusive.
+          Defaults to today.
+        - collection: STAC collection. Only landsat-8-l1 is supported by
+          `stac.search_pages`.
+        - stac_collection_limit: Limits the number of items per page returned by sat-api.
+        - stac_url: Endpoint to use
+        - session: session from `stac.create_session`
+        - concurrency: max number of concurrent requests
+
+    Returns:
+        dict of counts of `inserted`, `updated` and `unchanged` scenes
+    """
+    if collection != 'landsat-8-l1':
+        raise ValueError(f'Unsupported collection: {collection}')
+
+    max_date = coerce_to_datetime(max_date or datetime.today())
+
+    # The high-water mark only applies to the same search area and clouds
+    query = {
+        'bounds': list(bounds),
+        'min_cloud': min_cloud,
+        'max_cloud': max_cloud,
+        'stac_url': stac_url}
+    query_hash = get_hash(**query)
+
+    conn = connect_harvest_db(sqlite_path)
+    try:
+        # An explicit min_date, e.g. to backfill older scenes, overrides the
+        # mark
+        mark = find_harvest_mark(conn, collection, query_hash)
+        if min_date is not None:
+            min_date = coerce_to_datetime(min_date)
+        elif mark is not None:
+            mark_date = datetime.fromtimestamp(mark, timezone.utc)
+            print(
+                f'Harvested up to {mark_date:%Y-%m-%dT%H:%M:%SZ}',
+                file=sys.stderr)
+            min_date = mark_date.replace(tzinfo=None)
+        else:
+            min_date = coerce_to_datetime('2013-01-01')
+
+        counts = {'inserted': 0, 'updated': 0, 'unchanged': 0}
+        if min_date > max_date:
+            return counts
+
+        pages = search_pages(
+            bounds=bounds,
+            min_cloud=min_cloud,
+            max_cloud=max_cloud,
+            min_date=min_date,
+            max_date=max_date,
+            stac_collection_limit=stac_collection_limit,
+            stac_url=stac_url,
+            session=session,
+            concurrency=concurrency)
+
+        # Only advance the mark once every page is stored, as pages arrive in
+        # no particular order of time
+        max_ts = mark
+        for page in pages:
+            scenes = [parse_stac_feature(feature) for feature in page]
+            with conn:
+                for key, count in upsert_scenes(conn, scenes).items():
+                    counts[key] += count
+
+            page_max_ts = max(
+                (scene[_ACQUISITION_TS] for scene in scenes), default=None)
+            if page_max_ts is not None:
+                max_ts = max(max_ts or page_max_ts, page_max_ts)
+
+        if max_ts is not None:
+            with conn:
+                conn.execute(
+                    'INSERT OR REPLACE INTO harvest_marks VALUES (?, ?, ?, ?)',
+                    (collection, query_hash, json.dumps(query, sort_keys=True),
+                     max_ts))
+    finally:
+        conn.close()
+
+    print(
+        'Inserted {inserted}, updated {updated}, unchanged {unchanged} scenes'
+        .format(**counts),
+        file=sys.stderr)
+    return counts
+
+
+def connect_harvest_db(sqlite_path) -> sqlite3.Connection:
+    """Open database for harvesting, creating tables that don't exist
+
+    Args:
+        - sqlite_path: path to sqlite database
+    """
+    conn = sqlite3.connect(str(sqlite_path))
+    table_exists = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' "
+        "AND name = 'scene_list'").fetchone()
+    if not table_exists:
+        with conn:
+            conn.execute(CREATE_SCENE_TABLE_SQL)
+            conn.execute(CREATE_SCENE_INDEX_SQL)
+    else:
+        columns = {
+            row[1] for row in conn.execute('PRAGMA table_info(scene_list)')}
+        if 'acquisition_ts' not in columns:
+            conn.close()
+            raise ValueError(
+                f'{sqlite_path} is missing columns of `prepare-db`. Create '
+                'the database with `landsat-cogeo-mosaic prepare-db`.')
+
+    with conn:
+        conn.execute(CREATE_PRODUCT_INDEX_SQL)
+        conn.execute(CREATE_MARK_TABLE_SQL)
+
+    return conn
+
+
+def find_harvest_mark(
+        conn: sqlite3.Connection, collection: str,
+        query_hash: str) -> Optional[int]:
+    """Find newest acquisition time harvested for search
+
+    Args:
+        - conn: connection from `connect_harvest_db`
+        - collection: STAC collection
+        - query_hash: hash of search parameters
+
+    Returns:
+        seconds since epoch, or None if never harvested
+    """
+    row = conn.execute(
+        'SELECT max_acquisition_ts FROM harvest_marks '
+        'WHERE collection = ? AND query_hash = ?',
+        (collection, query_hash)).fetchone()
+    return row[0] if row else None
+
+
+def upsert_scenes(
+        conn: sqlite3.Connection, scenes: Iterable[Tuple]) -> Dict[str, int]:
+    """Insert scenes, replacing existing scenes with the same productId
+
+    Changed scenes are inserted before their old rows are deleted, so they
+    always get a rowid above every existing scene, even when the old row was
+    the newest.
+
+    Args:
+        - conn: connection from `connect_harvest_db`
+        - scenes: tuples of values in order of `CREATE_SCENE_TABLE_SQL`,
+          e.g. from `db.parse_stac_feature`
+
+    Returns:
+        dict of counts of `inserted`, `updated` and `unchanged` scenes
+    """
+    scenes = list(scenes)
+    placeholders = ', '.join('?' * _NUM_COLUMNS)
+    insert_sql = f'INSERT INTO scene_list VALUES ({placeholders});'
+
+    # Dict of {productId: [(rowid, scene)]}
+    existing = find_scenes(conn, [scene[0] for scene in scenes])
+
+    counts = {'inserted': 0, 'updated': 0, 'unchanged': 0}
+    for scene in scenes:
+        rows = existing.get(scene[0], [])
+        if [row for _, row in rows] == [scene]:
+            counts['unchanged'] += 1
+            continue
+
+        rowid = conn.execute(insert_sql, scene).lastrowid
+        if rows:
+            conn.executemany(
+                'DELETE FROM scene_list WHERE rowid = ?',
+                [(old_rowid, ) for old_rowid, _ in rows])
+            counts['updated'] += 1
+        else:
+            counts['inserted'] += 1
+
+        existing[scene[0]] = [(rowid, scene)]
+
+    return counts
+
+
+def find_scenes(conn: sqlite3.Connection,
+                product_ids: List[str]) -> Dict[str, List[Tuple[int, Tuple]]]:
+    """Find existing scenes by productId
+
+    Args:
+        - conn: connection from `connect_harvest_db`
+        - product_ids: productIds to find
+
+    Returns:
+        dict of {productId: [(rowid, scene)]}
+    """
+    existing = {}
+    for start in range(0, len(product_ids), _MAX_VARIABLES):
+        chunk = product_ids[start:start + _MAX_VARIABLES]
+        placeholders = ', '.join('?' * len(chunk))
+        rows = conn.execute(
+            'SELECT rowid, * FROM scene_list '
+            f'WHERE productId IN ({placeholders}) ORDER BY rowid', chunk)
+        for rowid, *scene in rows:
+            existing.setdefault(scene[0], []).append((rowid, tuple(scene)))
+
+    return existing
@@ -1,20 +1,54 @@
 """
 landsat_cogeo_mosaic.index.py: Create optimized path-row to quadkey index
 """
-from typing import List
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from typing import Dict, Iterable, List, Optional, Tuple
 
 import geopandas as gpd
 import mercantile
+import numpy as np
 import pandas as pd
-from shapely.geometry import asShape, box
+import shapely
+from shapely.geometry import box
 
+from landsat_cogeo_mosaic.cover import bounds_tiles, cover_geometries
+from landsat_cogeo_mosaic.quadkey import (
+    pack_tiles, tiles_to_bounds, tiles_to_quadkeys)
 
-def create_index(pathrow_path, scene_path, bounds, quadkey_zoom):
+
+def create_index(
+        pathrow_path,
+        scene_path,
+        bounds,
+        quadkey_zoom,
+        shard_zoom: int = 0,
+        workers: int = 1):
     """Create index of path-row to quadkey_zoom
 
     - First get mapping from _quadkey_ to pathrow
     - then optimize this mapping
     - Then reverse it to have mapping from pathrow to quadkey
+
+    The tiles intersecting each path-row are found with `cover.cover_geometries`,
+    so only tiles near path-rows are created. Pairs of path-row and tile are
+    split into shards by the parent tile at shard_zoom, so that only the
+    tiles of one shard are optimized at a time. Each shard is written to a
+    temporary file, and shards are merged in order of quadkey, so the index
+    is the same for any shard_zoom and workers.
+
+    Args:
+        - pathrow_path: path to Shapefile of WRS2 polygons
+        - scene_path: path to CSV of scene metadata
+        - bounds: minx, miny, maxx, maxy
+        - quadkey_zoom: zoom of quadkeys in index
+        - shard_zoom: zoom of tiles that tiles are split into shards by. At
+          most quadkey_zoom. 0 is a single shard.
+        - workers: number of processes used to index shards
     """
     # Load pathrow geometries
     pathrows = gpd.read_file(pathrow_path)
@@ -29,55 +63,187 @@ def create_index(pathrow_path, scene_path, bounds, quadkey_zoom):
     # Filter on pathrows that actually exist
     pathrows = pathrows[pathrows['PR'].isin(scene_pathrows)]
 
-    # df of mercator tiles at quadkey zoom
-    tiles = create_tiles_gdf(bounds, quadkey_zoom)
-    tiles = tiles[['geometry', 'quadkey']]
+    # n:n mapping between pathrows and tiles
+    pathrow_positions, x, y = cover_geometries(
+        pathrows.geometry.to_numpy(), bounds, quadkey_zoom)
+    shards = shard_pairs(
+        pathrow_positions, x, y, quadkey_zoom, min(shard_zoom, quadkey_zoom))
 
-    # Spatial join, keeping geometry of the pathrows
-    # joined is an n:n mapping between pathrows and quadkeys
-    joined = gpd.sjoin(pathrows, tiles, op='intersects')
+    # Dict of {pathrow: [quadkeys]}
+    index = {}
+    with TemporaryDirectory() as tmp_dir:
+        if workers > 1:
+            with ProcessPoolExecutor(
+                    max_workers=workers,
+                    initializer=_init_shard_worker,
+                    initargs=(pathrows, )) as executor:
+                futures = [
+                    executor.submit(
+                        _index_shard, shard_quadkey, positions, x, y,
+                        quadkey_zoom, tmp_dir)
+                    for shard_quadkey, positions, x, y in shards]
+                shard_paths = (future.result() for future in futures)
+                _merge_shards(index, shard_paths, len(shards))
+        else:
+            _init_shard_worker(pathrows)
+            shard_paths = (
+                _index_shard(
+                    shard_quadkey, positions, x, y, quadkey_zoom, tmp_dir)
+                for shard_quadkey, positions, x, y in shards)
+            _merge_shards(index, shard_paths, len(shards))
+            _init_shard_worker(None)
 
-    # Optimize
-    gdf = optimize_index(joined)
+    return {pathrow: index[pathrow] for pathrow in sorted(index)}
 
-    gdf = gdf.set_index('PR')
-    # Dict of {pathrow: [quadkeys]}
-    # https://stackoverflow.com/a/29876239
-    return gdf.groupby(gdf.index)['quadkey'].apply(list).to_dict()
+
+def shard_pairs(
+        pathrow_positions: np.ndarray, x: np.ndarray, y: np.ndarray,
+        quadkey_zoom: int, shard_zoom: int
+) -> List[Tuple[str, np.ndarray, np.ndarray, np.ndarray]]:
+    """Split pairs of path-row and tile into shards by parent tile
+
+    Args:
+        - pathrow_positions, x, y: arrays of pairs of position of path-row
+          and tile, e.g. from `cover.cover_geometries`
+        - quadkey_zoom: zoom of tiles
+        - shard_zoom: zoom of parent tiles, at most quadkey_zoom
+
+    Returns:
+        list of (quadkey of parent tile, pathrow_positions, x, y) sorted by
+        quadkey, where pairs within each shard are in their original order
+    """
+    shift = quadkey_zoom - shard_zoom
+    shard_quadkeys = tiles_to_quadkeys(
+        x >> shift, y >> shift, np.full(len(x), shard_zoom))
+
+    unique_quadkeys, inverse = np.unique(
+        np.array(shard_quadkeys, dtype=str), return_inverse=True)
+    order = np.argsort(inverse, kind='stable')
+    splits = np.cumsum(np.bincount(inverse, minlength=len(unique_quadkeys)))
+    return [(str(shard_quadkey), pathrow_positions[positions], x[positions],
+             y[positions]) for shard_quadkey, positions in zip(
+                 unique_quadkeys, np.split(order, splits[:-1]))]
 
 
 def create_tiles_gdf(
-        bounds: List[float], quadkey_zoom: int) -> gpd.GeoDataFrame:
+        bounds: List[float],
+        quadkey_zoom: int,
+        quadkeys: bool = True) -> gpd.GeoDataFrame:
     """Create GeoDataFrame of all tiles within bounds at quadkey_zoom
+
+    Args:
+        - bounds: minx, miny, maxx, maxy
+        - quadkey_zoom: zoom of tiles
+        - quadkeys: add `quadkey` column of quadkey strings. Creating the
+          strings is most of the time for many tiles.
+
+    Returns:
+        GeoDataFrame of tile polygons in the order of `mercantile.tiles`,
+        with `tile` column of tiles packed by `quadkey.pack_tiles`
+    """
+    x, y = bounds_tiles(bounds, quadkey_zoom)
+    z = np.full(len(x), quadkey_zoom)
+    west, south, east, north = tiles_to_bounds(x, y, z)
+
+    columns = {'tile': pack_tiles(x, y, z)}
+    if quadkeys:
+        columns['quadkey'] = tiles_to_quadkeys(x, y, z)
+
+    geometry = shapely.box(west, south, east, north, ccw=False)
+    return gpd.GeoDataFrame(columns, geometry=geometry, crs='EPSG:4326')
+
+
+# Path-rows of the process indexing shards, set by `_init_shard_worker`
+_shard_pathrows: Optional[gpd.GeoDataFrame] = None
+
+
+def _init_shard_worker(pathrows: Optional[gpd.GeoDataFrame]):
+    global _shard_pathrows
+    _shard_pathrows = pathrows
+
+
+def _index_shard(
+        shard_quadkey: str, pathrow_positions: np.ndarray, x: np.ndarray,
+        y: np.ndarray, quadkey_zoom: int, out_dir: str) -> str:
+    """Optimize index of tiles of one shard and write it to file
+
+    Args:
+        - shard_quadkey: quadkey of parent tile of shard
+        - pathrow_positions, x, y: arrays of pairs of position of path-row
+          and tile of shard
+        - quadkey_zoom: zoom of tiles
+        - out_dir: directory to write file in
+
+    Returns:
+        path of JSON file of [pathrow, quadkey] pairs, in order of quadkey
+    """
+    # Path-rows with the quadkey of each tile they intersect
+    joined = _shard_pathrows.iloc[pathrow_positions].copy()
+    joined['quadkey'] = tiles_to_quadkeys(x, y, np.full(len(x), quadkey_zoom))
+
+    # Optimize
+    gdf = optimize_index(joined)
+    rows = list(zip(gdf['PR'].tolist(), gdf['quadkey'].tolist()))
+
+    path = Path(out_dir) / f'shard_{shard_quadkey}.json'
+    with open(path, 'w') as f:
+        json.dump(rows, f, separators=(',', ':'))
+
+    return str(path)
+
+
+def _merge_shards(index: Dict, shard_paths: Iterable[str], num_shards: int):
+    """Add path-rows of each quadkey in shard files to index, deleting files
+
+    Args:
+        - index: dict of {pathrow: [quadkeys]} to add to
+        - shard_paths: files from `_index_shard`, in order of quadkey
+        - num_shards: number of shards, for progress
     """
-    features = [
-        mercantile.feature(tile, props={'quadkey': mercantile.quadkey(tile)})
-        for tile in mercantile.tiles(*bounds, quadkey_zoom)
-    ]
-    return gpd.GeoDataFrame.from_features(features, crs='EPSG:4326')
+    for i, path in enumerate(shard_paths, 1):
+        with open(path) as f:
+            rows = json.load(f)
+
+        for pathrow, quadkey in rows:
+            index.setdefault(pathrow, []).append(quadkey)
 
+        os.remove(path)
+        print(f'Shards: {i}/{num_shards}', file=sys.stderr)
 
-def optimize_index(gdf):
+
+def optimize_index(gdf: gpd.GeoDataFrame) -> gpd.GeoDataFrame:
     """Optimize index by selecting minimal pathrows per quadkey
 
     Within each quadkey, optimize
 
     Args:
         - gdf: joined GeoDataFrame
+
+    Returns:
+        rows of gdf selected by `optimize_group`, grouped by quadkey in sorted
+        order and within each quadkey in order of selection
     """
     # Reproject to web mercator to use a projected CRS for tile geometry
     # intersections
-    gdf = gdf.to_crs(epsg=3857)
+    geometries = gdf.geometry.to_crs(epsg=3857).values.to_numpy()
+    quadkeys = gdf['quadkey'].to_numpy()
 
-    # List to collect results
-    res_df = []
-    for quadkey, group in gdf.groupby('quadkey'):
-        res_df.append(optimize_group(group, quadkey))
+    # Positions of rows of each quadkey, in sorted order of quadkey and in
+    # order of gdf within each quadkey
+    unique_quadkeys, inverse = np.unique(quadkeys, return_inverse=True)
+    order = np.argsort(inverse, kind='stable')
+    splits = np.cumsum(np.bincount(inverse, minlength=len(unique_quadkeys)))
 
-    return pd.concat(res_df).set_crs(crs=3857).to_crs(epsg=4326)
+    selected = []
+    groups = np.split(order, splits[:-1])
+    for quadkey, positions in zip(unique_quadkeys, groups):
+        assets = optimize_group(geometries[positions], quadkey)
+        selected.extend(positions[assets])
 
+    return gdf.iloc[selected]
 
-def optimize_group(group, quadkey):
+
+def optimize_group(geometries: np.ndarray, quadkey: str) -> List[int]:
     """Try to find the minimal number of assets to cover tile
     This optimization implies _both_ that
     - assets will be ordered in the MosaicJSON in order of sort of the entire tile
@@ -86,43 +252,110 @@ def optimize_group(group, quadkey):
     general be possible in finite time, so this is a naive method that should
     work relatively well for this use case.
 
-    Returns group also sorted with respect to intersection of entire tile.
+    Each step greedily selects the asset covering the largest area of the
+    region of tile that is left. Only assets intersecting the area covered by
+    the selected asset are intersected with the tile again, found with an
+    STRtree, unless the areas of other assets are within rounding error of a
+    tie.
+
+    Args:
+        - geometries: array of shapely geometries of assets in web mercator
+        - quadkey: quadkey of tile
+
+    Returns:
+        indices of selected assets in geometries, in order of selection
     """
     tile = mercantile.quadkey_to_tile(quadkey)
     tile_geom = box(*mercantile.xy_bounds(tile))
+    tree = shapely.STRtree(geometries)
+
+    # Area of each asset intersecting the region of tile that is left
+    areas = np.full(len(geometries), np.nan)
+    intersections = np.empty(len(geometries), dtype=object)
+    stale = np.arange(len(geometries))
+
+    # Indices of assets that are left, in order of the previous step
+    candidates = np.arange(len(geometries))
     final_assets = []
 
     while True:
         # Find intersection percent
-        group['int_pct'] = group.geometry.intersection(
-            tile_geom).area / tile_geom.area
+        intersections[stale] = shapely.intersection(
+            geometries[stale], tile_geom)
+        areas[stale] = shapely.area(intersections[stale])
+        int_pct = areas[candidates] / tile_geom.area
+
+        # Areas that weren't recomputed are only the same up to rounding.
+        # When they're that close to a tie, recompute them, so that ties are
+        # sorted the same as when every area is recomputed.
+        cached = ~np.isin(candidates, stale)
+        if cached.any() and _has_near_ties(int_pct, cached):
+            rest = candidates[cached]
+            intersections[rest] = shapely.intersection(
+                geometries[rest], tile_geom)
+            areas[rest] = shapely.area(intersections[rest])
+            int_pct = areas[candidates] / tile_geom.area
 
         # Remove features with no tile overlap
-        group = group.loc[group['int_pct'] > 0]
+        keep = int_pct > 0
+        candidates = candidates[keep]
+        int_pct = int_pct[keep]
 
-        if len(group) == 0:
+        if len(candidates) == 0:
             # There are many ocean/border tiles on the edges of available maps
             # that by definition don't have full coverage
             break
 
         # Sort by cover of region of tile that is left
-        group = group.sort_values('int_pct', ascending=False)
+        candidates = candidates[_argsort_descending(int_pct)]
 
         # Remove top asset and add to final_assets
-        top_asset = group.iloc[0]
-        group = group.iloc[1:]
-        final_assets.append(top_asset)
+        top_asset = candidates[0]
+        candidates = candidates[1:]
+        final_assets.append(int(top_asset))
 
         # Recompute tile_geom, removing overlap with top_asset
-        tile_geom = tile_geom.difference(top_asset.geometry)
+        tile_geom = tile_geom.difference(geometries[top_asset])
 
         # When total area is covered, stop
         if tile_geom.area - 1e-4 < 0:
             break
 
-        if len(group) == 0:
+        if len(candidates) == 0:
             # There are many ocean/border tiles on the edges of available maps
             # that by definition don't have full coverage
             break
 
-    return gpd.GeoDataFrame(final_assets)
+        # Only the coverage of assets overlapping the newly covered area
+        # changed
+        stale = np.intersect1d(
+            tree.query(intersections[top_asset], predicate='intersects'),
+            candidates)
+
+    return final_assets
+
+
+def _argsort_descending(values: np.ndarray) -> np.ndarray:
+    """Indices that sort values in descending order
+
+    The same as pandas' `sort_values(ascending=False)`, including the order of
+    ties, which depends on NumPy's unstable quicksort.
+    """
+    indices = np.arange(len(values))[::-1]
+    return indices[values[::-1].argsort(kind='quicksort')][::-1]
+
+
+def _has_near_ties(values: np.ndarray, cached: np.ndarray) -> bool:
+    """Whether any cached value is within rounding error of another or of 0
+
+    Args:
+        - values: positive or zero values
+        - cached: mask of values that weren't recomputed
+    """
+    tolerance = 1e-9 * values.max()
+    if np.any(values[cached] <= tolerance):
+        return True
+
+    order = np.argsort(values)
+    close = np.diff(values[order]) <= tolerance
+    return bool(np.any(close & (cached[order][1:] | cached[order][:-1])))
@@ -27,18 +27,27 @@ OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
 OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 """
 
-import gzip
-import json
 import sys
-from datetime import datetime
-from typing import Dict, List, Optional, Set, Union
-
-import mercantile
+from array import array
+from collections import Counter
+from collections.abc import Mapping
+from concurrent.futures import ProcessPoolExecutor
+from itertools import groupby
+from typing import (
+    Container, Dict, Iterable, List, Optional, Set, Tuple, Union)
+
+import numpy as np
 from cogeo_mosaic.mosaic import MosaicJSON
-from rio_tiler_pds.landsat.utils import sceneid_parser
 
-from landsat_cogeo_mosaic.db import find_records, generate_query
-from landsat_cogeo_mosaic.util import coerce_to_datetime, index_data_path
+from landsat_cogeo_mosaic.catalog import load_catalog
+from landsat_cogeo_mosaic.db import (
+    SceneDB, connect, find_best_records, find_updated_pathrows,
+    find_watermark, format_pathrow, generate_query, iter_scenes,
+    relax_thresholds)
+from landsat_cogeo_mosaic.quadkey import (
+    pack_quadkey, quadkeys_to_tiles, tiles_to_bounds, unpack_quadkeys)
+from landsat_cogeo_mosaic.selection import scene_ranker, select_scene
+from landsat_cogeo_mosaic.util import load_index_data, pathrow_from_product_id
 
 
 def landsat_accessor(feature: Dict):
@@ -46,19 +55,20 @@ def landsat_accessor(feature: Dict):
 
 
 def features_to_mosaicJSON(
-        features: List[Dict],
+        features: Iterable[Dict],
         quadkey_zoom: int = None,
         minzoom: int = 7,
         maxzoom: int = 12,
-        index: Union[bool, Dict] = True,
+        index: Union[bool, Mapping] = True,
         sort='min-cloud') -> Dict:
     """
     Create a mosaicJSON from stac features.
 
     Attributes
     ----------
-    features : list
-        sat-api features.
+    features : iterable
+        sat-api features. With an index, features are read one at a time and
+        only the selected feature of each pathrow is kept.
     minzoom : int, optional, (default: 7)
         Mosaic Min Zoom.
     maxzoom : int, optional (default: 12)
@@ -71,44 +81,21 @@ def features_to_mosaicJSON(
     """
     if not index:
         mosaic = MosaicJSON.from_features(
-            features=features,
+            features=list(features),
             minzoom=minzoom,
             maxzoom=maxzoom,
             quadkey_zoom=quadkey_zoom,
             accessor=landsat_accessor)
         return mosaic.dict(exclude_none=True)
 
-    if not isinstance(index, dict):
-        path = index_data_path()
-        with gzip.open(path, 'rt') as f:
-            index = json.load(f)
+    if not isinstance(index, Mapping):
+        index = load_index_data()
 
     # Define quadkey zoom from index
-    quadkey_zoom = len(list(index.values())[0][0])
-
-    pr_keys = set(index.keys())
-    sorted_features = {}
-    for feature in features:
-        pathrow = feature['properties']['eo:column'].zfill(
-            3) + feature['properties']['eo:row'].zfill(3)
-        if pathrow not in pr_keys:
-            continue
-
-        sorted_features[pathrow] = sorted_features.get(pathrow, [])
-        sorted_features[pathrow].append(feature)
+    quadkey_zoom = index_quadkey_zoom(index)
 
     tiles = {}
-    for pathrow, feats in sorted_features.items():
-        if sort == 'min-cloud':
-            selected = min(
-                feats, key=lambda x: x['properties']['eo:cloud_cover'])
-        elif sort == 'max-cloud':
-            selected = max(
-                feats, key=lambda x: x['properties']['eo:cloud_cover'])
-        else:
-            selected = feats[0]
-
-        product_id = landsat_accessor(selected)
+    for pathrow, product_id in select_features(features, index, sort).items():
         quadkeys = index[pathrow]
 
         for qk in quadkeys:
@@ -126,116 +113,478 @@ def features_to_mosaicJSON(
     return mosaic.dict(exclude_none=True)
 
 
+def select_features(features: Iterable[Dict], pathrows: Container[str],
+                    sort='min-cloud') -> Dict[str, str]:
+    """Select one feature of each pathrow, reading features one at a time
+
+    Only the current best feature of each pathrow is kept, so memory doesn't
+    grow with the number of features.
+
+    Args:
+        - features: iterable of sat-api features
+        - pathrows: pathrows to select features for, e.g. pathrow-quadkey index
+        - sort: 'min-cloud' or 'max-cloud' to select the feature with least or
+          most cloud cover, otherwise the first feature. Ties keep the first
+          feature.
+
+    Returns:
+        dict of {pathrow: product id}, in order of first feature of pathrow
+    """
+    # {pathrow: (cloud cover, product id)}
+    selected = {}
+    for feature in features:
+        properties = feature['properties']
+        pathrow = properties['eo:column'].zfill(3) + properties['eo:row'].zfill(3)
+        if pathrow not in pathrows:
+            continue
+
+        current = selected.get(pathrow)
+        if current is not None:
+            cloud_cover = properties['eo:cloud_cover']
+            if sort == 'min-cloud':
+                better = cloud_cover < current[0]
+            elif sort == 'max-cloud':
+                better = cloud_cover > current[0]
+            else:
+                better = False
+
+            if not better:
+                continue
+
+        selected[pathrow] = (
+            properties['eo:cloud_cover'], landsat_accessor(feature))
+
+    return {
+        pathrow: product_id
+        for pathrow, (_, product_id) in selected.items()}
+
+
+def index_quadkey_zoom(index: Mapping) -> int:
+    """Get zoom of quadkeys of pathrow-quadkey index
+
+    Args:
+        - index: `util.PathrowIndex` or dict of {pathrow: [quadkey, ...]}
+    """
+    quadkey_zoom = getattr(index, 'quadkey_zoom', None)
+    if quadkey_zoom is None:
+        quadkey_zoom = len(next(iter(index.values()))[0])
+
+    return quadkey_zoom
+
+
 def quadkeys_to_bounds(quadkeys: List[str]):
     """Convert list of quadkeys to bounds
 
     Args:
         - quadkeys: List of quadkeys
     """
-    tile_bounds = [
-        mercantile.bounds(mercantile.quadkey_to_tile(qk)) for qk in quadkeys
-    ]
-
-    minx = 180
-    miny = 90
-    maxx = -180
-    maxy = -90
-    for tb in tile_bounds:
-        minx = min(minx, tb[0])
-        miny = min(miny, tb[1])
-        maxx = max(maxx, tb[2])
-        maxy = max(maxy, tb[3])
-
-    return [minx, miny, maxx, maxy]
+    x, y, z = quadkeys_to_tiles(quadkeys)
+    if not len(z):
+        return [180, 90, -180, -90]
+
+    # Bounds grow with x and shrink with y within a zoom, so only the outermost
+    # tiles of each zoom are converted
+    tiles = []
+    for zoom in np.unique(z).tolist():
+        in_zoom = z == zoom
+        tiles.append((x[in_zoom].min(), y[in_zoom].max(), zoom))
+        tiles.append((x[in_zoom].max(), y[in_zoom].min(), zoom))
+
+    west, south, east, north = tiles_to_bounds(*zip(*tiles))
+    return [
+        west.min().item(),
+        south.min().item(),
+        east.max().item(),
+        north.max().item()]
 
 
 def create_from_db(
-        sqlite_path, pr_index, max_cloud, min_date, max_date, min_zoom,
-        max_zoom, sort_preference, closest_to_date):
+        sqlite_path,
+        pr_index,
+        max_cloud,
+        min_date,
+        max_date,
+        min_zoom,
+        max_zoom,
+        sort_preference,
+        closest_to_date,
+        workers: int = 1,
+        engine: str = 'sqlite',
+        compact: bool = False,
+        as_parser: bool = False):
     """Create MosaicJSON from SQLite database of Landsat features
+
+    Args:
+        - workers: number of processes used to select assets. With more than
+          one, pathrows are split into shards that each process selects with
+          its own read-only connection. The mosaic is identical to a serial
+          run. Only used by the sqlite engine.
+        - engine: 'sqlite' to select assets with queries, or 'catalog' to
+          load the database once into a `catalog.SceneCatalog` and select
+          assets with array operations. Both select the same assets. With
+          'catalog', sqlite_path may also be a catalog file created by
+          `catalog.prepare_catalog`.
+        - compact: build tiles with `CompactStreamingParser`, which uses much
+          less memory for indexes with many quadkeys
+        - as_parser: return the streaming parser holding the tiles instead of
+          the mosaic, e.g. to write it with `writer.save_mosaic`
     """
-    quadkey_zoom = len(list(pr_index.values())[0][0])
-    streaming_parser = StreamingParser(
+    if engine not in ('sqlite', 'catalog'):
+        raise ValueError(f'engine not supported: {engine}')
+
+    query_kwargs = {
+        'max_cloud': max_cloud,
+        'min_date': min_date,
+        'max_date': max_date,
+        'sort_preference': sort_preference,
+        'closest_to_date': closest_to_date}
+
+    # Select the best scene of every pathrow in a single pass over the
+    # database. Pathrows without scenes matching the original parameters get
+    # the scene the relaxed parameters would find.
+    pathrows = list(pr_index.keys())
+    if engine == 'catalog':
+        catalog = load_catalog(sqlite_path)
+        watermark = catalog.watermark
+        assets = catalog.select(pathrows=pathrows, **query_kwargs)
+    else:
+        # Keep one read-only connection open for the whole build
+        with SceneDB(sqlite_path) as db:
+            watermark = find_watermark(db)
+            if workers > 1:
+                assets = _select_assets_sharded(
+                    sqlite_path, pathrows, workers, query_kwargs)
+            else:
+                assets = select_assets(db, pathrows=pathrows, **query_kwargs)
+
+    streaming_parser = assets_to_parser(
+        pr_index=pr_index,
+        assets=assets,
+        min_zoom=min_zoom,
+        max_zoom=max_zoom,
+        max_cloud=max_cloud,
+        compact=compact)
+    streaming_parser.extra['watermark'] = watermark
+    if as_parser:
+        return streaming_parser
+
+    return streaming_parser.mosaic
+
+
+def update_from_db(
+        sqlite_path,
+        mosaic: Dict,
+        pr_index,
+        max_cloud,
+        min_date,
+        max_date,
+        sort_preference,
+        closest_to_date,
+        watermark: Optional[Dict] = None) -> Dict:
+    """Update MosaicJSON with scenes added to database after watermark
+
+    Only pathrows with new scenes are selected again, with the same rules as
+    `create_from_db`, and only their quadkeys are changed. When the same
+    parameters are used as for creating the mosaic, the result has the same
+    assets as recreating it from scratch. The exception is the last resort of
+    relaxing a query without max_date, as the midpoint of the date range then
+    moves with the current date.
+
+    Args:
+        - sqlite_path: Path to sqlite database
+        - mosaic: MosaicJSON created by `create_from_db` or a previous update
+        - pr_index: pathrow-quadkey index
+        - watermark: dict with `rowid` or `acquisition_date` to find new
+          scenes after; see `db.find_updated_pathrows`. Defaults to the
+          watermark stored in the mosaic.
+
+    Returns:
+        updated MosaicJSON, with watermark of the newest scenes in database
+    """
+    watermark = watermark or mosaic.get('watermark')
+    if not watermark:
+        raise ValueError('watermark required when mosaic has no watermark')
+
+    with SceneDB(sqlite_path) as db:
+        new_watermark = find_watermark(db)
+        pathrows = [
+            pathrow
+            for pathrow in find_updated_pathrows(
+                db,
+                rowid=watermark.get('rowid'),
+                acquisition_date=watermark.get('acquisition_date'))
+            if pathrow in pr_index]
+        print(f'Updated pathrows: {len(pathrows)}', file=sys.stderr)
+
+        assets = select_assets(
+            db,
+            pathrows=pathrows,
+            max_cloud=max_cloud,
+            min_date=min_date,
+            max_date=max_date,
+            sort_preference=sort_preference,
+            closest_to_date=closest_to_date)
+
+    tiles = dict(mosaic['tiles'])
+    new_quadkeys = False
+    for pathrow, (product_id, _) in assets.items():
+        for quadkey in pr_index[pathrow]:
+            quadkey_assets = tiles.get(quadkey)
+            if quadkey_assets is None:
+                new_quadkeys = True
+                quadkey_assets = []
+
+            # Replace previous asset of pathrow
+            tiles[quadkey] = [
+                asset for asset in quadkey_assets
+                if pathrow_from_product_id(asset) != pathrow] + [product_id]
+
+    updated = {**mosaic, 'tiles': tiles, 'watermark': new_watermark}
+    if new_quadkeys:
+        bounds = quadkeys_to_bounds(tiles.keys())
+        updated['bounds'] = bounds
+        updated['center'] = [(bounds[0] + bounds[2]) / 2,
+                             (bounds[1] + bounds[3]) / 2, mosaic['minzoom']]
+
+    return updated
+
+
+def create_batch_from_db(
+        sqlite_path,
+        pr_index,
+        specs: List[Dict],
+        min_zoom: int = 7,
+        max_zoom: int = 12,
+        compact: bool = False,
+        as_parser: bool = False) -> Dict[str, Dict]:
+    """Create many MosaicJSONs from SQLite database in one pass
+
+    The scenes of each pathrow are read once, ordered by date, and every spec
+    is evaluated against them. Each mosaic is identical to running
+    `create_from_db` with the same parameters.
+
+    Args:
+        - sqlite_path: Path to sqlite database
+        - pr_index: pathrow-quadkey index
+        - specs: list of dicts, each with a `name` and the query parameters
+          of `create_from_db`: `max_cloud`, `min_date`, `max_date`,
+          `sort_preference` and optionally `closest_to_date` and
+          `tier_preference`
+        - min_zoom: Mosaic Min Zoom
+        - max_zoom: Mosaic Max Zoom
+        - compact: build tiles with `CompactStreamingParser`
+        - as_parser: return streaming parsers holding the tiles instead of
+          mosaics
+
+    Returns:
+        dict of {name: mosaic}
+    """
+    names = [spec['name'] for spec in specs]
+    if len(set(names)) != len(names):
+        raise ValueError('Names of specs must be unique')
+
+    rankers = []
+    for spec in specs:
+        query_kwargs = {k: v for k, v in spec.items() if k != 'name'}
+        rankers.append(scene_ranker(**query_kwargs))
+
+    spec_assets = [{} for _ in specs]
+    with SceneDB(sqlite_path) as db:
+        watermark = find_watermark(db)
+        for pathrow, scenes in groupby(iter_scenes(db),
+                                       key=lambda x: x.pathrow):
+            pathrow = format_pathrow(pathrow)
+            if pathrow not in pr_index:
+                continue
+
+            scenes = list(scenes)
+            for ranker, assets in zip(rankers, spec_assets):
+                best = select_scene(scenes, ranker)
+                if best is not None:
+                    key, scene = best
+                    assets[pathrow] = (scene.productId, key[0])
+
+    mosaics = {}
+    for spec, assets in zip(specs, spec_assets):
+        print(f"Mosaic: {spec['name']}", file=sys.stderr)
+        streaming_parser = assets_to_parser(
+            pr_index=pr_index,
+            assets=assets,
+            min_zoom=min_zoom,
+            max_zoom=max_zoom,
+            max_cloud=spec.get('max_cloud'),
+            compact=compact)
+        streaming_parser.extra['watermark'] = watermark
+        mosaics[spec['name']] = (
+            streaming_parser if as_parser else streaming_parser.mosaic)
+
+    return mosaics
+
+
+def assets_to_parser(
+        pr_index,
+        assets: Dict[str, Tuple[str, int]],
+        min_zoom: int,
+        max_zoom: int,
+        max_cloud: float,
+        compact: bool = False
+) -> Union['StreamingParser', 'CompactStreamingParser']:
+    """Add selected asset of each pathrow to streaming parser
+
+    Assets are added in the order of pr_index, so that the same assets always
+    create the same mosaic.
+
+    Args:
+        - pr_index: pathrow-quadkey index
+        - assets: dict of {pathrow: (productId, relax_tier)}
+        - min_zoom: Mosaic Min Zoom
+        - max_zoom: Mosaic Max Zoom
+        - max_cloud: maximum cloud cover percent of the original query, used
+          for reporting relaxation tiers
+        - compact: build tiles with `CompactStreamingParser`
+
+    Returns:
+        `StreamingParser`, or `CompactStreamingParser` if compact
+    """
+    quadkey_zoom = index_quadkey_zoom(pr_index)
+    parser_class = CompactStreamingParser if compact else StreamingParser
+    streaming_parser = parser_class(
         quadkey_zoom=quadkey_zoom, minzoom=min_zoom, maxzoom=max_zoom)
 
+    relax_tier_counts = Counter()
     count = 0
     for pathrow, quadkeys in pr_index.items():
         count += 1
         if count % 1000 == 0:
             print(f'Pathrow: {count}', file=sys.stderr)
 
-        asset = find_asset_for_pathrow(
-            sqlite_path,
-            pathrow=pathrow,
-            max_cloud=max_cloud,
-            min_date=min_date,
-            max_date=max_date,
-            sort_preference=sort_preference,
-            closest_to_date=closest_to_date)
-        product_id = asset['productId']
+        asset = assets.get(pathrow)
+        if asset is None:
+            print(f'Unable to find assets for pathrow {pathrow}', file=sys.stderr)
+            relax_tier_counts[None] += 1
+            continue
+
+        product_id, relax_tier = asset
+        relax_tier_counts[relax_tier] += 1
         for quadkey in quadkeys:
             streaming_parser.add(quadkey, product_id)
 
-    return streaming_parser.mosaic
+    print_relax_tier_counts(relax_tier_counts, max_cloud)
+    return streaming_parser
+
+
+def select_assets(db, pathrows=None, **kwargs) -> Dict[str, Tuple[str, int]]:
+    """Select asset for many pathrows, relaxing parameters where necessary
 
+    Args:
+        - db: open db.SceneDB
+        - pathrows: pathrows to select assets for. All pathrows if None.
+        - kwargs: Arguments passed to db.find_best_records
+
+    Returns:
+        dict of {pathrow: (productId, relax_tier)}
+    """
+    return {
+        format_pathrow(record.pathrow): (record.productId, record.relax_tier)
+        for record in find_best_records(
+            db, pathrows=pathrows, relax=True, **kwargs)}
 
-def find_asset_for_pathrow(sqlite_path, **kwargs):
+
+def _select_assets_sharded(sqlite_path, pathrows, workers, query_kwargs):
+    """Select assets for pathrows split into shards across worker processes
+    """
+    shard_size = -(-len(pathrows) // workers)
+    shards = [
+        pathrows[i:i + shard_size]
+        for i in range(0, len(pathrows), shard_size)]
+    assets = {}
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(
+                _select_assets_shard, sqlite_path, shard, query_kwargs)
+            for shard in shards]
+        for future in futures:
+            assets.update(future.result())
+
+    return assets
+
+
+def _select_assets_shard(sqlite_path, pathrows, query_kwargs):
+    """Select assets for shard of pathrows in worker process
+    """
+    with SceneDB(sqlite_path) as db:
+        return select_assets(db, pathrows=pathrows, **query_kwargs)
+
+
+def find_asset_for_pathrow(db, **kwargs):
     """Find asset from database for pathrow
 
-    The querying is done inside a loop, so that if the query returns no results,
-    it can be repeated with relaxed parameters.
+    If no scene matches the query, parameters are relaxed: max_cloud is raised
+    in steps of 5 up to 100, and as a last resort the scene closest to the
+    midpoint of the date range is chosen. This is resolved as a ranking in a
+    single query; see `db.relax_thresholds`.
 
     Args:
-        - sqlite_path: Path to sqlite database
+        - db: Path to sqlite database or open db.SceneDB
         - kwargs: Arguments passed to db.generate_query
+
+    Returns:
+        record with `productId` and `relax_tier` or None if not found
     """
-    while True:
-        # Generate query
-        query = generate_query(**kwargs)
+    if not isinstance(db, SceneDB):
+        db = connect(db)
+
+    kwargs.setdefault('table_name', db.table_name)
+    kwargs.setdefault('timestamp_column', db.timestamp_column)
+    query, params = generate_query(relax=True, **kwargs)
+    asset = next(db.query(query, params), None)
+    if asset is None:
+        pathrow = kwargs.get('pathrow')
+        print(f'Unable to find assets for pathrow {pathrow}', file=sys.stderr)
 
-        # Find records for query
-        iterator = find_records(sqlite_path, query)
+    return asset
 
-        # Return if found
-        try:
-            return next(iterator)
-        except StopIteration:
-            if kwargs.get('max_cloud') >= 100 and kwargs.get(
-                    'sort_preference') == 'closest-to-date':
 
-                pathrow = kwargs.get('pathrow')
-                print(
-                    f'Unable to find assets for pathrow {pathrow}',
-                    file=sys.stderr)
-                return
+def print_relax_tier_counts(relax_tier_counts: Counter, max_cloud: float):
+    """Print number of pathrows found at each relaxation tier to stderr
 
-        # Modify parameters
-        kwargs = relax_params(**kwargs)
+    Args:
+        - relax_tier_counts: Counter of `relax_tier`, with None for pathrows
+          where no asset was found
+        - max_cloud: maximum cloud cover percent of the original query
+    """
+    thresholds = relax_thresholds(max_cloud)
+    for relax_tier in sorted(relax_tier_counts, key=lambda x: (x is None, x)):
+        if relax_tier is None:
+            label = 'No asset found'
+        elif relax_tier == 0:
+            label = 'Original parameters'
+        elif relax_tier < len(thresholds):
+            label = f'Relaxed to max_cloud {thresholds[relax_tier]}'
+        else:
+            label = 'Relaxed to closest to midpoint date'
+
+        n_pathrows = relax_tier_counts[relax_tier]
+        print(f'{label}: {n_pathrows} pathrows', file=sys.stderr)
 
 
-def relax_params(**kwargs):
-    """Relax search parameters if not found
+def mosaic_header(parser, bounds: List[float]) -> Dict:
+    """Create fields of mosaic other than tiles
+
+    Args:
+        - parser: `StreamingParser` or `CompactStreamingParser`
+        - bounds: bounds of mosaic
     """
-    max_cloud = kwargs.get('max_cloud', 0)
-    if max_cloud < 100:
-        max_cloud += 5
-        kwargs['max_cloud'] = max_cloud
-        pathrow = kwargs['pathrow']
-        print(
-            f'Trying again with max_cloud {max_cloud} for pathrow={pathrow}',
-            file=sys.stderr)
-        return kwargs
-
-    # Otherwise, do a "last-ditch" of the closest to the midpoint date
-    min_date = coerce_to_datetime(kwargs.get('min_date', '2013-04-11'))
-    max_date = coerce_to_datetime(kwargs.get('max_date', datetime.today()))
-
-    midpoint_date = min_date + ((max_date - min_date) / 2)
-    kwargs['min_date'] = None
-    kwargs['max_date'] = None
-    kwargs['closest_to_date'] = midpoint_date
-    kwargs['sort_preference'] = 'closest-to-date'
-    return kwargs
+    return {
+        'mosaicjson': "0.0.2",
+        'minzoom': parser.minzoom,
+        'maxzoom': parser.maxzoom,
+        'quadkey_zoom': parser.quadkey_zoom,
+        'bounds': bounds,
+        'center': [(bounds[0] + bounds[2]) / 2, (bounds[1] + bounds[3]) / 2,
+                   parser.minzoom],
+        **parser.extra,
+    }
 
 
 class StreamingParser:
@@ -254,39 +603,213 @@ class StreamingParser:
         self.maxzoom = maxzoom
         self.tiles: Dict[str, Set[str]] = {}
 
+        # Additional top level fields of mosaic, like watermark
+        self.extra: Dict = {}
+
+        # Quadkeys with more than one asset of the same pathrow, and the
+        # number of such extra assets
+        self.duplicate_quadkeys: Set[str] = set()
+        self.num_duplicate_assets = 0
+        self._pathrows: Dict[str, str] = {}
+
     def add(self, quadkey, asset):
         """Add specific quadkey-asset combination to Mosaic
         """
-        self.tiles[quadkey] = self.tiles.get(quadkey, set())
-        self.tiles[quadkey].add(asset)
+        assets = self.tiles.get(quadkey)
+        if assets is None:
+            assets = self.tiles[quadkey] = set()
+        elif asset in assets:
+            return
+
+        # Parse each asset once
+        pathrows = self._pathrows
+        pathrow = pathrows.get(asset)
+        if pathrow is None:
+            pathrow = pathrows[asset] = pathrow_from_product_id(asset)
+
+        for other in assets:
+            if pathrows[other] == pathrow:
+                self.duplicate_quadkeys.add(quadkey)
+                self.num_duplicate_assets += 1
+                break
+
+        assets.add(asset)
+
+    def iter_tiles(self):
+        """Iterate over quadkeys with at least one asset
+
+        Yields:
+            (quadkey, list of assets)
+        """
+        for quadkey, assets in self.tiles.items():
+            if assets:
+                yield quadkey, list(assets)
+
+    @property
+    def header(self) -> Dict:
+        """Fields of mosaic other than tiles
+        """
+        bounds = self.bounds or quadkeys_to_bounds(
+            [k for k, v in self.tiles.items() if v])
+        return mosaic_header(self, bounds)
 
     @property
     def mosaic(self):
-        # Keep tiles with at least one asset
-        tiles = {k: list(v) for k, v in self.tiles.items() if v}
-        bounds = self.bounds or quadkeys_to_bounds(tiles.keys())
+        return {**self.header, 'tiles': dict(self.iter_tiles())}
+
+    def check_optimized_selection(self):
+        """Count quadkeys with more than one asset of the same pathrow
+
+        Returns:
+            tuple of number of such quadkeys, and number of extra assets
+        """
+        return len(self.duplicate_quadkeys), self.num_duplicate_assets
+
+
+class CompactStreamingParser:
+    """Create MosaicJSON iteratively, with compact storage
+
+    Same API as `StreamingParser`, for mosaics with many quadkeys. Assets are
+    interned in a table, and each added quadkey-asset combination is stored
+    as a quadkey packed by `quadkey.pack_quadkey` and an asset id in growable
+    arrays, which are only deduplicated and grouped by quadkey when the mosaic
+    is created.
+
+    Quadkeys and their assets are in the order they were first added.
+    """
+    def __init__(
+            self,
+            quadkey_zoom: Optional[int] = None,
+            bounds: List[float] = None,
+            minzoom: int = 7,
+            maxzoom: int = 12):
+
+        self.quadkey_zoom = quadkey_zoom or minzoom
+        self.bounds = bounds
+        self.minzoom = minzoom
+        self.maxzoom = maxzoom
+
+        self.assets: List[str] = []
+        self._asset_ids: Dict[str, int] = {}
+        self._quadkeys = array('Q')
+        self._assets = array('i')
+        self._grouped_cache = None
+
+        # Additional top level fields of mosaic, like watermark
+        self.extra: Dict = {}
+
+    def add(self, quadkey, asset):
+        """Add specific quadkey-asset combination to Mosaic
+        """
+        asset_id = self._asset_ids.get(asset)
+        if asset_id is None:
+            asset_id = len(self.assets)
+            self._asset_ids[asset] = asset_id
+            self.assets.append(asset)
+
+        self._quadkeys.append(pack_quadkey(quadkey))
+        self._assets.append(asset_id)
 
+    def _grouped(self) -> Tuple[List[str], np.ndarray, np.ndarray]:
+        """Deduplicate and group quadkey-asset combinations by quadkey
+
+        Returns:
+            tuple of quadkeys, asset ids of each quadkey in turn, and offsets
+            of each quadkey's asset ids
+        """
+        # Reuse while nothing was added
+        if self._grouped_cache is not None and self._grouped_cache[
+                0] == len(self._quadkeys):
+            return self._grouped_cache[1]
+
+        quadkeys = np.frombuffer(self._quadkeys, dtype=np.uint64)
+        asset_ids = np.frombuffer(self._assets, dtype=np.intc).astype(np.int64)
+        n_assets = max(len(self.assets), 1)
+
+        # Rank quadkeys by first appearance
+        unique_quadkeys, first, inverse = np.unique(
+            quadkeys, return_index=True, return_inverse=True)
+        order = np.argsort(first, kind='stable')
+        rank = np.empty(len(order), dtype=np.int64)
+        rank[order] = np.arange(len(order))
+
+        # Deduplicate combinations, keeping the first appearance of each
+        pairs, first = np.unique(
+            rank[inverse.reshape(-1)] * n_assets + asset_ids,
+            return_index=True)
+        pairs = pairs[np.lexsort((first, pairs // n_assets))]
+
+        offsets = np.zeros(len(order) + 1, dtype=np.int64)
+        np.cumsum(
+            np.bincount(pairs // n_assets, minlength=len(order)),
+            out=offsets[1:])
+        grouped = (
+            unpack_quadkeys(unique_quadkeys[order]), pairs % n_assets,
+            offsets)
+        self._grouped_cache = (len(self._quadkeys), grouped)
+        return grouped
+
+    @property
+    def tiles(self) -> Dict[str, Set[str]]:
+        """Assets of each quadkey, like `StreamingParser.tiles`
+        """
         return {
-            'mosaicjson': "0.0.2",
-            'minzoom': self.minzoom,
-            'maxzoom': self.maxzoom,
-            'quadkey_zoom': self.quadkey_zoom,
-            'bounds': bounds,
-            'center': [(bounds[0] + bounds[2]) / 2, (bounds[1] + bounds[3]) / 2,
-                       self.minzoom],
-            'tiles': tiles,
-        }
+            quadkey: set(assets)
+            for quadkey, assets in self.iter_tiles()}
+
+    def iter_tiles(self):
+        """Iterate over quadkeys with their assets
+
+        Yields:
+            (quadkey, list of assets)
+        """
+        quadkeys, asset_ids, offsets = self._grouped()
+        assets = self.assets
+        for quadkey, start, end in zip(quadkeys, offsets[:-1].tolist(),
+                                       offsets[1:].tolist()):
+            yield quadkey, [assets[i] for i in asset_ids[start:end].tolist()]
+
+    @property
+    def header(self) -> Dict:
+        """Fields of mosaic other than tiles
+        """
+        bounds = self.bounds or quadkeys_to_bounds(self._grouped()[0])
+        return mosaic_header(self, bounds)
+
+    @property
+    def mosaic(self):
+        return {**self.header, 'tiles': dict(self.iter_tiles())}
 
     def check_optimized_selection(self):
-        num_duplicate_quadkeys = 0
-        num_duplicate_assets = 0
-        for assets in self.tiles.values():
-            n_assets = len(assets)
-            metas = [sceneid_parser(asset) for asset in assets]
+        """Count quadkeys with more than one asset of the same pathrow
 
-            pathrows = {meta['path'] + meta['row'] for meta in metas}
-            if n_assets != len(pathrows):
-                num_duplicate_quadkeys += 1
-                num_duplicate_assets += n_assets - len(pathrows)
+        Unlike `StreamingParser`, duplicates aren't counted in `add`, which
+        would need a set of every quadkey-pathrow combination added. They are
+        counted in one vectorized pass over the grouped arrays instead.
 
+        Returns:
+            tuple of number of such quadkeys, and number of extra assets
+        """
+        _, asset_ids, offsets = self._grouped()
+
+        # Parse each asset once instead of once per quadkey
+        pathrow_ids = {}
+        asset_pathrows = np.empty(len(self.assets), dtype=np.int64)
+        for ind, asset in enumerate(self.assets):
+            asset_pathrows[ind] = pathrow_ids.setdefault(
+                pathrow_from_product_id(asset), len(pathrow_ids))
+
+        # Count distinct pathrows of each quadkey
+        n_quadkeys = len(offsets) - 1
+        n_pathrows = max(len(pathrow_ids), 1)
+        quadkey_pathrows = np.unique(
+            np.repeat(np.arange(n_quadkeys), np.diff(offsets)) * n_pathrows +
+            asset_pathrows[asset_ids])
+        pathrow_counts = np.bincount(
+            quadkey_pathrows // n_pathrows, minlength=n_quadkeys)
+        asset_counts = np.diff(offsets)
+
+        num_duplicate_quadkeys = int(
+            np.count_nonzero(asset_counts != pathrow_counts))
+        num_duplicate_assets = int((asset_counts - pathrow_counts).sum())
         return num_duplicate_quadkeys, num_duplicate_assets
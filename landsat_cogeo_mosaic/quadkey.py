@@ -0,0 +1,214 @@
+"""
+landsat_cogeo_mosaic.quadkey: Convert and pack many quadkeys at once with NumPy
+"""
+import math
+from typing import List, Sequence, Tuple
+
+import numpy as np
+
+# Max zoom of tiles that `pack_tiles` can pack into 64 bits
+MAX_PACKED_ZOOM = 29
+
+
+def quadkeys_to_tiles(
+        quadkeys: Sequence[str]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Convert quadkeys to tiles
+
+    Same as `mercantile.quadkey_to_tile` for each quadkey.
+
+    Args:
+        - quadkeys: quadkeys, of any zooms
+
+    Returns:
+        tuple of int64 arrays of x, y and z of tiles
+    """
+    quadkeys = list(quadkeys)
+    z = np.fromiter(map(len, quadkeys), dtype=np.int64, count=len(quadkeys))
+    x = np.zeros(len(quadkeys), dtype=np.int64)
+    y = np.zeros(len(quadkeys), dtype=np.int64)
+
+    # Quadkeys of the same zoom are converted as one array of digits
+    for zoom in np.unique(z):
+        if zoom == 0:
+            continue
+
+        inds = np.flatnonzero(z == zoom)
+        try:
+            data = ''.join(quadkeys[ind] for ind in inds).encode('ascii')
+        except UnicodeEncodeError:
+            raise ValueError('Unexpected quadkey digit')
+
+        digits = np.frombuffer(data, dtype=np.uint8).reshape(-1, zoom) - 48
+        if digits.max() > 3:
+            raise ValueError('Unexpected quadkey digit')
+
+        # Each digit holds one bit of x and one bit of y, highest bit first
+        weights = 1 << np.arange(zoom - 1, -1, -1, dtype=np.int64)
+        x[inds] = (digits & 1) @ weights
+        y[inds] = (digits >> 1) @ weights
+
+    return x, y, z
+
+
+def tiles_to_quadkeys(x: np.ndarray, y: np.ndarray,
+                      z: np.ndarray) -> List[str]:
+    """Convert tiles to quadkeys
+
+    Same as `mercantile.quadkey` for each tile.
+
+    Args:
+        - x, y, z: arrays of tile coordinates
+
+    Returns:
+        list of quadkeys
+    """
+    x = np.asarray(x, dtype=np.int64)
+    y = np.asarray(y, dtype=np.int64)
+    z = np.asarray(z, dtype=np.int64)
+    quadkeys = [''] * len(z)
+
+    # Tiles of the same zoom are converted as one array of digits
+    for zoom in np.unique(z):
+        if zoom == 0:
+            continue
+
+        inds = np.flatnonzero(z == zoom)
+        shifts = np.arange(zoom - 1, -1, -1, dtype=np.int64)
+        digits = ((x[inds, None] >> shifts) & 1) | (
+            ((y[inds, None] >> shifts) & 1) << 1)
+        data = (digits + 48).astype(np.uint8).tobytes().decode('ascii')
+        for i, ind in enumerate(inds.tolist()):
+            quadkeys[ind] = data[i * zoom:(i + 1) * zoom]
+
+    return quadkeys
+
+
+def pack_tiles(x: np.ndarray, y: np.ndarray, z: np.ndarray) -> np.ndarray:
+    """Pack tiles into integers
+
+    Tiles are packed as `z << 58 | x << 29 | y`, which holds tiles up to zoom
+    29.
+
+    Args:
+        - x, y, z: arrays of tile coordinates
+
+    Returns:
+        uint64 array
+    """
+    x = np.asarray(x, dtype=np.uint64)
+    y = np.asarray(y, dtype=np.uint64)
+    z = np.asarray(z, dtype=np.uint64)
+    if len(z) and z.max() > MAX_PACKED_ZOOM:
+        raise ValueError(f'Zoom above {MAX_PACKED_ZOOM} can\'t be packed')
+
+    return (z << np.uint64(58)) | (x << np.uint64(29)) | y
+
+
+def pack_quadkeys(quadkeys: Sequence[str]) -> np.ndarray:
+    """Pack quadkeys into integers
+
+    Args:
+        - quadkeys: quadkeys, of any zooms up to 29
+
+    Returns:
+        uint64 array, see `pack_tiles`
+    """
+    return pack_tiles(*quadkeys_to_tiles(quadkeys))
+
+
+def unpack_quadkeys(packed: np.ndarray) -> List[str]:
+    """Unpack integers created by `pack_quadkeys`
+
+    Args:
+        - packed: uint64 array
+
+    Returns:
+        list of quadkeys
+    """
+    return tiles_to_quadkeys(*unpack_tiles(packed))
+
+
+def unpack_tiles(
+        packed: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Unpack integers created by `pack_tiles`
+
+    Args:
+        - packed: uint64 array
+
+    Returns:
+        tuple of int64 arrays of x, y and z of tiles
+    """
+    packed = np.asarray(packed, dtype=np.uint64)
+    mask = np.uint64((1 << 29) - 1)
+    x = ((packed >> np.uint64(29)) & mask).astype(np.int64)
+    y = (packed & mask).astype(np.int64)
+    z = (packed >> np.uint64(58)).astype(np.int64)
+    return x, y, z
+
+
+def pack_quadkey(quadkey: str) -> int:
+    """Pack one quadkey into an integer
+
+    Same as `pack_quadkeys` for one quadkey, but cheaper when quadkeys arrive
+    one by one. The quadkey is read as a base 4 number, whose bits
+    interleave y and x, and the bits of x and y are then separated.
+
+    Args:
+        - quadkey: quadkey, of zoom up to 29
+
+    Returns:
+        integer, see `pack_tiles`
+    """
+    zoom = len(quadkey)
+    if zoom > MAX_PACKED_ZOOM:
+        raise ValueError(f'Zoom above {MAX_PACKED_ZOOM} can\'t be packed')
+
+    digits = int(quadkey or '0', 4)
+    x = _compact_bits(digits)
+    y = _compact_bits(digits >> 1)
+    return (zoom << 58) | (x << 29) | y
+
+
+def _compact_bits(value: int) -> int:
+    """Gather even bits of value into its lowest 32 bits
+    """
+    value &= 0x5555555555555555
+    value = (value | (value >> 1)) & 0x3333333333333333
+    value = (value | (value >> 2)) & 0x0F0F0F0F0F0F0F0F
+    value = (value | (value >> 4)) & 0x00FF00FF00FF00FF
+    value = (value | (value >> 8)) & 0x0000FFFF0000FFFF
+    return (value | (value >> 16)) & 0x00000000FFFFFFFF
+
+
+def tiles_to_bounds(
+        x: np.ndarray, y: np.ndarray, z: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Convert tiles to longitude and latitude bounds
+
+    Same as `mercantile.bounds` for each tile.
+
+    Args:
+        - x, y, z: arrays of tile coordinates
+
+    Returns:
+        tuple of float64 arrays of west, south, east and north
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    z2 = np.power(2.0, np.asarray(z, dtype=np.float64))
+
+    west = x / z2 * 360.0 - 180.0
+    east = (x + 1) / z2 * 360.0 - 180.0
+
+    # Latitude only depends on the row of the tile, and is computed once per
+    # distinct row with `math`, since NumPy's sinh and arctan can differ from
+    # mercantile in the last digit
+    rows, inverse = np.unique(
+        np.concatenate([y / z2, (y + 1) / z2]), return_inverse=True)
+    lats = np.array([
+        math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * row))))
+        for row in rows.tolist()])
+    lats = lats[inverse.reshape(-1)]
+    north = lats[:len(y)]
+    south = lats[len(y):]
+    return west, south, east, north
@@ -0,0 +1,155 @@
+"""
+landsat_cogeo_mosaic.selection: Select scenes in Python with the same ranking
+as relaxed queries in landsat_cogeo_mosaic.db
+"""
+from datetime import datetime, timedelta
+from typing import Callable, Iterable, List, Optional, Tuple, Union
+
+from landsat_cogeo_mosaic.constants import LANDSAT8_MIN_DATE
+from landsat_cogeo_mosaic.db import relax_thresholds
+from landsat_cogeo_mosaic.util import (
+    coerce_to_datetime, date_to_ts, midpoint_date)
+
+
+def scene_ranker(
+        max_cloud: float = 10,
+        min_date: str = None,
+        max_date: str = None,
+        sort_preference: Optional[str] = None,
+        tier_preference: List[str] = ['T1', 'T2', 'RT'],
+        closest_to_date: Optional[Union[datetime, str]] = None
+) -> Callable[[Tuple], Optional[Tuple]]:
+    """Create function that ranks scenes like `db.generate_query(relax=True)`
+
+    Args:
+        - max_cloud: maximum cloud cover percent. Range from 0-100.
+        - min_date: min date as str: 'YYYY-MM-DD'
+        - max_date: max date as str: 'YYYY-MM-DD'
+        - sort_preference: preference for selecting pathrow
+        - tier_preference: preference of tiers, by default ['T1', 'T2', 'RT']
+        - closest_to_date: datetime used for comparisons when preference is closest-to-date. Must be datetime or str of format YYYY-MM-DD
+
+    Returns:
+        function that takes a scene record with `acquisition_ts`,
+        `cloudCover`, `tier` and `scene_rowid` attributes and returns a sort
+        key, where the smallest key is the best scene, or None if the scene
+        can't be selected. The first element of the key is the `relax_tier`.
+    """
+    thresholds = relax_thresholds(max_cloud)
+    midpoint_tier = len(thresholds)
+    max_threshold = thresholds[-1]
+    use_midpoint = sort_preference != 'closest-to-date'
+
+    min_ts, max_ts = date_range_ts(min_date, max_date)
+
+    preference = _preference_key(sort_preference, closest_to_date)
+    if use_midpoint:
+        midpoint = _preference_key(
+            'closest-to-date',
+            midpoint_date(min_date=min_date, max_date=max_date))
+
+    # CASE tier WHEN ... END is NULL for other tiers, which sorts first
+    tier_ranks = {tier: ind for ind, tier in enumerate(tier_preference or [])}
+    default_tier_rank = -1 if tier_preference else 0
+
+    def rank(scene):
+        ts = scene.acquisition_ts
+        cloud_cover = scene.cloudCover
+        in_range = (min_ts is None or ts >= min_ts) and (
+            max_ts is None or ts < max_ts)
+
+        # Same conditions as the where clause of db._candidates_query
+        if max_cloud:
+            if cloud_cover > max_threshold:
+                return None
+            if not in_range and not use_midpoint:
+                return None
+        elif not in_range and (not use_midpoint
+                               or cloud_cover > max_threshold):
+            return None
+
+        if not in_range:
+            relax_tier = midpoint_tier
+            preference_value = midpoint(scene)
+        else:
+            relax_tier = 0
+            if max_cloud:
+                relax_tier = len(thresholds) - 1
+                for ind, threshold in enumerate(thresholds[:-1]):
+                    if cloud_cover <= threshold:
+                        relax_tier = ind
+                        break
+
+            preference_value = preference(scene)
+
+        tier_rank = tier_ranks.get(scene.tier, default_tier_rank)
+        return relax_tier, preference_value, tier_rank, scene.scene_rowid
+
+    return rank
+
+
+def date_range_ts(min_date: str = None,
+                  max_date: str = None) -> Tuple[Optional[int], Optional[int]]:
+    """Date range as half-open range of seconds since epoch
+
+    Same whole days as the conditions of `db._date_terms`. min_date is moved
+    to when Landsat 8 reached operational orbit if earlier.
+
+    Returns:
+        tuple of (min_ts, max_ts), each None if the date isn't given
+    """
+    min_ts = None
+    if min_date:
+        min_date = max(coerce_to_datetime(min_date), LANDSAT8_MIN_DATE)
+        min_ts = date_to_ts(min_date)
+
+    max_ts = None
+    if max_date:
+        max_ts = date_to_ts(coerce_to_datetime(max_date) + timedelta(days=1))
+
+    return min_ts, max_ts
+
+
+def select_scene(scenes: Iterable[Tuple],
+                 ranker: Callable[[Tuple], Optional[Tuple]]
+                 ) -> Optional[Tuple[Tuple, Tuple]]:
+    """Select best scene according to ranker
+
+    Args:
+        - scenes: scene records
+        - ranker: function created by `scene_ranker`
+
+    Returns:
+        tuple of (key, scene) of best scene or None if no scene can be selected
+    """
+    best = None
+    for scene in scenes:
+        key = ranker(scene)
+        if key is not None and (best is None or key < best[0]):
+            best = (key, scene)
+
+    return best
+
+
+def _preference_key(
+        sort_preference: Optional[str] = None,
+        closest_to_date: Optional[Union[datetime, str]] = None
+) -> Callable[[Tuple], float]:
+    """Create function returning order value of scene for sort preference
+    """
+    if sort_preference == 'min-cloud':
+        return lambda scene: scene.cloudCover
+
+    if sort_preference == 'newest':
+        return lambda scene: -scene.acquisition_ts
+
+    if sort_preference == 'oldest':
+        return lambda scene: scene.acquisition_ts
+
+    if sort_preference == 'closest-to-date':
+        closest_to_date_timestamp = round(
+            coerce_to_datetime(closest_to_date).timestamp())
+        return lambda scene: abs(
+            closest_to_date_timestamp - scene.acquisition_ts)
+
+    raise ValueError('sort_preference not supported')
@@ -27,18 +27,75 @@ OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
 OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 """
 
-import itertools
 import json
 import sys
-from datetime import datetime
-from typing import List
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime, timedelta
+from typing import Dict, Iterator, List, Optional, Tuple
 
 import requests
 from dateutil.parser import parse as date_parse
 from dateutil.relativedelta import relativedelta
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
+from landsat_cogeo_mosaic.cache import ResponseCache, response_key
 
-def search(
+# Response statuses that are retried
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# Max number of features the API returns for one query
+MAX_RESULTS = 10000
+
+# Bounds smaller than this in both directions aren't split further
+MIN_SPLIT_DEGREES = 0.01
+
+
+def create_session(
+        retries: int = 3,
+        backoff_factor: float = 0.5,
+        pool_maxsize: int = 10) -> requests.Session:
+    """Create HTTP session for STAC API requests
+
+    Connections are pooled and kept alive across requests, and responses are
+    gzipped.
+
+    Args:
+        - retries: number of times to retry failed connections and responses
+          with a status in RETRY_STATUSES
+        - backoff_factor: sleep backoff_factor * 2 ** (retry - 1) seconds
+          between retries
+        - pool_maxsize: number of connections kept alive per host. Should be
+          at least the number of concurrent requests.
+    """
+    retry = Retry(
+        total=retries,
+        backoff_factor=backoff_factor,
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=None)
+    adapter = HTTPAdapter(max_retries=retry, pool_maxsize=pool_maxsize)
+
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    session.headers.update({
+        "Content-Type": "application/json",
+        "Accept-Encoding": "gzip",
+        "Accept": "application/geo+json",
+    })
+    return session
+
+
+def search(*args, **kwargs) -> List[Dict]:
+    """Search STAC API given parameters
+
+    Same arguments as `search_pages`, but returns a list of all features.
+    """
+    return [
+        feature for page in search_pages(*args, **kwargs) for feature in page]
+
+
+def search_pages(
         bounds: List[float],
         min_cloud: float = 0,
         max_cloud: float = 100,
@@ -47,8 +104,14 @@ def search(
         period: str = None,
         period_qty: int = 1,
         stac_collection_limit: int = 500,
-        stac_url: str = "https://sat-api.developmentseed.org"):
-    """Search STAC API given parameters
+        stac_url: str = "https://sat-api.developmentseed.org",
+        session: Optional[requests.Session] = None,
+        concurrency: int = 4,
+        cache: Optional[ResponseCache] = None) -> Iterator[List[Dict]]:
+    """Search STAC API given parameters, yielding features as pages arrive
+
+    Searches finding more features than the API can return are split into
+    many queries. See `iter_sat_api_pages`.
 
     Args:
         - bounds: minx, miny, maxx, maxy
@@ -60,6 +123,12 @@ def search(
         - period_qty: Number of periods to apply after `min-date`. Only applies if `period` is provided.
         - stac_collection_limit: Limits the number of items per page returned by sat-api.
         - stac_url: Endpoint to use. Defaults to Development Seed's Sat API
+        - session: session from `create_session`. A new one is created by default.
+        - concurrency: max number of concurrent requests
+        - cache: cache of responses. Responses aren't cached by default.
+
+    Yields:
+        list of features of each page
     """
 
     period_choices = ['day', 'week', 'month', 'year']
@@ -116,37 +185,199 @@ def search(
     if stac_collection_limit:
         query['limit'] = stac_collection_limit
 
-    return fetch_sat_api(query, stac_url=stac_url)
+    yield from iter_sat_api_pages(
+        query,
+        stac_url=stac_url,
+        session=session,
+        concurrency=concurrency,
+        cache=cache)
 
 
-def fetch_sat_api(query, stac_url: str = "https://sat-api.developmentseed.org"):
-    headers = {
-        "Content-Type": "application/json",
-        "Accept-Encoding": "gzip",
-        "Accept": "application/geo+json",
-    }
+def fetch_sat_api(
+        query: Dict,
+        stac_url: str = "https://sat-api.developmentseed.org",
+        session: Optional[requests.Session] = None,
+        concurrency: int = 4,
+        cache: Optional[ResponseCache] = None) -> List[Dict]:
+    """Fetch all features of query from STAC API
+
+    Args:
+        - query: STAC API search query
+        - stac_url: Endpoint to use
+        - session: session from `create_session`
+        - concurrency: max number of concurrent requests
+        - cache: cache of responses
+    """
+    pages = iter_sat_api_pages(
+        query,
+        stac_url=stac_url,
+        session=session,
+        concurrency=concurrency,
+        cache=cache)
+    return [feature for page in pages for feature in page]
+
+
+def iter_sat_api_pages(
+        query: Dict,
+        stac_url: str = "https://sat-api.developmentseed.org",
+        session: Optional[requests.Session] = None,
+        concurrency: int = 4,
+        cache: Optional[ResponseCache] = None) -> Iterator[List[Dict]]:
+    """Fetch pages of query from STAC API concurrently
+
+    Queries that find MAX_RESULTS or more features, more than the API can
+    return, are split with `split_query` until each part finds fewer. Once
+    the first page of a query says how many features it found, its other
+    pages are fetched concurrently. Features found by more than one part are
+    only yielded once.
+
+    Args:
+        - query: STAC API search query
+        - stac_url: Endpoint to use
+        - session: session from `create_session`. A new one is created by
+          default.
+        - concurrency: max number of concurrent requests
+        - cache: cache of responses. Pages found in cache aren't requested.
+
+    Yields:
+        list of features of each page, in the order pages arrive
+    """
+    if session is None:
+        with create_session(pool_maxsize=concurrency) as session:
+            yield from iter_sat_api_pages(
+                query, stac_url, session, concurrency=concurrency, cache=cache)
+        return
 
     url = f"{stac_url}/stac/search"
-    data = requests.post(url, headers=headers, json=query).json()
+    seen = set()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        # {future: (query, whether it's the first page of query)}
+        pending = {
+            executor.submit(fetch_page, session, url, query, cache): (
+                query, True)}
+        try:
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    page_query, first_page = pending.pop(future)
+                    data = future.result()
+                    meta = data.get("meta", {})
+                    found = meta.get("found") or 0
+
+                    if first_page and found >= MAX_RESULTS:
+                        print(
+                            f'Found {found} results; splitting query',
+                            file=sys.stderr)
+                        for part in split_query(page_query):
+                            pending[executor.submit(
+                                fetch_page, session, url, part,
+                                cache)] = (part, True)
+                        continue
+
+                    if first_page and found:
+                        limit = int(meta["limit"])
+                        for page in range(2, -(-found // limit) + 1):
+                            next_query = {
+                                **page_query, 'page': page, 'limit': limit}
+                            pending[executor.submit(
+                                fetch_page, session, url, next_query,
+                                cache)] = (next_query, False)
+
+                    if not found:
+                        continue
+
+                    print(json.dumps(meta), file=sys.stderr)
+
+                    features = []
+                    for feature in data["features"]:
+                        key = feature.get('properties', {}).get(
+                            'landsat:product_id', feature.get('id'))
+                        if key not in seen:
+                            seen.add(key)
+                            features.append(feature)
+
+                    yield features
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+def fetch_page(
+        session: requests.Session,
+        url: str,
+        query: Dict,
+        cache: Optional[ResponseCache] = None) -> Dict:
+    """Fetch one page of query from STAC API
+
+    Args:
+        - session: session from `create_session`
+        - url: search endpoint
+        - query: STAC API search query
+        - cache: cache of responses. Only successful responses are cached.
+
+    Returns:
+        response data
+    """
+    if cache is not None:
+        key = response_key(url, query)
+        data = cache.get(key)
+        if data is not None:
+            return data
+
+    data = session.post(url, json=query).json()
     error = data.get("message", "")
     if error:
         raise Exception(f"SAT-API failed and returned: {error}")
 
-    meta = data.get("meta", {})
-    if not meta.get("found"):
-        return []
+    if cache is not None:
+        cache.put(key, data)
+
+    return data
+
+
+def split_query(query: Dict) -> Tuple[Dict, Dict]:
+    """Split query into two queries finding fewer features
+
+    The time range is split in half, or the longer side of bbox once the
+    time range is within one day. Features on the edge of both halves of
+    bbox are found by both queries.
+
+    Args:
+        - query: STAC API search query
+
+    Returns:
+        two queries, without page
+    """
+    query = {k: v for k, v in query.items() if k != 'page'}
+
+    if query.get('time'):
+        start, end = [date_parse(d) for d in query['time'].split('/')]
+        if end - start > timedelta(days=1):
+            middle = (start + (end - start) // 2).replace(microsecond=0)
+            first_time = f'{_format_time(start)}/{_format_time(middle)}'
+            second_time = '{}/{}'.format(
+                _format_time(middle + timedelta(seconds=1)), _format_time(end))
+            return {**query, 'time': first_time}, {**query, 'time': second_time}
+
+    if not query.get('bbox'):
+        raise ValueError(f'Found {MAX_RESULTS} or more results; add bbox')
 
-    if meta['found'] >= 10000:
-        raise ValueError(f'Found {meta["found"]} results; max is 10,000')
+    minx, miny, maxx, maxy = query['bbox']
+    if max(maxx - minx, maxy - miny) < MIN_SPLIT_DEGREES:
+        raise ValueError(
+            f'Found {MAX_RESULTS} or more results in bbox {query["bbox"]}')
 
-    print(json.dumps(meta), file=sys.stderr)
+    if maxx - minx >= maxy - miny:
+        middle = (minx + maxx) / 2
+        return (
+            {**query, 'bbox': [minx, miny, middle, maxy]},
+            {**query, 'bbox': [middle, miny, maxx, maxy]})
 
-    features = data["features"]
-    if data["links"]:
-        curr_page = int(meta["page"])
-        query["page"] = curr_page + 1
-        query["limit"] = meta["limit"]
+    middle = (miny + maxy) / 2
+    return (
+        {**query, 'bbox': [minx, miny, maxx, middle]},
+        {**query, 'bbox': [minx, middle, maxx, maxy]})
 
-        features = list(itertools.chain(features, fetch_sat_api(query)))
 
-    return features
+def _format_time(date: datetime) -> str:
+    return date.strftime("%Y-%m-%dT%H:%M:%SZ")
@@ -2,12 +2,22 @@ import gzip
 import hashlib
 import json
 import os
+import struct
+from collections import OrderedDict
+from collections.abc import Mapping
 from datetime import datetime
+from itertools import chain
 from pathlib import Path
-from typing import List
+from threading import Lock
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
 
+import numpy as np
 from dateutil.parser import parse as date_parse
 
+from landsat_cogeo_mosaic.constants import LANDSAT8_MIN_DATE
+from landsat_cogeo_mosaic.quadkey import (
+    pack_tiles, quadkeys_to_tiles, tiles_to_quadkeys, unpack_tiles)
+
 
 def coerce_to_datetime(dt):
     if isinstance(dt, datetime):
@@ -16,20 +26,312 @@ def coerce_to_datetime(dt):
     return date_parse(dt)
 
 
-def load_index_data(path=None):
+def date_to_ts(date: datetime) -> int:
+    """Seconds since epoch of start of day of date, treating it as UTC
+    """
+    return (date.date() - datetime(1970, 1, 1).date()).days * 86400
+
+
+def midpoint_date(min_date=None, max_date=None) -> datetime:
+    """Midpoint of date range
+
+    Used as the last resort when relaxing a query. Defaults to the range from
+    when Landsat 8 reached operational orbit until today.
+    """
+    min_date = coerce_to_datetime(min_date or LANDSAT8_MIN_DATE)
+    max_date = coerce_to_datetime(max_date or datetime.today())
+    return min_date + ((max_date - min_date) / 2)
+
+
+def pathrow_from_product_id(product_id: str) -> str:
+    """Get 6-character pathrow from Landsat product or scene id
+
+    Collection product ids look like LC08_L1TP_139045_20170304_20170316_01_T1,
+    pre-collection scene ids like LC81390452017063LGN00.
+    """
+    if product_id[4] == '_':
+        return product_id[10:16]
+
+    return product_id[3:9]
+
+
+# First bytes of binary pathrow index files: magic and format version
+INDEX_MAGIC = b'LSPRI\x00\x00\x01'
+
+# Arrays of binary pathrow index files, in order, with their dtypes
+INDEX_ARRAYS = {
+    'pathrows': '<i4',
+    'offsets': '<i8',
+    'tiles': '<u8',
+}
+
+
+class PathrowIndex(Mapping):
+    """Immutable index of pathrow to quadkeys
+
+    Behaves like the dict of {pathrow: [quadkey, ...]} of pr_index.json.gz,
+    with tuples of quadkeys. It's stored in CSR form: the tiles of the pathrow
+    at position i are `tiles[offsets[i]:offsets[i + 1]]`, packed into
+    integers by `quadkey.pack_tiles`. Quadkeys are converted to tiles once,
+    when the index is created, and `save` writes the arrays to a binary file
+    that `open` memory-maps.
+
+    Attributes:
+        - pathrows: int32 array of pathrows as path * 1000 + row, in order of
+          index
+        - offsets: int64 array of index of first tile of each pathrow, with one
+          more element than pathrows
+        - tiles: uint64 array of packed tiles
+        - quadkey_zoom: zoom of quadkeys, None if index is empty
+    """
+    def __init__(
+            self,
+            pathrows: np.ndarray,
+            offsets: np.ndarray,
+            tiles: np.ndarray,
+            quadkeys: Optional[List[str]] = None):
+        """
+        Args:
+            - pathrows, offsets, tiles: see class attributes
+            - quadkeys: all quadkeys, in order of tiles. Converted from tiles
+              when first needed if not given.
+        """
+        self.pathrows = pathrows
+        self.offsets = offsets
+        self.tiles = tiles
+        self._quadkeys = quadkeys
+        self._positions = {
+            f'{pathrow:06d}': ind
+            for ind, pathrow in enumerate(pathrows.tolist())}
+
+        self.quadkey_zoom = None
+        if len(tiles):
+            self.quadkey_zoom = int(unpack_tiles(tiles[:1])[2][0])
+
+    @classmethod
+    def from_dict(cls, index: Mapping) -> 'PathrowIndex':
+        """Create index from dict
+
+        Args:
+            - index: dict of {pathrow: [quadkey, ...]}, with 6-character
+              pathrows
+        """
+        pathrows = []
+        for pathrow in index:
+            if len(pathrow) != 6 or not pathrow.isdigit():
+                raise ValueError(f'Unexpected pathrow: {pathrow}')
+            pathrows.append(int(pathrow))
+
+        offsets = np.zeros(len(index) + 1, dtype=np.int64)
+        np.cumsum([len(quadkeys) for quadkeys in index.values()],
+                  out=offsets[1:])
+
+        quadkeys = list(chain.from_iterable(index.values()))
+        return cls(
+            pathrows=np.array(pathrows, dtype=np.int32),
+            offsets=offsets,
+            tiles=pack_tiles(*quadkeys_to_tiles(quadkeys)),
+            quadkeys=quadkeys)
+
+    @classmethod
+    def open(cls, path) -> 'PathrowIndex':
+        """Memory-map binary index file written by `save`
+
+        Args:
+            - path: path to binary index file
+        """
+        _, arrays = open_arrays(path, INDEX_MAGIC, INDEX_ARRAYS)
+        return cls(**arrays)
+
+    def save(self, path):
+        """Write index to binary file
+
+        The file has the arrays of `INDEX_ARRAYS`; see `save_arrays`.
+
+        Args:
+            - path: path of new index file. Overwrites existing file.
+        """
+        arrays = {name: getattr(self, name) for name in INDEX_ARRAYS}
+        save_arrays(path, INDEX_MAGIC, INDEX_ARRAYS, arrays)
+
+    def __getitem__(self, pathrow: str) -> Tuple[str, ...]:
+        ind = self._positions[pathrow]
+        if self._quadkeys is None:
+            self._quadkeys = tiles_to_quadkeys(*unpack_tiles(self.tiles))
+
+        start, end = self.offsets[ind:ind + 2]
+        return tuple(self._quadkeys[start:end])
+
+    def __iter__(self):
+        return iter(self._positions)
+
+    def __len__(self):
+        return len(self._positions)
+
+    def __contains__(self, pathrow) -> bool:
+        return pathrow in self._positions
+
+    def tiles_of(self, pathrow: str) -> Tuple[Tuple[int, int, int], ...]:
+        """Get tiles of quadkeys of pathrow as (x, y, z) tuples
+        """
+        ind = self._positions[pathrow]
+        start, end = self.offsets[ind:ind + 2]
+        x, y, z = unpack_tiles(self.tiles[start:end])
+        return tuple(zip(x.tolist(), y.tolist(), z.tolist()))
+
+
+# Max number of indexes kept by `load_index_data`
+INDEX_CACHE_SIZE = 4
+
+# Indexes loaded by `load_index_data`, keyed by path and mtime, least recently
+# used first
+_index_cache: 'OrderedDict[Tuple[str, int], PathrowIndex]' = OrderedDict()
+_index_cache_lock = Lock()
+
+
+def load_index_data(path=None) -> PathrowIndex:
+    """Load pathrow-quadkey index
+
+    Indexes are cached for the life of the process, keyed by path and
+    modification time, so that an index is only parsed again after its file
+    changes. At most `INDEX_CACHE_SIZE` indexes are kept.
+
+    Args:
+        - path: path to index as JSON, optionally gzipped, or binary index
+          file written by `PathrowIndex.save`, which is memory-mapped. Loads
+          bundled index by default.
+    """
     # Load index from inside package if not provided
-    path = path or index_data_path()
+    path = str(path or index_data_path())
+    key = (str(Path(path).resolve()), os.stat(path).st_mtime_ns)
+
+    with _index_cache_lock:
+        pr_index = _index_cache.get(key)
+        if pr_index is not None:
+            _index_cache.move_to_end(key)
+            return pr_index
+
+    if has_magic(path, INDEX_MAGIC):
+        pr_index = PathrowIndex.open(path)
+    else:
+        # Use gzip file opener if path ends with .gz
+        file_opener = gzip.open if path.endswith('.gz') else open
+        mode = 'rt' if path.endswith('.gz') else 'r'
 
-    # Use gzip file opener if path ends with .gz
-    file_opener = gzip.open if path.endswith('.gz') else open
-    mode = 'rt' if path.endswith('.gz') else 'r'
+        with file_opener(path, mode) as f:
+            pr_index = PathrowIndex.from_dict(json.load(f))
 
-    with file_opener(path, mode) as f:
-        pr_index = json.load(f)
+    with _index_cache_lock:
+        # Drop versions of the file with a different mtime
+        for cached_key in list(_index_cache):
+            if cached_key[0] == key[0]:
+                del _index_cache[cached_key]
+
+        _index_cache[key] = pr_index
+        while len(_index_cache) > INDEX_CACHE_SIZE:
+            _index_cache.popitem(last=False)
 
     return pr_index
 
 
+def clear_index_cache():
+    """Remove all indexes cached by `load_index_data`
+    """
+    with _index_cache_lock:
+        _index_cache.clear()
+
+
+# Arrays in files written by `save_arrays` start at multiples of this many
+# bytes
+ARRAY_ALIGNMENT = 64
+
+
+def save_arrays(
+        path, magic: bytes, dtypes: Dict[str, str],
+        arrays: Dict[str, np.ndarray], **header):
+    """Write arrays to binary file that `open_arrays` can memory-map
+
+    The file has a magic string, the length of a JSON header as uint64, the
+    header, and then the arrays in order of dtypes, each aligned to
+    `ARRAY_ALIGNMENT` bytes. The header has the given keys and the offset and
+    number of elements of each array. Offsets are relative to the first
+    aligned byte after the header.
+
+    Args:
+        - path: path of new file. Overwrites existing file.
+        - magic: first bytes of file, identifying its format
+        - dtypes: dict of {name: dtype} of arrays to write
+        - arrays: dict of {name: array}
+        - header: values to store in header
+    """
+    arrays = {
+        name: np.ascontiguousarray(arrays[name], dtype=dtype)
+        for name, dtype in dtypes.items()}
+
+    array_offsets = {}
+    offset = 0
+    for name, array in arrays.items():
+        array_offsets[name] = [offset, len(array)]
+        offset = _align(offset + array.nbytes)
+
+    header = json.dumps({**header, 'arrays': array_offsets}).encode()
+    data_offset = _align(len(magic) + 8 + len(header))
+
+    with open(path, 'wb') as f:
+        f.write(magic)
+        f.write(struct.pack('<Q', len(header)))
+        f.write(header)
+        for name, array in arrays.items():
+            f.seek(data_offset + array_offsets[name][0])
+            f.write(array.tobytes())
+
+
+def open_arrays(path, magic: bytes,
+                dtypes: Dict[str, str]) -> Tuple[Dict, Dict[str, np.ndarray]]:
+    """Memory-map file written by `save_arrays`
+
+    Only the header is read. Arrays are views of one read-only memory map,
+    so pages are read from disk when they're first used.
+
+    Args:
+        - path: path to file
+        - magic: expected first bytes of file
+        - dtypes: dict of {name: dtype} of arrays in file
+
+    Returns:
+        tuple of header and dict of {name: array}
+    """
+    with open(path, 'rb') as f:
+        prefix = f.read(len(magic) + 8)
+        if prefix[:len(magic)] != magic:
+            raise ValueError(f'Unexpected file format: {path}')
+
+        header_len, = struct.unpack('<Q', prefix[len(magic):])
+        header = json.loads(f.read(header_len))
+
+    data = np.memmap(path, dtype=np.uint8, mode='r')
+    data_offset = _align(len(magic) + 8 + header_len)
+    arrays = {}
+    for name, dtype in dtypes.items():
+        offset, length = header['arrays'][name]
+        offset += data_offset
+        nbytes = length * np.dtype(dtype).itemsize
+        arrays[name] = data[offset:offset + nbytes].view(dtype)
+
+    return header, arrays
+
+
+def has_magic(path, magic: bytes) -> bool:
+    """Check whether file starts with magic bytes
+    """
+    with open(path, 'rb') as f:
+        return f.read(len(magic)) == magic
+
+
+def _align(offset: int) -> int:
+    return -(-offset // ARRAY_ALIGNMENT) * ARRAY_ALIGNMENT
+
+
 def index_data_path():
     """Find path to bundled pr_index.json.gz
     """
@@ -69,13 +371,35 @@ def _get_season(date, lat=0):
 
 
 def filter_season(features, seasons):
-    return list(
-        filter(
-            lambda x: _get_season(
-                x["properties"]["datetime"], max(x["bbox"][1], x["bbox"][3])) in
-            seasons,
-            features,
-        ))
+    return list(filter_features(features, seasons=seasons))
+
+
+def filter_features(
+        features: Iterable[Dict],
+        seasons: Optional[Sequence[str]] = None,
+        bounds: Optional[List[float]] = None) -> Iterator[Dict]:
+    """Filter STAC features one at a time
+
+    Args:
+        - features: iterable of STAC features
+        - seasons: keep features acquired in one of these seasons
+        - bounds: keep features whose bbox intersects these bounds
+
+    Yields:
+        features matching all filters
+    """
+    for feature in features:
+        if seasons:
+            bbox = feature["bbox"]
+            season = _get_season(
+                feature["properties"]["datetime"], max(bbox[1], bbox[3]))
+            if season not in seasons:
+                continue
+
+        if bounds and not bounds_intersect(feature["bbox"], bounds):
+            continue
+
+        yield feature
 
 
 def bounds_intersect(bounds1: List[float], bounds2: List[float]) -> bool:
@@ -2,8 +2,12 @@ from typing import Dict, List
 
 import geopandas as gpd
 import mercantile
+import numpy as np
 from shapely.geometry import shape
 
+from landsat_cogeo_mosaic.quadkey import pack_quadkeys, pack_tiles, unpack_tiles
+from landsat_cogeo_mosaic.util import pathrow_from_product_id
+
 
 def missing_quadkeys(
         mosaic: Dict,
@@ -30,12 +34,17 @@ def missing_quadkeys(
     # Keep the landmasses that are visible at given zoom
     gdf = gdf[gdf['max_zoom'] <= quadkey_zoom]
 
-    land_tiles = find_child_land_tiles(top_tile, gdf, quadkey_zoom)
-    quadkeys = {mercantile.quadkey(tile) for tile in land_tiles}
+    land_tiles = np.array(
+        find_child_land_tiles(top_tile, gdf, quadkey_zoom),
+        dtype=np.int64).reshape(-1, 3)
 
-    mosaic_quadkeys = set(mosaic['tiles'].keys())
-    not_in_mosaic = quadkeys.difference(mosaic_quadkeys)
-    not_in_mosaic = [mercantile.quadkey_to_tile(qk) for qk in not_in_mosaic]
+    # Compare quadkeys as packed integers
+    land_packed = pack_tiles(*land_tiles.T)
+    mosaic_packed = pack_quadkeys(mosaic['tiles'].keys())
+    x, y, z = unpack_tiles(np.setdiff1d(land_packed, mosaic_packed))
+    not_in_mosaic = [
+        mercantile.Tile(*tile)
+        for tile in zip(x.tolist(), y.tolist(), z.tolist())]
 
     if simplify:
         not_in_mosaic = mercantile.simplify(not_in_mosaic)
@@ -45,6 +54,48 @@ def missing_quadkeys(
     return {'type': 'FeatureCollection', 'features': features}
 
 
+def mosaic_stats(mosaic: Dict) -> Dict:
+    """Compute statistics of assets in mosaic
+
+    Args:
+        - mosaic: mosaic definition
+
+    Returns:
+        dict with number of quadkeys and distinct assets, the max and mean
+        number of assets per quadkey, and the number of quadkeys with more
+        than one asset of the same pathrow and of such extra assets
+    """
+    # Parse each distinct asset once
+    pathrows = {}
+    num_assets = 0
+    max_assets = 0
+    num_duplicate_quadkeys = 0
+    num_duplicate_assets = 0
+    for assets in mosaic['tiles'].values():
+        quadkey_pathrows = set()
+        for asset in assets:
+            pathrow = pathrows.get(asset)
+            if pathrow is None:
+                pathrow = pathrows[asset] = pathrow_from_product_id(asset)
+            quadkey_pathrows.add(pathrow)
+
+        num_assets += len(assets)
+        max_assets = max(max_assets, len(assets))
+        if len(assets) != len(quadkey_pathrows):
+            num_duplicate_quadkeys += 1
+            num_duplicate_assets += len(assets) - len(quadkey_pathrows)
+
+    num_quadkeys = len(mosaic['tiles'])
+    return {
+        'quadkeys': num_quadkeys,
+        'assets': len(pathrows),
+        'max_assets_per_quadkey': max_assets,
+        'mean_assets_per_quadkey': num_assets / num_quadkeys
+        if num_quadkeys else 0,
+        'duplicate_quadkeys': num_duplicate_quadkeys,
+        'duplicate_assets': num_duplicate_assets}
+
+
 def find_child_land_tiles(
         tile: mercantile.Tile, gdf: gpd.GeoDataFrame,
         maxzoom: int) -> List[mercantile.Tile]:
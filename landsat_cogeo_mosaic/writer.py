@@ -0,0 +1,96 @@
+"""
+landsat_cogeo_mosaic.writer: Write MosaicJSON without building the whole document
+"""
+import gzip
+import json
+import sys
+from contextlib import contextmanager
+from typing import BinaryIO, Dict, Iterable, List, Optional, Tuple
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Tiles are written to the output in chunks of about this many bytes
+CHUNK_SIZE = 1 << 16
+
+
+def dumps(obj) -> bytes:
+    """Serialize object to compact JSON
+
+    Uses orjson when it is installed. For strings and lists of ASCII strings,
+    like quadkeys and assets, its output is the same as `json.dumps`.
+    """
+    if orjson is not None:
+        return orjson.dumps(obj)
+
+    return json.dumps(obj, separators=(',', ':')).encode('utf-8')
+
+
+def write_mosaic(
+        f: BinaryIO, header: Dict, tiles: Iterable[Tuple[str, List[str]]]):
+    """Write MosaicJSON to binary file object
+
+    The output is the same as `json.dumps` of the mosaic with compact
+    separators, except that `tiles` is always the last key.
+
+    Args:
+        - f: binary file object
+        - header: fields of mosaic other than tiles
+        - tiles: iterable of (quadkey, assets), e.g. from
+          `StreamingParser.iter_tiles`
+    """
+    # Serialize header with an empty tiles object, and leave it open
+    start = json.dumps({**header, 'tiles': {}}, separators=(',', ':'))
+    f.write(start[:-2].encode('utf-8'))
+
+    chunk = []
+    chunk_size = 0
+    separator = b''
+    for quadkey, assets in tiles:
+        entry = separator + dumps(quadkey) + b':' + dumps(assets)
+        separator = b','
+        chunk.append(entry)
+        chunk_size += len(entry)
+        if chunk_size >= CHUNK_SIZE:
+            f.write(b''.join(chunk))
+            chunk = []
+            chunk_size = 0
+
+    chunk.append(b'}}')
+    f.write(b''.join(chunk))
+
+
+@contextmanager
+def open_output(path: Optional[str] = None):
+    """Open output for writing bytes
+
+    Args:
+        - path: path of file, gzipped if it ends with .gz. Stdout if None or -.
+    """
+    if path is None or path == '-':
+        yield sys.stdout.buffer
+        sys.stdout.buffer.flush()
+        return
+
+    file_opener = gzip.open if str(path).endswith('.gz') else open
+    with file_opener(path, 'wb') as f:
+        yield f
+
+
+def save_mosaic(
+        path: Optional[str], header: Dict,
+        tiles: Iterable[Tuple[str, List[str]]]):
+    """Write MosaicJSON to path
+
+    Args:
+        - path: path of file, gzipped if it ends with .gz. Stdout if None or -,
+          followed by a newline.
+        - header: fields of mosaic other than tiles
+        - tiles: iterable of (quadkey, assets)
+    """
+    with open_output(path) as f:
+        write_mosaic(f, header, tiles)
+        if path is None or path == '-':
+            f.write(b'\n')
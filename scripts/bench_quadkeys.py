@@ -0,0 +1,75 @@
+"""Compare bulk NumPy quadkey conversions against mercantile
+
+Usage: python scripts/bench_quadkeys.py [--zoom 8] [--repeat 5]
+"""
+import argparse
+import timeit
+
+import mercantile
+
+from landsat_cogeo_mosaic.mosaic import quadkeys_to_bounds
+from landsat_cogeo_mosaic.quadkey import (
+    quadkeys_to_tiles, tiles_to_bounds, tiles_to_quadkeys)
+
+
+def mercantile_quadkeys_to_bounds(quadkeys):
+    tile_bounds = [
+        mercantile.bounds(mercantile.quadkey_to_tile(qk)) for qk in quadkeys
+    ]
+
+    minx = 180
+    miny = 90
+    maxx = -180
+    maxy = -90
+    for tb in tile_bounds:
+        minx = min(minx, tb[0])
+        miny = min(miny, tb[1])
+        maxx = max(maxx, tb[2])
+        maxy = max(maxy, tb[3])
+
+    return [minx, miny, maxx, maxy]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--zoom', type=int, default=8)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    quadkeys = [
+        mercantile.quadkey(tile)
+        for tile in mercantile.tiles(-180, -85, 180, 85, args.zoom)]
+    x, y, z = quadkeys_to_tiles(quadkeys)
+    tiles = [mercantile.Tile(*t) for t in zip(x.tolist(), y.tolist(), z)]
+
+    assert quadkeys_to_bounds(quadkeys) == mercantile_quadkeys_to_bounds(
+        quadkeys)
+    assert tiles_to_quadkeys(x, y, z) == quadkeys
+
+    cases = {
+        'quadkey -> tile': (
+            lambda: [mercantile.quadkey_to_tile(qk) for qk in quadkeys],
+            lambda: quadkeys_to_tiles(quadkeys)),
+        'tile -> quadkey': (
+            lambda: [mercantile.quadkey(tile) for tile in tiles],
+            lambda: tiles_to_quadkeys(x, y, z)),
+        'tile -> bounds': (
+            lambda: [mercantile.bounds(tile) for tile in tiles],
+            lambda: tiles_to_bounds(x, y, z)),
+        'quadkeys_to_bounds': (
+            lambda: mercantile_quadkeys_to_bounds(quadkeys),
+            lambda: quadkeys_to_bounds(quadkeys)),
+    }
+
+    print(f'{len(quadkeys)} quadkeys at zoom {args.zoom}')
+    print(f'{"":<20}{"mercantile":>12}{"numpy":>12}{"speedup":>10}')
+    for name, (slow, fast) in cases.items():
+        slow_time = min(timeit.repeat(slow, number=1, repeat=args.repeat))
+        fast_time = min(timeit.repeat(fast, number=1, repeat=args.repeat))
+        print(
+            f'{name:<20}{slow_time * 1000:>10.1f}ms{fast_time * 1000:>10.1f}ms'
+            f'{slow_time / fast_time:>9.1f}x')
+
+
+if __name__ == '__main__':
+    main()
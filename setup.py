@@ -17,7 +17,7 @@ with open('requirements_dev.txt') as test_requirements_file:
 
 setup_requirements = ['setuptools >= 38.6.0', 'twine >= 1.11.0']
 
-extras = ["geopandas", "pandas", "shapely", "keplergl_cli"]
+extras = ["geopandas>=0.10", "pandas", "shapely>=2", "keplergl_cli"]
 extra_reqs = {
     "docs": ["mkdocs", "mkdocs-material"],
     "cli": ["click", *extras],
@@ -0,0 +1,121 @@
+import csv
+import gzip
+import random
+import sqlite3
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import pytest
+
+from landsat_cogeo_mosaic.db import SCENE_LIST_COLUMNS, prepare_db
+
+CSV_IMPORT_SQL = Path(__file__).parents[1] / 'scripts' / 'csv_import.sql'
+
+# Pathrows of scene fixture. Scenes of 026034 are all cloudy, of 026035 all
+# after 2019, and of 026036 all before Landsat 8 reached operational orbit.
+PATHROWS = [
+    '026030', '026031', '026032', '026033', '026034', '026035', '026036',
+    '027030', '027031', '027032']
+
+
+def make_scenes(pathrows=PATHROWS, per_pathrow=12, seed=0):
+    """Create rows of scene_list CSV
+
+    Every scene has a distinct cloud cover and acquisition time, so that no
+    sort preference has ties.
+    """
+    rng = random.Random(seed)
+    clouds = rng.sample(range(10000), len(pathrows) * per_pathrow)
+    start = datetime(2013, 3, 18)
+    scenes = []
+    for pathrow in pathrows:
+        for _ in range(per_pathrow):
+            cloud = clouds.pop() / 100
+            days = rng.uniform(0, 2800)
+            if pathrow == '026034':
+                cloud = 60 + cloud * 0.4
+            elif pathrow == '026035':
+                days = rng.uniform(2200, 2800)
+            elif pathrow == '026036':
+                days = rng.uniform(0, 23)
+
+            date = start + timedelta(days=days)
+            tier = rng.choice(['T1', 'T2', 'RT'])
+            product_id = (
+                f'LC08_L1TP_{pathrow}_{date:%Y%m%d}_{date:%Y%m%d}_01_{tier}')
+            scenes.append({
+                'productId': product_id,
+                'entityId': f'LC8{pathrow}{date:%Y%j}LGN00',
+                'acquisitionDate': f'{date:%Y-%m-%d %H:%M:%S.%f}',
+                'cloudCover': f'{cloud:.2f}',
+                'processingLevel': 'L1TP',
+                'path': str(int(pathrow[:3])),
+                'row': str(int(pathrow[3:])),
+                'min_lat': '40.0',
+                'min_lon': '-100.0',
+                'max_lat': '42.0',
+                'max_lon': '-98.0',
+                'download_url':
+                f'https://example.com/{pathrow}/{product_id}/index.html'})
+
+    rng.shuffle(scenes)
+    return scenes
+
+
+def write_scene_list(path, scenes):
+    """Write scenes as gzipped scene_list CSV
+    """
+    with gzip.open(path, 'wt', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=SCENE_LIST_COLUMNS)
+        writer.writeheader()
+        writer.writerows(scenes)
+
+
+def create_legacy_db(path, scenes):
+    """Create database like `scripts/csv_import.sql`, without acquisition_ts
+    """
+    statements = [
+        line for line in CSV_IMPORT_SQL.read_text().splitlines()
+        if not line.startswith('.')]
+    create_table, rest = '\n'.join(statements).split(';', 1)
+
+    conn = sqlite3.connect(str(path))
+    with conn:
+        conn.execute(create_table)
+        placeholders = ', '.join('?' * len(SCENE_LIST_COLUMNS))
+        conn.executemany(
+            f'INSERT INTO scene_list VALUES ({placeholders})',
+            [[scene[column] for column in SCENE_LIST_COLUMNS]
+             for scene in scenes])
+        conn.executescript(rest)
+    conn.close()
+
+
+@pytest.fixture
+def scenes():
+    return make_scenes()
+
+
+@pytest.fixture(params=['prepare_db', 'legacy'])
+def db_path(request, tmp_path, scenes):
+    """Path to database of scenes, of each schema
+    """
+    path = tmp_path / 'scenes.db'
+    if request.param == 'prepare_db':
+        scene_list_path = tmp_path / 'scene_list.gz'
+        write_scene_list(scene_list_path, scenes)
+        prepare_db(scene_list_path, path)
+    else:
+        create_legacy_db(path, scenes)
+
+    return path
+
+
+@pytest.fixture
+def pr_index():
+    """Index of pathrows to zoom 8 quadkeys, where neighbors share quadkeys
+    """
+    quadkeys = [f'02310{n // 16}{n // 4 % 4}{n % 4}' for n in range(64)]
+    return {
+        pathrow: quadkeys[ind * 2:ind * 2 + 4]
+        for ind, pathrow in enumerate(PATHROWS)}
@@ -0,0 +1,63 @@
+from types import SimpleNamespace
+
+import pytest
+
+from landsat_cogeo_mosaic import cache as cache_module
+from landsat_cogeo_mosaic.cache import ResponseCache, response_key
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = SimpleNamespace(now=1000.0)
+    monkeypatch.setattr(
+        cache_module, 'time', SimpleNamespace(time=lambda: clock.now))
+    return clock
+
+
+def make_data(name):
+    return {'features': [{'id': name, 'properties': {'cloud_cover': 1.5}}]}
+
+
+def test_response_key_depends_on_page():
+    query = {'bbox': [-10, -10, 10, 10], 'limit': 500}
+    key = response_key('http://stac/search', query)
+    assert response_key('http://stac/search', {**query, 'page': 1}) == key
+    assert response_key('http://stac/search', {**query, 'page': 2}) != key
+
+
+def test_cache_hit_and_expiry(tmp_path, clock):
+    with ResponseCache(tmp_path, ttl=60) as cache:
+        assert cache.get('a') is None
+
+        cache.put('a', make_data('a'))
+        clock.now += 59
+        assert cache.get('a') == make_data('a')
+
+        clock.now += 1
+        assert cache.get('a') is None
+
+
+def test_cache_evicts_least_recently_used(tmp_path, clock):
+    with ResponseCache(tmp_path) as cache:
+        cache.put('a', make_data('a'))
+        size = cache.conn.execute('SELECT size FROM responses').fetchone()[0]
+        cache.max_size = int(2.5 * size)
+
+        clock.now += 1
+        cache.put('b', make_data('b'))
+        clock.now += 1
+        assert cache.get('a') == make_data('a')
+
+        clock.now += 1
+        cache.put('c', make_data('c'))
+        assert cache.get('b') is None
+        assert cache.get('a') == make_data('a')
+        assert cache.get('c') == make_data('c')
+
+
+def test_cache_shared_between_connections(tmp_path, clock):
+    with ResponseCache(tmp_path) as cache:
+        cache.put('a', make_data('a'))
+
+    with ResponseCache(tmp_path) as cache:
+        assert cache.get('a') == make_data('a')
@@ -0,0 +1,112 @@
+import numpy as np
+import pytest
+
+from conftest import PATHROWS, write_scene_list
+from landsat_cogeo_mosaic.catalog import (
+    CATALOG_ARRAYS, SceneCatalog, is_catalog_file, load_catalog,
+    prepare_catalog)
+from landsat_cogeo_mosaic.db import SceneDB, parse_stac_feature, prepare_db
+from landsat_cogeo_mosaic.harvest import connect_harvest_db, upsert_scenes
+from landsat_cogeo_mosaic.mosaic import select_assets
+
+
+def make_feature(product_id):
+    pathrow = product_id.split('_')[2]
+    return {
+        'bbox': [-100.0, 40.0, -98.0, 42.0],
+        'properties': {
+            'landsat:product_id': product_id,
+            'datetime': '2020-06-01T17:00:00.123456Z',
+            'eo:cloud_cover': 10.0,
+            'eo:column': int(pathrow[:3]),
+            'eo:row': int(pathrow[3:])}}
+
+
+def insert_scenes(path, product_ids):
+    conn = connect_harvest_db(path)
+    with conn:
+        upsert_scenes(conn, [
+            parse_stac_feature(make_feature(pid)) for pid in product_ids])
+    conn.close()
+
+
+def test_load_catalog_reloads_changed_database(tmp_path):
+    path = tmp_path / 'scenes.db'
+    insert_scenes(path, ['LC08_L1TP_026032_20200601_20200608_01_T1'])
+
+    catalog = load_catalog(path)
+    assert len(catalog) == 1
+    assert load_catalog(path) is catalog
+
+    insert_scenes(path, ['LC08_L1TP_027032_20200601_20200608_01_T1'])
+    assert len(load_catalog(path)) == 2
+
+
+@pytest.mark.parametrize('sort_preference', [
+    'newest', 'oldest', 'min-cloud', 'closest-to-date'])
+@pytest.mark.parametrize('max_cloud', [5, 100])
+def test_select_matches_select_assets(db_path, sort_preference, max_cloud):
+    query_kwargs = {
+        'max_cloud': max_cloud,
+        'min_date': '2013-01-01',
+        'max_date': '2016-06-30',
+        'sort_preference': sort_preference,
+        'closest_to_date': '2016-01-01'}
+
+    with SceneDB(db_path) as db:
+        catalog = SceneCatalog.from_db(db)
+        expected = select_assets(db, pathrows=PATHROWS, **query_kwargs)
+
+    assert catalog.select(PATHROWS, **query_kwargs) == expected
+    assert catalog.select(PATHROWS[:3], **query_kwargs) == {
+        pathrow: expected[pathrow] for pathrow in PATHROWS[:3]}
+
+
+def test_catalog_file_round_trip(tmp_path, db_path):
+    catalog = SceneCatalog.from_db(db_path)
+    path = tmp_path / 'scenes.catalog'
+    catalog.save(path)
+    opened = SceneCatalog.open(path)
+
+    assert is_catalog_file(path)
+    assert not is_catalog_file(db_path)
+    assert opened.tiers == catalog.tiers
+    assert opened.watermark == catalog.watermark
+    for name in [*CATALOG_ARRAYS, 'pathrows', 'pathrow_offsets']:
+        assert isinstance(getattr(opened, name), np.memmap)
+        if name != 'product_id_data':
+            np.testing.assert_array_equal(
+                getattr(opened, name), getattr(catalog, name))
+    assert bytes(opened.product_id_data) == catalog.product_id_data
+    assert [opened.product_id(ind) for ind in range(len(opened))] == [
+        catalog.product_id(ind) for ind in range(len(catalog))]
+
+    query_kwargs = {
+        'max_cloud': 5,
+        'min_date': '2013-01-01',
+        'max_date': '2016-06-30',
+        'sort_preference': 'newest'}
+    assert opened.select(**query_kwargs) == catalog.select(**query_kwargs)
+
+
+def test_prepare_catalog_from_scene_list(tmp_path, scenes):
+    scene_list_path = tmp_path / 'scene_list.gz'
+    write_scene_list(scene_list_path, scenes)
+    path = tmp_path / 'scenes.catalog'
+    prepare_catalog(scene_list_path, path)
+
+    db_path = tmp_path / 'scenes.db'
+    prepare_db(scene_list_path, db_path)
+    catalog = SceneCatalog.from_db(db_path)
+
+    opened = load_catalog(path)
+    assert opened.watermark == catalog.watermark
+    assert bytes(opened.product_id_data) == catalog.product_id_data
+    for name in CATALOG_ARRAYS:
+        if name not in ('tier', 'product_id_data'):
+            np.testing.assert_array_equal(
+                getattr(opened, name), getattr(catalog, name))
+
+    # Tiers are numbered in the order they're first found
+    assert [opened.tiers[tier] for tier in opened.tier] == [
+        catalog.tiers[tier] for tier in catalog.tier]
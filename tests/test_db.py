@@ -0,0 +1,133 @@
+import sqlite3
+from datetime import datetime
+
+import pytest
+
+from conftest import PATHROWS
+from landsat_cogeo_mosaic.constants import LANDSAT8_MIN_DATE
+from landsat_cogeo_mosaic.db import SceneDB, connect
+from landsat_cogeo_mosaic.mosaic import find_asset_for_pathrow, select_assets
+from landsat_cogeo_mosaic.util import coerce_to_datetime
+
+
+def test_connect_reopens_after_write(tmp_path):
+    path = tmp_path / 'scenes.db'
+    conn = sqlite3.connect(str(path))
+    with conn:
+        conn.execute('CREATE TABLE scene_list (productId TEXT)')
+        conn.execute("INSERT INTO scene_list VALUES ('a')")
+
+    db = connect(path)
+    assert connect(path) is db
+    assert next(db.query('SELECT count(*) AS n FROM scene_list')).n == 1
+
+    with conn:
+        conn.executemany(
+            'INSERT INTO scene_list VALUES (?)',
+            [(str(i), ) for i in range(10000)])
+    conn.close()
+
+    assert connect(path) is not db
+    records = connect(path).query('SELECT count(*) AS n FROM scene_list')
+    assert next(records).n == 10001
+
+
+def baseline_query(
+        pathrow,
+        max_cloud=10,
+        min_date=None,
+        max_date=None,
+        sort_preference=None,
+        closest_to_date=None):
+    """Query of the original per-pathrow loop, before bulk and relaxed queries
+    """
+    where_clause = [f"pathrow = '{pathrow}'"]
+    if min_date:
+        min_date = max(coerce_to_datetime(min_date), LANDSAT8_MIN_DATE)
+        min_date = datetime.strftime(min_date, '%Y-%m-%d')
+        where_clause.append(f"DATE(acquisitionDate) >= DATE('{min_date}')")
+    if max_date:
+        where_clause.append(f"DATE(acquisitionDate) <= DATE('{max_date}')")
+    if max_cloud:
+        where_clause.append(f'cloudCover <= {max_cloud}')
+
+    closest_to_date = {
+        'oldest': '1970-01-01',
+        'newest': '2050-01-01'}.get(sort_preference, closest_to_date)
+    if sort_preference == 'min-cloud':
+        order_str = 'cloudCover'
+    else:
+        ts = round(coerce_to_datetime(closest_to_date).timestamp())
+        order_str = (
+            f"abs(strftime('%s', datetime({ts}, 'unixepoch')) "
+            "- strftime('%s', acquisitionDate))")
+
+    return (
+        f"SELECT productId FROM scene_list WHERE {' AND '.join(where_clause)} "
+        f"ORDER BY {order_str}, "
+        "CASE tier WHEN 'T1' THEN 0 WHEN 'T2' THEN 1 WHEN 'RT' THEN 2 END "
+        'LIMIT 1;')
+
+
+def baseline_asset(conn, **kwargs):
+    """Asset of the original loop relaxing parameters until a scene is found
+
+    Returns:
+        tuple of productId and number of times parameters were relaxed, or
+        None if not found
+    """
+    relax_tier = 0
+    while True:
+        record = conn.execute(baseline_query(**kwargs)).fetchone()
+        if record is not None:
+            return record[0], relax_tier
+
+        if (kwargs['max_cloud'] >= 100
+                and kwargs['sort_preference'] == 'closest-to-date'):
+            return None
+
+        relax_tier += 1
+        if kwargs['max_cloud'] < 100:
+            kwargs['max_cloud'] += 5
+            continue
+
+        min_date = coerce_to_datetime(kwargs['min_date'])
+        max_date = coerce_to_datetime(kwargs['max_date'])
+        kwargs.update(
+            min_date=None,
+            max_date=None,
+            closest_to_date=min_date + ((max_date - min_date) / 2),
+            sort_preference='closest-to-date')
+
+
+@pytest.mark.parametrize('sort_preference', [
+    'newest', 'oldest', 'min-cloud', 'closest-to-date'])
+@pytest.mark.parametrize('max_cloud', [5, 30, 100])
+@pytest.mark.parametrize('min_date,max_date', [
+    ('2013-01-01', '2016-06-30'), ('2017-01-01', '2018-12-31')])
+def test_select_assets_matches_relax_loop(
+        db_path, sort_preference, max_cloud, min_date, max_date):
+    query_kwargs = {
+        'max_cloud': max_cloud,
+        'min_date': min_date,
+        'max_date': max_date,
+        'sort_preference': sort_preference,
+        'closest_to_date': '2016-01-01'}
+
+    conn = sqlite3.connect(str(db_path))
+    expected = {
+        pathrow: baseline_asset(conn, pathrow=pathrow, **query_kwargs)
+        for pathrow in PATHROWS}
+    conn.close()
+
+    with SceneDB(db_path) as db:
+        assets = select_assets(db, pathrows=PATHROWS, **query_kwargs)
+        assert assets == {
+            pathrow: asset
+            for pathrow, asset in expected.items() if asset is not None}
+
+        for pathrow in PATHROWS:
+            record = find_asset_for_pathrow(
+                db, pathrow=pathrow, **query_kwargs)
+            asset = record and (record.productId, record.relax_tier)
+            assert asset == expected[pathrow]
@@ -0,0 +1,88 @@
+import sqlite3
+
+from landsat_cogeo_mosaic import harvest as harvest_module
+from landsat_cogeo_mosaic.db import SceneDB, find_updated_pathrows
+from landsat_cogeo_mosaic.db import parse_stac_feature
+from landsat_cogeo_mosaic.harvest import (
+    connect_harvest_db, find_harvest_mark, harvest, upsert_scenes)
+
+
+def make_feature(product_id, cloud_cover=10.0, date='2020-06-01'):
+    pathrow = product_id.split('_')[2]
+    return {
+        'bbox': [-100.0, 40.0, -98.0, 42.0],
+        'properties': {
+            'landsat:product_id': product_id,
+            'landsat:scene_id': 'LC8' + pathrow,
+            'datetime': f'{date}T17:00:00.123456Z',
+            'eo:cloud_cover': cloud_cover,
+            'eo:column': int(pathrow[:3]),
+            'eo:row': int(pathrow[3:])}}
+
+
+def read_scenes(path):
+    conn = sqlite3.connect(str(path))
+    rows = conn.execute(
+        'SELECT rowid, productId, cloudCover FROM scene_list ORDER BY rowid'
+    ).fetchall()
+    conn.close()
+    return rows
+
+
+A = 'LC08_L1TP_026032_20200601_20200608_01_T1'
+B = 'LC08_L1TP_027032_20200601_20200608_01_T1'
+
+
+def test_upsert_changed_newest_scene_gets_new_rowid(tmp_path):
+    path = tmp_path / 'scenes.db'
+    conn = connect_harvest_db(path)
+    with conn:
+        counts = upsert_scenes(
+            conn, [parse_stac_feature(make_feature(pid)) for pid in (A, B)])
+    assert counts == {'inserted': 2, 'updated': 0, 'unchanged': 0}
+    assert read_scenes(path) == [(1, A, 10.0), (2, B, 10.0)]
+
+    with conn:
+        counts = upsert_scenes(
+            conn, [parse_stac_feature(make_feature(B, cloud_cover=20.0))])
+    conn.close()
+    assert counts == {'inserted': 0, 'updated': 1, 'unchanged': 0}
+    assert read_scenes(path) == [(1, A, 10.0), (3, B, 20.0)]
+
+    with SceneDB(path) as db:
+        assert find_updated_pathrows(db, rowid=2) == ['027032']
+
+
+def test_upsert_unchanged_scenes(tmp_path):
+    path = tmp_path / 'scenes.db'
+    scenes = [parse_stac_feature(make_feature(pid)) for pid in (A, B)]
+    conn = connect_harvest_db(path)
+    with conn:
+        upsert_scenes(conn, scenes)
+        counts = upsert_scenes(conn, scenes)
+    conn.close()
+    assert counts == {'inserted': 0, 'updated': 0, 'unchanged': 2}
+    assert read_scenes(path) == [(1, A, 10.0), (2, B, 10.0)]
+
+
+def test_harvest_min_date_overrides_mark(tmp_path, monkeypatch):
+    searches = []
+
+    def search_pages(**kwargs):
+        searches.append(kwargs['min_date'].strftime('%Y-%m-%d'))
+        return iter([[make_feature(A, date='2020-06-01')]])
+
+    monkeypatch.setattr(harvest_module, 'search_pages', search_pages)
+    path = tmp_path / 'scenes.db'
+    bounds = [-100, 40, -98, 42]
+
+    harvest(path, bounds, max_date='2020-12-31')
+    harvest(path, bounds, max_date='2020-12-31')
+    harvest(path, bounds, min_date='2015-01-01', max_date='2020-12-31')
+    assert searches == ['2013-01-01', '2020-06-01', '2015-01-01']
+
+    conn = connect_harvest_db(path)
+    marks = conn.execute('SELECT query_hash FROM harvest_marks').fetchall()
+    assert len(marks) == 1
+    assert find_harvest_mark(conn, 'landsat-8-l1', marks[0][0]) is not None
+    conn.close()
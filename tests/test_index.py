@@ -0,0 +1,138 @@
+import geopandas as gpd
+import mercantile
+import numpy as np
+import pandas as pd
+import pytest
+from shapely import affinity
+from shapely.geometry import MultiPolygon, Polygon, box
+
+from landsat_cogeo_mosaic.cover import cover_geometries
+from landsat_cogeo_mosaic.index import (
+    create_index, create_tiles_gdf, optimize_group)
+from landsat_cogeo_mosaic.quadkey import pack_tiles
+
+WORLD = [-180, -85, 180, 85]
+
+
+@pytest.fixture
+def pathrows():
+    """Overlapping, rotated path-row-like polygons
+
+    Also a concave polygon, a polygon with a hole and a polygon crossing the
+    antimeridian, split into two parts.
+    """
+    pathrows = {}
+    for path in range(3):
+        for row in range(4):
+            polygon = box(-100 + path * 1.6, 40 - row * 1.5,
+                          -97.5 + path * 1.6, 38 - row * 1.5)
+            pathrows[f'{26 + path:03d}{30 + row:03d}'] = affinity.rotate(
+                polygon, -12)
+
+    pathrows['100050'] = Polygon(
+        [(10, 10), (14, 10), (14, 11), (11, 11), (11, 14), (10, 14)])
+    pathrows['100051'] = Polygon(
+        [(20, -30), (24, -30), (24, -26), (20, -26)],
+        [[(21, -29), (23, -29), (23, -27), (21, -27)]])
+    pathrows['100052'] = MultiPolygon([
+        Polygon([(178.5, -16), (180, -16.2), (180, -18.4), (178.1, -18)]),
+        Polygon([(-180, -16.2), (-179.2, -16.3), (-179.6, -18.5),
+                 (-180, -18.4)])])
+
+    return gpd.GeoDataFrame(
+        {'PR': list(pathrows)}, geometry=list(pathrows.values()),
+        crs='EPSG:4326')
+
+
+def test_cover_geometries_matches_sjoin(pathrows):
+    zoom = 8
+    tiles = create_tiles_gdf(WORLD, zoom)
+    joined = gpd.sjoin(pathrows, tiles, predicate='intersects')
+    expected = sorted(zip(
+        pathrows.index.get_indexer(joined.index).tolist(),
+        joined['tile'].tolist()))
+
+    indices, x, y = cover_geometries(
+        pathrows.geometry.to_numpy(), WORLD, zoom, chunk_size=5)
+    tiles = pack_tiles(x, y, np.full(len(x), zoom))
+    assert list(zip(indices.tolist(), tiles.tolist())) == expected
+
+    # Both sides of the antimeridian
+    antimeridian = np.asarray(x)[indices == len(pathrows) - 1]
+    assert antimeridian.min() == 0
+    assert antimeridian.max() == 2**zoom - 1
+
+
+@pytest.mark.parametrize('bounds,zoom', [
+    (WORLD, 0), (WORLD, 3), ([-100.5, 30.2, -90.1, 40.7], 7),
+    ([170, -20, -170, -10], 6)])
+def test_create_tiles_gdf_matches_mercantile(bounds, zoom):
+    tiles = list(mercantile.tiles(*bounds, zoom))
+    gdf = create_tiles_gdf(bounds, zoom)
+
+    assert gdf['quadkey'].tolist() == [mercantile.quadkey(t) for t in tiles]
+    assert gdf['tile'].tolist() == [
+        (t.z << 58) | (t.x << 29) | t.y for t in tiles]
+    np.testing.assert_allclose(
+        gdf.geometry.bounds.to_numpy(),
+        [mercantile.bounds(t) for t in tiles], rtol=0, atol=1e-9)
+    assert gdf.crs == 'EPSG:4326'
+    assert 'quadkey' not in create_tiles_gdf(bounds, zoom, quadkeys=False)
+
+
+def optimize_group_loop(group, quadkey):
+    """Original optimize_group, which intersects every asset in each step
+    """
+    tile = mercantile.quadkey_to_tile(quadkey)
+    tile_geom = box(*mercantile.xy_bounds(tile))
+    final_assets = []
+
+    while True:
+        group['int_pct'] = group.geometry.intersection(
+            tile_geom).area / tile_geom.area
+        group = group.loc[group['int_pct'] > 0]
+        if len(group) == 0:
+            break
+
+        group = group.sort_values('int_pct', ascending=False)
+        top_asset = group.iloc[0]
+        group = group.iloc[1:]
+        final_assets.append(int(top_asset.name))
+
+        tile_geom = tile_geom.difference(top_asset.geometry)
+        if tile_geom.area - 1e-4 < 0 or len(group) == 0:
+            break
+
+    return final_assets
+
+
+@pytest.mark.parametrize('quadkey', [
+    '02311', '023112', '0231121', '0231123', '02311213', '122203', '31113'])
+def test_optimize_group_matches_loop(pathrows, quadkey):
+    group = pathrows.to_crs(epsg=3857).reset_index(drop=True)
+    expected = optimize_group_loop(group.copy(), quadkey)
+    assert expected
+    assert optimize_group(group.geometry.to_numpy(), quadkey) == expected
+
+
+def test_create_index_sharded(tmp_path, pathrows):
+    pathrow_path = tmp_path / 'wrs2.shp'
+    pathrows.to_file(pathrow_path)
+
+    # Pathrow 026033 has no scenes
+    scene_path = tmp_path / 'scenes.csv'
+    scenes = pd.DataFrame({
+        'path': [pr[:3].lstrip('0') for pr in pathrows['PR']],
+        'row': [pr[3:].lstrip('0') for pr in pathrows['PR']]})
+    scenes[pathrows['PR'] != '026033'].to_csv(scene_path, index=False)
+
+    indexes = [
+        create_index(
+            pathrow_path, scene_path, WORLD, 8, shard_zoom=shard_zoom,
+            workers=workers)
+        for shard_zoom, workers in [(0, 1), (5, 1), (5, 2), (8, 2)]]
+
+    assert '026033' not in indexes[0]
+    assert len(indexes[0]) == len(pathrows) - 1
+    for index in indexes[1:]:
+        assert index == indexes[0]
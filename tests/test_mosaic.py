@@ -0,0 +1,177 @@
+import csv
+import io
+import random
+
+import pytest
+
+from conftest import make_scenes, write_scene_list
+from landsat_cogeo_mosaic.db import (
+    SCENE_LIST_COLUMNS, parse_scene_list, prepare_db)
+from landsat_cogeo_mosaic.harvest import connect_harvest_db, upsert_scenes
+from landsat_cogeo_mosaic.mosaic import (
+    CompactStreamingParser, StreamingParser, create_batch_from_db,
+    create_from_db, update_from_db)
+
+SPECS = [
+    {'name': 'newest', 'max_cloud': 5, 'min_date': '2013-01-01',
+     'max_date': '2016-06-30', 'sort_preference': 'newest'},
+    {'name': 'oldest', 'max_cloud': 30, 'min_date': '2017-01-01',
+     'max_date': '2018-12-31', 'sort_preference': 'oldest'},
+    {'name': 'min-cloud', 'max_cloud': 100, 'min_date': '2013-01-01',
+     'max_date': '2016-06-30', 'sort_preference': 'min-cloud'},
+    {'name': 'closest-to-date', 'max_cloud': 5, 'min_date': '2013-01-01',
+     'max_date': '2018-12-31', 'sort_preference': 'closest-to-date',
+     'closest_to_date': '2016-01-01'}]
+
+
+def query_kwargs(spec):
+    return {
+        'max_cloud': spec['max_cloud'],
+        'min_date': spec['min_date'],
+        'max_date': spec['max_date'],
+        'sort_preference': spec['sort_preference'],
+        'closest_to_date': spec.get('closest_to_date')}
+
+
+def sorted_assets(mosaic):
+    """Mosaic with assets of each quadkey sorted
+
+    Assets of `StreamingParser` are in the arbitrary order of a set.
+    """
+    tiles = {
+        quadkey: sorted(assets) for quadkey, assets in mosaic['tiles'].items()}
+    return {**mosaic, 'tiles': tiles}
+
+
+@pytest.mark.parametrize('spec', SPECS, ids=lambda spec: spec['name'])
+def test_create_from_db_workers(db_path, pr_index, spec):
+    mosaics = [
+        create_from_db(
+            db_path, pr_index, min_zoom=7, max_zoom=12, workers=workers,
+            **query_kwargs(spec))
+        for workers in [1, 2]]
+
+    assert mosaics[0]['tiles']
+    assert sorted_assets(mosaics[1]) == sorted_assets(mosaics[0])
+
+
+def test_create_batch_from_db(db_path, pr_index):
+    mosaics = create_batch_from_db(
+        db_path, pr_index, SPECS, min_zoom=7, max_zoom=12)
+
+    assert list(mosaics) == [spec['name'] for spec in SPECS]
+    for spec in SPECS:
+        expected = create_from_db(
+            db_path, pr_index, min_zoom=7, max_zoom=12, **query_kwargs(spec))
+        assert sorted_assets(mosaics[spec['name']]) == sorted_assets(expected)
+
+
+@pytest.mark.parametrize('spec', SPECS, ids=lambda spec: spec['name'])
+def test_update_from_db(tmp_path, pr_index, spec):
+    scenes = make_scenes()
+    scene_list_path = tmp_path / 'scene_list.gz'
+    write_scene_list(scene_list_path, scenes[:60])
+    db_path = tmp_path / 'scenes.db'
+    prepare_db(scene_list_path, db_path)
+
+    mosaic = create_from_db(
+        db_path, pr_index, min_zoom=7, max_zoom=12, **query_kwargs(spec))
+
+    f = io.StringIO()
+    writer = csv.DictWriter(f, fieldnames=SCENE_LIST_COLUMNS)
+    writer.writeheader()
+    writer.writerows(scenes[60:])
+    f.seek(0)
+    conn = connect_harvest_db(db_path)
+    with conn:
+        upsert_scenes(conn, parse_scene_list(f))
+    conn.close()
+
+    updated = update_from_db(db_path, mosaic, pr_index, **query_kwargs(spec))
+    expected = create_from_db(
+        db_path, pr_index, min_zoom=7, max_zoom=12, **query_kwargs(spec))
+
+    assert updated['watermark'] == expected['watermark']
+    assert updated['watermark'] != mosaic['watermark']
+    assert sorted_assets(updated)['tiles'] != sorted_assets(mosaic)['tiles']
+    assert sorted_assets(updated) == sorted_assets(expected)
+
+
+def add_all(parser, combinations):
+    for quadkey, asset in combinations:
+        parser.add(quadkey, asset)
+    return parser
+
+
+def test_compact_parser_matches_streaming_parser():
+    rng = random.Random(0)
+    quadkeys = [
+        ''.join(rng.choice('0123') for _ in range(9)) for _ in range(200)]
+    assets = [
+        f'LC08_L1TP_{rng.randrange(1, 234):03d}{rng.randrange(1, 249):03d}'
+        f'_20200101_20200108_01_T1' for _ in range(50)]
+    combinations = [
+        (rng.choice(quadkeys), rng.choice(assets)) for _ in range(2000)]
+
+    kwargs = {'quadkey_zoom': 9, 'minzoom': 7, 'maxzoom': 12}
+    parser = add_all(StreamingParser(**kwargs), combinations)
+    compact = add_all(CompactStreamingParser(**kwargs), combinations)
+
+    # Quadkeys and their assets are in the order they were first added
+    expected = {}
+    for quadkey, asset in combinations:
+        expected.setdefault(quadkey, dict())[asset] = None
+    assert list(compact.iter_tiles()) == [
+        (quadkey, list(quadkey_assets))
+        for quadkey, quadkey_assets in expected.items()]
+
+    assert compact.tiles == parser.tiles
+    assert compact.header == parser.header
+    assert sorted_assets(compact.mosaic) == sorted_assets(parser.mosaic)
+    assert compact.check_optimized_selection() == (
+        parser.check_optimized_selection())
+
+    # Adding after the mosaic was created
+    add_all(parser, [('0' * 9, assets[0])])
+    add_all(compact, [('0' * 9, assets[0])])
+    assert compact.tiles == parser.tiles
+
+
+@pytest.mark.parametrize('parser_class', [
+    StreamingParser, CompactStreamingParser])
+def test_check_optimized_selection(parser_class):
+    # Quadkey 01 is covered by overlapping pathrows 026030 and 026031, which
+    # isn't a duplicate. Both quadkeys also have two or three scenes of
+    # 026030.
+    combinations = [
+        ('00', 'LC08_L1TP_026030_20200101_20200108_01_T1'),
+        ('01', 'LC08_L1TP_026030_20200101_20200108_01_T1'),
+        ('01', 'LC08_L1TP_026031_20200101_20200108_01_T1'),
+        ('00', 'LC08_L1TP_026030_20200117_20200124_01_T1'),
+        ('00', 'LC08_L1TP_026030_20200101_20200108_01_T1'),
+        ('01', 'LC08_L1TP_026031_20200101_20200108_01_T1'),
+        ('10', 'LC08_L1TP_026031_20200101_20200108_01_T1'),
+        ('01', 'LC08_L1TP_026030_20200117_20200124_01_T1'),
+        ('01', 'LC08_L1TP_026030_20200202_20200209_01_T2')]
+    parser = add_all(parser_class(quadkey_zoom=2), combinations)
+    assert parser.check_optimized_selection() == (2, 3)
+
+    parser = add_all(parser_class(quadkey_zoom=2), combinations[:3])
+    assert parser.check_optimized_selection() == (0, 0)
+
+
+def test_create_from_db_compact(db_path, pr_index):
+    parsers = [
+        create_from_db(
+            db_path, pr_index, min_zoom=7, max_zoom=12, compact=compact,
+            as_parser=True, **query_kwargs(SPECS[0]))
+        for compact in [False, True]]
+
+    # Pathrows of index overlap, but each has one asset
+    assert len(parsers[0].tiles) < sum(map(len, pr_index.values()))
+    assert parsers[1].check_optimized_selection() == (0, 0)
+    assert parsers[0].check_optimized_selection() == (0, 0)
+    assert list(parsers[1].iter_tiles()) == [
+        (quadkey, sorted(assets, key=parsers[1].assets.index))
+        for quadkey, assets in parsers[0].iter_tiles()]
+    assert parsers[1].header == parsers[0].header
@@ -0,0 +1,115 @@
+import random
+
+import geopandas as gpd
+import mercantile
+import pytest
+from shapely.geometry import Point, box
+
+from landsat_cogeo_mosaic.mosaic import quadkeys_to_bounds
+from landsat_cogeo_mosaic.quadkey import (
+    pack_quadkey, pack_quadkeys, quadkeys_to_tiles, tiles_to_bounds,
+    unpack_quadkeys)
+from landsat_cogeo_mosaic.validate import (
+    find_child_land_tiles, missing_quadkeys)
+
+QUADKEYS = ['', '0', '3', '0231', '120210233', '3' * 29, '0123' * 7 + '2']
+
+
+def test_pack_quadkey_matches_pack_quadkeys():
+    assert [pack_quadkey(qk) for qk in QUADKEYS] == pack_quadkeys(
+        QUADKEYS).tolist()
+    assert unpack_quadkeys([pack_quadkey(qk) for qk in QUADKEYS]) == QUADKEYS
+
+
+def test_pack_quadkey_matches_mercantile():
+    for quadkey in QUADKEYS[1:]:
+        tile = mercantile.quadkey_to_tile(quadkey)
+        packed = (tile.z << 58) | (tile.x << 29) | tile.y
+        assert pack_quadkey(quadkey) == packed
+
+
+def test_pack_quadkey_invalid():
+    with pytest.raises(ValueError):
+        pack_quadkey('0124')
+    with pytest.raises(ValueError):
+        pack_quadkey('0' * 30)
+
+
+def random_tiles(rng, zoom, n):
+    return [
+        mercantile.Tile(rng.randrange(2**zoom), rng.randrange(2**zoom), zoom)
+        for _ in range(n)]
+
+
+@pytest.mark.parametrize('zoom', [0, 1, 4, 9, 17, 24, 29])
+def test_tiles_to_bounds_matches_mercantile(zoom):
+    rng = random.Random(zoom)
+    tiles = random_tiles(rng, zoom, 200) + [
+        mercantile.Tile(0, 0, zoom),
+        mercantile.Tile(2**zoom - 1, 2**zoom - 1, zoom)]
+    quadkeys = [mercantile.quadkey(tile) for tile in tiles]
+
+    x, y, z = quadkeys_to_tiles(quadkeys)
+    assert list(zip(x.tolist(), y.tolist(), z.tolist())) == tiles
+
+    bounds = tiles_to_bounds(x, y, z)
+    assert list(zip(*[b.tolist() for b in bounds])) == [
+        tuple(mercantile.bounds(tile)) for tile in tiles]
+
+
+@pytest.mark.parametrize('zooms', [[0], [3], [8], [12], [5, 8, 12], [0, 7]])
+def test_quadkeys_to_bounds_matches_mercantile(zooms):
+    rng = random.Random(sum(zooms))
+    for _ in range(20):
+        tiles = [
+            tile for zoom in zooms
+            for tile in random_tiles(rng, zoom, rng.randrange(1, 30))]
+        all_bounds = [mercantile.bounds(tile) for tile in tiles]
+        expected = [
+            min(b.west for b in all_bounds),
+            min(b.south for b in all_bounds),
+            max(b.east for b in all_bounds),
+            max(b.north for b in all_bounds)]
+
+        quadkeys = [mercantile.quadkey(tile) for tile in tiles]
+        assert quadkeys_to_bounds(quadkeys) == expected
+
+
+@pytest.mark.parametrize('simplify', [False, True])
+def test_missing_quadkeys_matches_quadkey_sets(tmp_path, simplify):
+    land = gpd.GeoDataFrame(
+        {'max_zoom': [2, 2, 7]},
+        geometry=[
+            box(-100, 30, -80, 45), box(10, -30, 30, -10),
+            Point(0, 0).buffer(1)],
+        crs='EPSG:4326')
+    shp_path = tmp_path / 'land.shp'
+    land.to_file(shp_path)
+
+    bounds = [-120, -40, 40, 50]
+    quadkey_zoom = 6
+    land_tiles = find_child_land_tiles(
+        mercantile.bounding_tile(*bounds),
+        land[land['max_zoom'] <= quadkey_zoom], quadkey_zoom)
+    land_quadkeys = {mercantile.quadkey(tile) for tile in land_tiles}
+
+    rng = random.Random(0)
+    mosaic_quadkeys = rng.sample(sorted(land_quadkeys), len(land_tiles) // 2)
+    mosaic = {
+        'minzoom': 7,
+        'quadkey_zoom': quadkey_zoom,
+        'bounds': bounds,
+        'tiles': {
+            quadkey: [] for quadkey in [*mosaic_quadkeys, '0' * quadkey_zoom]}}
+
+    # Set difference of quadkey strings, like before quadkeys were packed
+    expected = [
+        mercantile.quadkey_to_tile(quadkey)
+        for quadkey in land_quadkeys - set(mosaic_quadkeys)]
+    if simplify:
+        expected = mercantile.simplify(expected)
+
+    missing = missing_quadkeys(mosaic, str(shp_path), simplify=simplify)
+    assert len(missing['features']) > 1
+    assert sorted(feature['id'] for feature in missing['features']) == sorted(
+        mercantile.feature(tile)['id'] for tile in expected)
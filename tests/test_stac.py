@@ -0,0 +1,190 @@
+import json
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+from landsat_cogeo_mosaic.stac import (
+    MAX_RESULTS, create_session, iter_sat_api_pages, search_pages)
+
+
+class StacHandler(BaseHTTPRequestHandler):
+    """Serve responses of `server.respond(query)` to STAC API searches
+    """
+    def do_POST(self):
+        length = int(self.headers['Content-Length'])
+        query = json.loads(self.rfile.read(length))
+        with self.server.lock:
+            self.server.queries.append(query)
+
+        status, data = self.server.respond(query)
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stac_server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StacHandler)
+    server.daemon_threads = True
+    server.lock = threading.Lock()
+    server.queries = []
+    server.url = f'http://127.0.0.1:{server.server_address[1]}'
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def make_feature(product_id):
+    return {'id': product_id, 'properties': {'landsat:product_id': product_id}}
+
+
+def page_response(features, query):
+    """Response with the page of features requested by query
+    """
+    limit = query['limit']
+    page = query.get('page', 1)
+    returned = features[(page - 1) * limit:page * limit]
+    meta = {
+        'found': len(features),
+        'limit': limit,
+        'page': page,
+        'returned': len(returned)}
+    return 200, {'meta': meta, 'features': returned}
+
+
+def test_search_pages_paginates_lazily(stac_server):
+    features = [make_feature(f'scene_{i}') for i in range(5)]
+    release = threading.Event()
+
+    def respond(query):
+        # Later pages wait until the first page was yielded
+        if query.get('page', 1) > 1:
+            release.wait(timeout=10)
+        return page_response(features, query)
+
+    stac_server.respond = respond
+    pages = search_pages(
+        [-10, -10, 10, 10],
+        stac_collection_limit=2,
+        stac_url=stac_server.url,
+        session=create_session(retries=0))
+
+    first_page = next(pages)
+    assert not release.is_set()
+    assert first_page == features[:2]
+
+    release.set()
+    rest = list(pages)
+    assert sorted(len(page) for page in rest) == [1, 2]
+    assert sorted(f['id'] for page in [first_page, *rest] for f in page) == [
+        f['id'] for f in features]
+    assert sorted(q.get('page', 1) for q in stac_server.queries) == [1, 2, 3]
+
+
+def test_search_pages_retries_unavailable(stac_server):
+    features = [make_feature('scene_0')]
+
+    def respond(query):
+        if len(stac_server.queries) == 1:
+            return 503, {'message': 'Service Unavailable'}
+        return page_response(features, query)
+
+    stac_server.respond = respond
+    pages = search_pages(
+        [-10, -10, 10, 10],
+        stac_url=stac_server.url,
+        session=create_session(retries=2, backoff_factor=0))
+
+    assert list(pages) == [features]
+    assert len(stac_server.queries) == 2
+
+
+def test_search_pages_raises_after_retries(stac_server):
+    stac_server.respond = lambda query: (503, {'message': 'Unavailable'})
+    pages = search_pages(
+        [-10, -10, 10, 10],
+        stac_url=stac_server.url,
+        session=create_session(retries=2, backoff_factor=0))
+
+    with pytest.raises(requests.exceptions.RetryError):
+        list(pages)
+
+    assert len(stac_server.queries) == 3
+
+
+def test_iter_sat_api_pages_splits_large_queries(stac_server):
+    # (product id, acquisition time, longitude). scene_b is on the edge of
+    # both halves of bbox once it's split.
+    scenes = [
+        ('scene_a', '2020-01-01T12:00:00Z', -10),
+        ('scene_b', '2020-01-01T12:00:00Z', 0),
+        ('scene_c', '2020-01-01T12:00:00Z', 5),
+        ('scene_d', '2020-01-01T12:00:00Z', 15),
+        ('scene_e', '2020-01-02T12:00:00Z', -15),
+        ('scene_f', '2020-01-03T12:00:00Z', 8),
+        ('scene_g', '2020-01-04T12:00:00Z', 18)]
+    active = []
+    max_active = []
+
+    def respond(query):
+        start, end = [
+            datetime.strptime(d, '%Y-%m-%dT%H:%M:%SZ')
+            for d in query['time'].split('/')]
+        minx, _, maxx, _ = query['bbox']
+        features = [
+            make_feature(product_id)
+            for product_id, date, lon in scenes
+            if start <= datetime.strptime(date, '%Y-%m-%dT%H:%M:%SZ') <= end
+            and minx <= lon <= maxx]
+
+        with stac_server.lock:
+            active.append(None)
+            max_active.append(len(active))
+        time.sleep(0.02)
+        with stac_server.lock:
+            active.pop()
+
+        # Pretend that queries finding more than 2 scenes find too many
+        if len(features) > 2:
+            meta = {'found': MAX_RESULTS, 'limit': 1, 'page': 1}
+            return 200, {'meta': meta, 'features': features[:1]}
+        return page_response(features, query)
+
+    stac_server.respond = respond
+    query = {
+        'bbox': [-20, -10, 20, 10],
+        'time': '2020-01-01T00:00:00Z/2020-01-04T23:59:59Z',
+        'limit': 1}
+    pages = iter_sat_api_pages(
+        query,
+        stac_url=stac_server.url,
+        session=create_session(retries=0, pool_maxsize=2),
+        concurrency=2)
+
+    product_ids = [f['id'] for page in pages for f in page]
+    assert sorted(product_ids) == [scene[0] for scene in scenes]
+    assert max(max_active) <= 2
+
+    # Time is split before bbox, and bbox only once within a day
+    times = {q['time'] for q in stac_server.queries}
+    bbox_queries = [
+        q for q in stac_server.queries if q['bbox'] != query['bbox']]
+    assert len(times) > 1
+    assert bbox_queries
+    for q in bbox_queries:
+        start, end = q['time'].split('/')
+        assert start[:10] == end[:10] == '2020-01-01'
+    assert [-20, -10, 0.0, 10] in [q['bbox'] for q in bbox_queries]
+    assert [0.0, -10, 20, 10] in [q['bbox'] for q in bbox_queries]
@@ -0,0 +1,77 @@
+import gzip
+import json
+
+import numpy as np
+import pytest
+
+from landsat_cogeo_mosaic.util import (
+    ARRAY_ALIGNMENT, INDEX_MAGIC, PathrowIndex, clear_index_cache, has_magic,
+    load_index_data, open_arrays, save_arrays)
+
+MAGIC = b'TEST\x00\x00\x00\x01'
+
+DTYPES = {
+    'a': '<i4',
+    'empty': '<f8',
+    'b': '<u8',
+    'c': '<f4',
+}
+
+
+def test_save_arrays_round_trip(tmp_path):
+    path = tmp_path / 'arrays.bin'
+    arrays = {
+        'a': np.arange(-5, 12, dtype=np.int32),
+        'empty': np.zeros(0),
+        'b': np.array([0, 1, 2**63 + 5], dtype=np.uint64),
+        'c': np.linspace(0, 1, 7, dtype=np.float32)}
+    save_arrays(path, MAGIC, DTYPES, arrays, name='test', values=[1, 2])
+
+    assert has_magic(path, MAGIC)
+    header, opened = open_arrays(path, MAGIC, DTYPES)
+    assert header['name'] == 'test'
+    assert header['values'] == [1, 2]
+    assert list(opened) == list(DTYPES)
+    for name, dtype in DTYPES.items():
+        assert opened[name].dtype == np.dtype(dtype)
+        np.testing.assert_array_equal(opened[name], arrays[name])
+        assert opened[name].ctypes.data % ARRAY_ALIGNMENT == 0
+        assert not opened[name].flags.writeable
+
+
+def test_open_arrays_rejects_other_format(tmp_path):
+    path = tmp_path / 'arrays.bin'
+    save_arrays(path, MAGIC, {'a': '<i4'}, {'a': np.arange(3)})
+    other_path = tmp_path / 'other.json'
+    other_path.write_text('{"a": [0, 1, 2]}')
+
+    assert not has_magic(path, INDEX_MAGIC)
+    assert not has_magic(other_path, MAGIC)
+    with pytest.raises(ValueError):
+        open_arrays(path, INDEX_MAGIC, {'a': '<i4'})
+    with pytest.raises(ValueError):
+        open_arrays(other_path, MAGIC, {'a': '<i4'})
+
+
+def test_pathrow_index_round_trip(tmp_path, pr_index):
+    index = PathrowIndex.from_dict(pr_index)
+    path = tmp_path / 'pr_index.bin'
+    index.save(path)
+    opened = PathrowIndex.open(path)
+
+    assert has_magic(path, INDEX_MAGIC)
+    assert isinstance(opened.tiles, np.memmap)
+    assert opened.quadkey_zoom == index.quadkey_zoom == 8
+    assert list(opened) == list(index) == list(pr_index)
+    for pathrow, quadkeys in pr_index.items():
+        assert opened[pathrow] == index[pathrow] == tuple(quadkeys)
+        assert opened.tiles_of(pathrow) == index.tiles_of(pathrow)
+
+    json_path = tmp_path / 'pr_index.json.gz'
+    with gzip.open(json_path, 'wt') as f:
+        json.dump(pr_index, f)
+
+    clear_index_cache()
+    assert dict(load_index_data(path)) == dict(load_index_data(json_path))
+    assert isinstance(load_index_data(path).tiles, np.memmap)
+    clear_index_cache()
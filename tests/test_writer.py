@@ -0,0 +1,54 @@
+import gzip
+import io
+import json
+
+import pytest
+
+from landsat_cogeo_mosaic import writer
+from landsat_cogeo_mosaic.mosaic import StreamingParser
+from landsat_cogeo_mosaic.writer import save_mosaic, write_mosaic
+
+
+@pytest.fixture(params=['orjson', 'json'])
+def json_library(request, monkeypatch):
+    if request.param == 'orjson':
+        pytest.importorskip('orjson')
+    else:
+        monkeypatch.setattr(writer, 'orjson', None)
+    return request.param
+
+
+@pytest.fixture
+def parser():
+    parser = StreamingParser(quadkey_zoom=8, minzoom=7, maxzoom=12)
+    for ind in range(3000):
+        quadkey = f'{ind % 4}{ind // 4 % 4}{ind // 16 % 4}{ind // 64 % 4}0123'
+        parser.add(quadkey, f'LC08_L1TP_0{ind % 7}0030_20200101_01_T1')
+    parser.extra['watermark'] = {'rowid': 3, 'acquisition_date': '2020-01-01'}
+    return parser
+
+
+def test_write_mosaic_matches_json(json_library, parser, monkeypatch):
+    # Write in several chunks
+    monkeypatch.setattr(writer, 'CHUNK_SIZE', 1000)
+    f = io.BytesIO()
+    write_mosaic(f, parser.header, parser.iter_tiles())
+
+    mosaic = parser.mosaic
+    assert len(mosaic['tiles']) == 256
+    assert f.getvalue() == json.dumps(mosaic, separators=(',', ':')).encode()
+    assert json.loads(f.getvalue()) == json.loads(json.dumps(mosaic))
+
+
+def test_write_mosaic_empty(json_library):
+    f = io.BytesIO()
+    write_mosaic(f, {'minzoom': 7}, [])
+    assert json.loads(f.getvalue()) == {'minzoom': 7, 'tiles': {}}
+
+
+def test_save_mosaic_gzip(json_library, parser, tmp_path):
+    path = tmp_path / 'mosaic.json.gz'
+    save_mosaic(str(path), parser.header, parser.iter_tiles())
+
+    with gzip.open(path, 'rt') as f:
+        assert json.load(f) == json.loads(json.dumps(parser.mosaic))